@@ -0,0 +1,102 @@
+# file: ann_benchmark.py
+"""
+Recall / latency benchmark for the index types supported by faiss_store.
+Runs on a synthetic clustered corpus so we can pick an operating point for a given data size:
+
+    python cv_search.py bench --n 200000 --dim 384 --types flat,ivf,ivfpq,hnsw
+"""
+import argparse
+import json
+import time
+
+import faiss
+import numpy as np
+
+from faiss_store import build_index, search_params
+
+# Search-time knob values swept per index type
+SWEEPS = {
+    "flat": [None],
+    "ivf": [1, 4, 16, 64],
+    "ivfpq": [1, 4, 16, 64],
+    "hnsw": [16, 32, 64, 128],
+}
+
+
+def synthetic_corpus(n: int, dim: int, nq: int, seed: int = 0):
+    """Unit vectors around a few hundred topic centres, roughly like CV embeddings."""
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(max(8, n // 500), dim)).astype("float32")
+
+    def sample(count):
+        x = centres[rng.integers(len(centres), size=count)]
+        x = x + 0.6 * rng.normal(size=(count, dim)).astype("float32")
+        return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+    return np.ascontiguousarray(sample(n)), np.ascontiguousarray(sample(nq))
+
+
+def recall_at_k(found: np.ndarray, truth: np.ndarray) -> float:
+    k = truth.shape[1]
+    hits = sum(len(np.intersect1d(f, t)) for f, t in zip(found, truth))
+    return hits / (k * len(truth))
+
+
+def run(n: int = 100_000, dim: int = 384, nq: int = 1000, k: int = 10,
+        types=("flat", "ivf", "ivfpq", "hnsw")) -> list:
+    xb, xq = synthetic_corpus(n, dim, nq)
+    ids = np.arange(n, dtype="int64")
+
+    # Ground truth from exact search
+    exact = faiss.IndexFlatL2(dim)
+    exact.add(xb)
+    _, truth = exact.search(xq, k)
+
+    rows = []
+    for index_type in types:
+        started = time.perf_counter()
+        index = build_index(xb, ids, index_type)
+        build_s = time.perf_counter() - started
+        memory_mb = len(faiss.serialize_index(index)) / 2 ** 20
+
+        for knob in SWEEPS[index_type]:
+            params = search_params(index, nprobe=knob, ef_search=knob)
+            started = time.perf_counter()
+            _, found = index.search(xq, k, params=params) if params else index.search(xq, k)
+            elapsed = time.perf_counter() - started
+            rows.append({
+                "index_type": index_type,
+                "knob": None if knob is None else ("efSearch" if index_type == "hnsw" else "nprobe"),
+                "value": knob,
+                f"recall@{k}": round(recall_at_k(found, truth), 4),
+                "qps": round(nq / elapsed, 1),
+                "build_s": round(build_s, 2),
+                "memory_mb": round(memory_mb, 1),
+            })
+    return rows
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--n", type=int, default=100_000, help="corpus size")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--nq", type=int, default=1000, help="number of queries")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--types", default="flat,ivf,ivfpq,hnsw")
+    parser.add_argument("--json", help="also write the results to this file")
+
+
+def main(args):
+    rows = run(args.n, args.dim, args.nq, args.k, [t.strip() for t in args.types.split(",")])
+    header = list(rows[0].keys())
+    print(" | ".join(f"{h:>10}" for h in header))
+    for row in rows:
+        print(" | ".join(f"{str(row[h]):>10}" for h in header))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    add_arguments(parser)
+    main(parser.parse_args())
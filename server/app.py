@@ -1,27 +1,93 @@
 # app.py
 
 import uvicorn
+import json
+import logging
 import os
-import uuid
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from typing import Dict
+import time
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from typing import List, Literal, Optional
 from fastapi.middleware.cors import CORSMiddleware
 # Assuming your chat_rag.py is in the same directory
-from chat_rag import ask, InMemoryChatMessageHistory # Import the ask function and history classes
+import threading
+# Importing chat_rag is cheap: its Vertex AI clients are only built on first use or /warmup
+from chat_rag import (HISTORY_COMPACTION, aask, aask_stream, candidate_text, config, get_embedding_cache,
+                      get_history_compactor, in_thread, is_ready, limits, llm_flights, results, retrieval_cache,
+                      retrieval_flights, warmup)
+from session_store import SqliteSessionStore, create_session_store
+from attribute_index import AttributeFilter
+from response_format import compact_card, decode_cursor, paginate
+from ranking_job import RankingJobs, parse_jds
+from upload_queue import QueueFull, UploadQueue, UploadWorker, multipart_boundary, receive_uploads
+import metrics
 
-# A dictionary to store chat histories keyed by a unique session ID
-chat_histories: Dict[str, InMemoryChatMessageHistory] = {}
+try:
+    # Serializes dicts straight to bytes, skipping FastAPI's jsonable_encoder pass
+    from fastapi.responses import ORJSONResponse as FastJSONResponse
+    import orjson  # noqa: F401
+except ImportError:
+    FastJSONResponse = JSONResponse
+
+# Debug output of chat_rag etc. goes through logging; set "LOG_LEVEL": "DEBUG" in config.json to see it
+logging.basicConfig(level=getattr(config, "LOG_LEVEL", "WARNING"),
+                    format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logger = logging.getLogger("app")
+
+# Upper bound on queries per /search/batch request
+MAX_BATCH_QUERIES = 1000
+# Responses smaller than this aren't worth compressing
+COMPRESS_MIN_BYTES = getattr(config, "COMPRESS_MIN_BYTES", 1000)
+
+# Bulk JD ranking jobs over the FAISS chunk corpus, queued in SQLite (see ranking_job.py)
+ranking_jobs = RankingJobs.from_config(config)
+
+# Uploaded CVs wait here until the upload worker has ingested them (see upload_queue.py)
+uploads = UploadQueue.from_config(config)
+UPLOAD_DIR = getattr(config, "UPLOAD_DIR", "uploads")
+UPLOAD_MAX_BYTES = getattr(config, "UPLOAD_MAX_BYTES", 10 * 1024 * 1024)
+UPLOAD_MAX_FILES = getattr(config, "UPLOAD_MAX_FILES", 100)
+upload_worker = None
+
+# Chat histories keyed by a unique session ID (bounded; memory or SQLite backend, see session_store.py)
+sessions = create_session_store(config)
 
 # Define Pydantic models for the request and response bodies
+class CandidateFilters(BaseModel):
+    min_years: Optional[float] = None
+    min_degree: Optional[Literal["associate", "bachelor", "master", "phd"]] = None
+    location: Optional[str] = None
+    skills: List[str] = []
+
 class Query(BaseModel):
     session_id: str
     question: str
+    mode: Optional[Literal["vector", "lexical", "hybrid"]] = None  # retrieval mode; server default if unset
+    filters: Optional[CandidateFilters] = None  # hard constraints; else parsed from the question (ATTRIBUTE_FILTERS)
+    compact: bool = False  # drop constant/empty card fields, send each snippet once
+    page_size: Optional[int] = Field(None, ge=1)  # cards per page; the rest via /candidates?cursor=
 
 class SessionResponse(BaseModel):
     session_id: str
     message: str
 
+class BatchSearchQuery(BaseModel):
+    queries: List[str]
+    top_k: int = 2
+    mode: Literal["vector", "lexical", "hybrid"] = "vector"
+    filters: Optional[CandidateFilters] = None
+
+class JobDescription(BaseModel):
+    id: Optional[str] = None
+    text: str
+    filters: Optional[CandidateFilters] = None  # hard constraints for this JD
+
+class RankQuery(BaseModel):
+    jds: List[JobDescription]
+    top_k: Optional[int] = Field(1000, ge=1)  # CVs listed per JD; null lists every CV that passes the filters
+    format: Literal["csv", "parquet"] = "csv"
+
 # Initialize the FastAPI application
 app = FastAPI(
     title="RAG Chatbot API",
@@ -40,19 +106,106 @@ app.add_middleware(
     expose_headers=["*"] # This can help with more complex scenarios
 )
 
+# Brotli if brotli-asgi is installed, else gzip; both fall back to identity for clients that ask for it
+try:
+    from brotli_asgi import BrotliMiddleware
+    app.add_middleware(BrotliMiddleware, minimum_size=COMPRESS_MIN_BYTES, gzip_fallback=True)
+except ImportError:
+    from fastapi.middleware.gzip import GZipMiddleware
+    app.add_middleware(GZipMiddleware, minimum_size=COMPRESS_MIN_BYTES)
+
+# Request latency and status per route template (so IDs in paths don't explode the label set)
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        path = route.path if route is not None else "unmatched"
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - started, route=path)
+        metrics.REQUESTS.inc(route=path, status=str(status))
+
+# Counters that already live in the caches / session store, read on every scrape
+metrics.register_collector("hirepal_sessions", "gauge", "Live chat sessions.", "",
+                           lambda: {"": sessions.stats()["sessions"]},
+                           per_process=not isinstance(sessions, SqliteSessionStore))  # SQLite counts every worker's
+metrics.register_collector("hirepal_sessions_total", "counter", "Sessions by lifecycle event.", "event",
+                           lambda: {k: v for k, v in sessions.stats().items() if k in ("created", "evicted", "expired")})
+metrics.register_collector("hirepal_retrieval_cache_total", "counter", "Semantic retrieval cache lookups.", "result",
+                           lambda: {k: v for k, v in retrieval_cache.stats().items() if k in ("hits", "misses")})
+metrics.register_collector("hirepal_embedding_cache_total", "counter", "Embedding cache lookups.", "result",
+                           lambda: {k: v for k, v in get_embedding_cache().stats().items() if k in ("hits", "misses")})
+metrics.register_collector("hirepal_upstream_slots_available", "gauge", "Free concurrency slots per upstream.",
+                           "upstream", lambda: {name: s["available"] for name, s in limits.stats().items()})
+
 # A simple health check endpoint
 @app.get("/")
 def read_root():
     return {"message": "RAG Chatbot is running!"}
 
+@app.on_event("startup")
+def warm_in_background():
+    # Under serve.py every worker process publishes its metrics for the others to add up
+    if getattr(config, "METRICS_MULTIPROCESS_DIR", None):
+        metrics.enable_multiprocess(config.METRICS_MULTIPROCESS_DIR)
+    # Queued ranking jobs run in whichever worker process claims them first
+    ranking_jobs.start()
+    # Uploads are ingested by `python upload_queue.py` (or serve.py's child worker);
+    # "thread" runs the worker in this process, for development
+    global upload_worker
+    if getattr(config, "UPLOAD_WORKER", "external") == "thread":
+        upload_worker = UploadWorker.from_config(config, uploads)
+        upload_worker.start()
+    # Build the clients off the request path; /ready reports when they are done
+    if getattr(config, "WARMUP_ON_STARTUP", True):
+        threading.Thread(target=warmup, daemon=True).start()
+
+@app.on_event("shutdown")
+def stop_upload_worker():
+    if upload_worker is not None:
+        upload_worker.stop()
+
+@app.post("/warmup")
+def warmup_clients():
+    """Builds every client now (idempotent) and returns the seconds spent on each."""
+    return {"ready": True, "timings": warmup()}
+
+@app.get("/ready")
+def readiness():
+    """Readiness probe: 200 once all clients are built, 503 before that."""
+    if not is_ready():
+        raise HTTPException(status_code=503, detail="Warming up.")
+    return {"ready": True}
+
+@app.get("/stats")
+def get_stats():
+    """Cache, coalescing and session counters: hit rates, latency saved, session memory and evictions."""
+    return {
+        "embedding_cache": get_embedding_cache().stats(),
+        "retrieval_cache": retrieval_cache.stats(),
+        "singleflight": {"retrieve": retrieval_flights.stats(), "llm": llm_flights.stats()},
+        "sessions": sessions.stats(),
+        "history_compaction": get_history_compactor().stats() if HISTORY_COMPACTION else None,
+        "uploads": uploads.stats(),
+        "ranking_jobs": ranking_jobs.stats(),
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Prometheus scrape endpoint: per-stage latency histograms plus request, error, cache and session counters."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/new_session", response_model=SessionResponse)
 def get_new_session():
     """
     Creates a new chat session and returns its ID.
     This ID should be used for subsequent requests to maintain conversation history.
     """
-    session_id = str(uuid.uuid4())
-    chat_histories[session_id] = InMemoryChatMessageHistory()
+    session_id = sessions.create()
     return {"session_id": session_id, "message": "New session created."}
 
 # Endpoint to handle user queries with history
@@ -60,26 +213,187 @@ def get_new_session():
 # ... (keep previous code)
 
 @app.post("/ask")
-def chat_with_bot_with_history(query: Query):
+async def chat_with_bot_with_history(query: Query):
     """
     Sends a question to the RAG chatbot and returns the response, maintaining history.
+    Awaits the Gemini call on the event loop; embedding, Vector Search and the session/result
+    stores (SQLite under serve.py) run on executor threads.
+    With `compact` and/or `page_size` the candidates come back compacted and/or paged
+    (`next_cursor` for /candidates); without them the response is unchanged.
     """
     session_id = query.session_id
     question = query.question
 
-    if session_id not in chat_histories:
+    session_history = await in_thread(sessions.get, session_id)
+    if session_history is None:
         raise HTTPException(status_code=404, detail="Session not found.")
 
-    session_history = chat_histories[session_id]
-
     try:
         # Call the ask function, which now returns a dict
-        response_data = ask(question, session_history) # This is now a dictionary
-        return response_data # Return the dict directly, FastAPI will convert to JSON
+        filters = AttributeFilter.from_dict(query.filters.dict()) if query.filters else None
+        response_data = await aask(question, session_history, query.mode, filters) # This is now a dictionary
+        await in_thread(sessions.save, session_id, session_history)
+        if HISTORY_COMPACTION:
+            get_history_compactor().schedule(session_id, sessions, session_history)
+        if response_data["type"] == "candidates" and (query.compact or query.page_size):
+            cards = response_data["content"]
+            if query.compact:
+                cards = [compact_card(card) for card in cards]
+            result_id = (await in_thread(results.put, cards, query.compact)
+                         if query.page_size and len(cards) > query.page_size else None)
+            response_data.update(paginate(cards, query.compact, 0, query.page_size, result_id))
+        return FastJSONResponse(response_data)
     except Exception as e:
+        metrics.ERRORS.inc(where="ask")
+        logger.exception("/ask failed")
         # Return a structured error as well
         return {"type": "error", "content": f"An error occurred: {str(e)}"}
     
+@app.post("/ask/stream")
+async def chat_with_bot_streamed(query: Query):
+    """
+    Like /ask, but streams NDJSON (one JSON object per line): the candidate cards right
+    after retrieval, then the LLM summary as {"type": "token"} lines, then {"type": "done"}.
+    The session is saved once the answer is complete. `compact` applies to the cards;
+    `page_size` is ignored here since the cards arrive before the summary anyway.
+    """
+    session_id = query.session_id
+    session_history = await in_thread(sessions.get, session_id)
+    if session_history is None:
+        raise HTTPException(status_code=404, detail="Session not found.")
+    filters = AttributeFilter.from_dict(query.filters.dict()) if query.filters else None
+
+    async def lines():
+        try:
+            async for event in aask_stream(query.question, session_history, query.mode, filters):
+                if event["type"] == "candidates" and query.compact:
+                    event.update(paginate([compact_card(c) for c in event["content"]], True, 0, None, None))
+                elif event["type"] == "done":
+                    await in_thread(sessions.save, session_id, session_history)
+                    if HISTORY_COMPACTION:
+                        get_history_compactor().schedule(session_id, sessions, session_history)
+                yield json.dumps(event) + "\n"
+        except Exception as e:
+            metrics.ERRORS.inc(where="ask_stream")
+            logger.exception("/ask/stream failed")
+            yield json.dumps({"type": "error", "content": f"An error occurred: {str(e)}"}) + "\n"
+
+    # Content-Encoding keeps the compression middleware from buffering the lines
+    return StreamingResponse(lines(), media_type="application/x-ndjson",
+                             headers={"Content-Encoding": "identity", "Cache-Control": "no-cache",
+                                      "X-Accel-Buffering": "no"})
+
+@app.get("/candidates")
+def next_candidates(cursor: str, page_size: int = 10):
+    """The next page of an /ask result; 410 once it has expired (ask again)."""
+    try:
+        result_id, offset = decode_cursor(cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Malformed cursor.")
+    entry = results.get(result_id)
+    if entry is None:
+        raise HTTPException(status_code=410, detail="Result expired, ask again.")
+    cards, compact = entry
+    return FastJSONResponse(paginate(cards, compact, offset, max(1, page_size), result_id))
+
+@app.get("/candidates/{candidate_id}")
+def get_candidate(candidate_id: str):
+    """Full CV text of a candidate, for cards that only carry a snippet."""
+    text = candidate_text(candidate_id)
+    if text is None:
+        raise HTTPException(status_code=404, detail="Candidate not found.")
+    return FastJSONResponse({"id": candidate_id, "text": text})
+
+@app.post("/search/batch")
+def search_batch(body: BatchSearchQuery):
+    """
+    Runs many local CV searches at once (e.g. one per requisition).
+    All queries are encoded in one batch and searched with a single index call.
+    """
+    import cv_search  # local FAISS search; loaded on first use to keep startup fast
+    if len(body.queries) > MAX_BATCH_QUERIES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_QUERIES} queries per request.")
+    filters = AttributeFilter.from_dict(body.filters.dict()) if body.filters else None
+    results = cv_search.search_many(body.queries, top_k=body.top_k, mode=body.mode, filters=filters)
+    return {"results": [{"query": q, "matches": r} for q, r in zip(body.queries, results)]}
+
+@app.post("/rank", status_code=202)
+def start_ranking(body: RankQuery):
+    """
+    Starts ranking every CV of the chunk corpus /ask searches (ingested and uploaded CVs) against
+    the given job descriptions in the background; poll GET /rank/{job_id} and download the
+    CSV/Parquet from /rank/{job_id}/result. Needs VECTOR_BACKEND "faiss" (501 otherwise).
+    """
+    if not body.jds:
+        raise HTTPException(status_code=400, detail="No job descriptions given.")
+    jds = parse_jds([jd.dict(exclude_none=True) for jd in body.jds])
+    try:
+        job_id = ranking_jobs.submit(jds, body.top_k, body.format)
+    except ValueError as e:
+        raise HTTPException(status_code=501, detail=str(e))
+    return {"job_id": job_id, "status": ranking_jobs.status(job_id)}
+
+@app.get("/rank/{job_id}")
+def ranking_status(job_id: str):
+    """State (queued, running, done, failed) and progress in shards of a ranking job."""
+    status = ranking_jobs.status(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return {"job_id": job_id, "status": status}
+
+@app.get("/rank/{job_id}/result")
+def ranking_result(job_id: str):
+    """The ranked CVs per JD (jd_id, rank, cv_id, name, score) once the job is done."""
+    status = ranking_jobs.status(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    if status["state"] != "done":
+        raise HTTPException(status_code=409, detail=f"Job is {status['state']}.")
+    return FileResponse(status["result"], filename=os.path.basename(status["result"]))
+
+@app.post("/cvs", status_code=202)
+async def upload_cvs(request: Request):
+    """
+    Streams the uploaded PDF CVs (multipart/form-data) to disk and queues them for ingestion;
+    poll GET /cvs/{upload_id}. Answers 429 (with Retry-After) while the ingestion queue is full.
+    """
+    boundary = multipart_boundary(request.headers.get("content-type", ""))
+    if boundary is None:
+        raise HTTPException(status_code=400, detail="Expected a multipart/form-data body.")
+    # Check for room before reading the body
+    try:
+        await in_thread(uploads.check_room, 1)
+    except QueueFull as e:
+        return JSONResponse({"detail": str(e)}, status_code=429,
+                            headers={"Retry-After": str(getattr(config, "UPLOAD_RETRY_AFTER", 30))})
+    length = request.headers.get("content-length")
+    if length and length.isdigit() and int(length) > UPLOAD_MAX_BYTES * UPLOAD_MAX_FILES:
+        raise HTTPException(status_code=413, detail="Request body is too large.")
+    try:
+        stored = await receive_uploads(request.stream(), boundary, UPLOAD_DIR, UPLOAD_MAX_BYTES, UPLOAD_MAX_FILES)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not stored:
+        raise HTTPException(status_code=400, detail="No files in the request.")
+    accepted = []
+    for f in stored:
+        if "error" not in f:
+            try:
+                accepted.append(await in_thread(uploads.enqueue, f["filename"], f["path"], f["content_hash"]))
+                continue
+            except QueueFull as e:
+                f = dict(f, error=str(e))   # the queue filled up during this request
+        accepted.append({"upload_id": None, "filename": f["filename"], "state": "rejected", "error": f["error"]})
+    return {"uploads": accepted}
+
+@app.get("/cvs/{upload_id}")
+def upload_status(upload_id: str):
+    """State (queued, processing, done, failed) of an uploaded CV and how many chunks it gave."""
+    status = uploads.status(upload_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Upload not found.")
+    return status
+
 if __name__ == "__main__":
     # Get the port from an environment variable, default to 8000
     port = int(os.environ.get("PORT", 8000))
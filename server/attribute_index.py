@@ -0,0 +1,426 @@
+# file: attribute_index.py
+import json
+import math
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from bm25_index import reciprocal_rank_fusion
+from skill_extractor import canonical_skill, extract_skills, get_matcher
+
+# Degree levels; a filter on a level also accepts every higher one
+DEGREE_LEVELS = {"associate": 1, "bachelor": 2, "master": 3, "phd": 4}
+_DEGREES = [
+    (4, re.compile(r"\b(?:ph\.?\s?d|doctorate|doctor of philosophy|d\.?phil)\b", re.I)),
+    # "master" alone would also match "Scrum Master"
+    (3, re.compile(r"\b(?:master'?s|master of|master degree|m\.?sc|m\.s\.|m\.eng|meng|mba|m\.a\.)(?![a-z])", re.I)),
+    (2, re.compile(r"\b(?:bachelor'?s?|b\.?sc|b\.s\.|b\.eng|beng|b\.?tech|b\.a\.|undergraduate degree)(?![a-z])", re.I)),
+    (1, re.compile(r"\b(?:associate'?s? degree|diploma)\b", re.I)),
+]
+
+_YEARS = re.compile(r"(\d{1,2}(?:\.\d)?)\s*\+?\s*(?:years?|yrs?)\b", re.I)
+_DATE_RANGE = re.compile(r"\b((?:19|20)\d{2})\s*(?:-|–|—|to|until)\s*((?:19|20)\d{2}|present|current|now|today)\b", re.I)
+# Minimums stated in a question: "at least 5 years", "5+ years", "3-5 years", "5 years of experience"
+_MIN_YEARS = re.compile(
+    r"\b(?:at\s+least|minimum(?:\s+of)?|min\.?|over|more\s+than|upwards\s+of)\s+(\d{1,2}(?:\.\d)?)\s*\+?\s*(?:years?|yrs?)\b"
+    r"|\b(\d{1,2}(?:\.\d)?)\s*(?:\+|or\s+more|plus)\s*(?:years?|yrs?)\b"
+    r"|\b(\d{1,2}(?:\.\d)?)\s*(?:-|–|to)\s*\d{1,2}\s*(?:years?|yrs?)\b"
+    r"|\b(\d{1,2}(?:\.\d)?)\s*(?:years?|yrs?)'?\s+(?:of\s+)?(?:professional\s+|work\s+|industry\s+|relevant\s+)?experience\b",
+    re.I)
+# ... unless it is really an upper bound or a time window ("no more than", "less than 3 years of experience")
+_NOT_MIN = re.compile(r"\b(?:no|not|less\s+than|fewer\s+than|under|below|at\s+most|up\s+to|max(?:imum)?(?:\s+of)?"
+                      r"|(?:in|over|during)\s+the\s+(?:last|past)|within|last|past)\s*$", re.I)
+# What comes right before a skill the question requires, excludes, or adds to the previous one
+_REQUIRE = re.compile(r"\b(?:with|knows?|knowing|skilled\s+in|experienced?\s+(?:in|with)|proficient\s+(?:in|with)"
+                      r"|expertise\s+in|background\s+in|must\s+(?:have|know)|requir(?:e|es|ing)|who\s+uses?)"
+                      r"(?:\s+(?:strong|solid|good|deep|proven|hands-on|production|commercial|professional|a|an))*"
+                      r"(?:\s+(?:at\s+least|over|more\s+than|minimum\s+of))?"
+                      r"(?:\s+\d{1,2}(?:\.\d)?\s*\+?\s*(?:years?|yrs?)\s+of)?\s*$", re.I)
+_NEGATE = re.compile(r"\b(?:without|not|no|except|excluding|other\s+than|never|lacks?)(?:\s+(?:any|a|an))?\s*$", re.I)
+_AND = re.compile(r"\s*(?:,|/|&|\+|and|as\s+well\s+as|plus)?\s*(?:and\s+)?", re.I)
+_OR = re.compile(r"\s*,?\s*(?:or|and/or)\s+", re.I)
+_LOCATION_LINE = re.compile(r"^\s*(?:location|address|based in|city|residence)\s*[:\-]\s*(.+)$", re.I | re.M)
+_MAX_YEARS = 50.0
+
+
+class AttributeFilter(NamedTuple):
+    """Hard constraints on a CV; None / empty means unconstrained."""
+    min_years: Optional[float] = None
+    min_degree: Optional[int] = None
+    location: Optional[str] = None
+    skills: Tuple[str, ...] = ()
+
+    @property
+    def empty(self) -> bool:
+        return self.min_years is None and self.min_degree is None and not self.location and not self.skills
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "AttributeFilter":
+        """
+        From API input; `min_degree` may be a level number or a name from DEGREE_LEVELS,
+        skills may use any alias from skills.json ("node.js" -> "Node").
+        """
+        degree = data.get("min_degree")
+        if isinstance(degree, str):
+            if degree.lower() not in DEGREE_LEVELS:
+                raise ValueError(f"Unknown degree '{degree}', expected one of {list(DEGREE_LEVELS)}")
+            degree = DEGREE_LEVELS[degree.lower()]
+        location = data.get("location")
+        return cls(min_years=data.get("min_years"), min_degree=degree,
+                   location=location.strip().lower() if location else None,
+                   skills=tuple(canonical_skill(s) for s in data.get("skills") or ()))
+
+    def accepts(self, attributes: dict) -> bool:
+        """Check one CV's attributes (as stored in chunk metadata by ingestion)."""
+        years = attributes.get("cv_years")
+        if self.min_years is not None and (years is None or years < self.min_years):
+            return False
+        if self.min_degree is not None and attributes.get("cv_degree", 0) < self.min_degree:
+            return False
+        if self.location and attributes.get("cv_location") != self.location:
+            return False
+        skills = attributes.get("cv_skills") or ()
+        return all(s in skills for s in self.skills)
+
+
+def filter_results(scored_docs: list, flt: Optional[AttributeFilter]) -> list:
+    """Keep the (doc, score) pairs whose chunk metadata satisfies `flt`."""
+    if flt is None:
+        return scored_docs
+    return [(doc, score) for doc, score in scored_docs if flt.accepts(doc.metadata)]
+
+
+def _years_of_experience(text: str) -> Optional[float]:
+    # Stated totals ("7+ years of experience") win; otherwise add up the dated roles
+    stated = [float(m) for m in _YEARS.findall(text) if 0 < float(m) <= _MAX_YEARS]
+    if stated:
+        return max(stated)
+    this_year = time.localtime().tm_year
+    spans = []
+    for start, end in _DATE_RANGE.findall(text):
+        end = this_year if not end[0].isdigit() else int(end)
+        if int(start) <= end <= this_year:
+            spans.append((int(start), end))
+    if not spans:
+        return None
+    total, current_start, current_end = 0, None, None
+    for start, end in sorted(spans):
+        if current_end is None or start > current_end:
+            if current_end is not None:
+                total += current_end - current_start
+            current_start, current_end = start, end
+        else:
+            current_end = max(current_end, end)
+    total += current_end - current_start
+    return float(min(total, _MAX_YEARS))
+
+
+def _degree_level(text: str) -> int:
+    return next((level for level, pattern in _DEGREES if pattern.search(text)), 0)
+
+
+def _location(text: str) -> Optional[str]:
+    match = _LOCATION_LINE.search(text)
+    if not match:
+        return None
+    # "12 Main St, Cairo, Egypt" -> "cairo": the first part without a house number
+    for part in match.group(1).split(","):
+        part = part.strip().lower()
+        if part and not any(c.isdigit() for c in part):
+            return part
+    return None
+
+
+def extract_attributes(text: str) -> dict:
+    """
+    Structured attributes of one CV, computed once at ingest. Keys are prefixed with `cv_`
+    so they can sit in chunk metadata next to the chunk's own `skills`; missing values
+    are left out (Vector Search turns str/list values into restricts, numbers into numeric restricts).
+    """
+    attributes = {"cv_degree": _degree_level(text), "cv_skills": extract_skills(text)}
+    years = _years_of_experience(text)
+    if years is not None:
+        attributes["cv_years"] = years
+    location = _location(text)
+    if location:
+        attributes["cv_location"] = location
+    return attributes
+
+
+def boost_results(scored_docs: list, skills: Sequence[str]) -> list:
+    """
+    Soft counterpart of filter_results: fuses the ranking with one ordered by how many of
+    `skills` the chunk's CV has (reciprocal rank), so those CVs move up but none are dropped.
+    """
+    if not skills:
+        return scored_docs
+    wanted = set(skills)
+
+    def hits(doc) -> int:
+        return len(wanted.intersection(doc.metadata.get("cv_skills") or doc.metadata.get("skills") or ()))
+
+    by_skills = sorted((pair for pair in scored_docs if hits(pair[0])), key=lambda pair: -hits(pair[0]))
+    if not by_skills:
+        return scored_docs
+    return reciprocal_rank_fusion([scored_docs, by_skills], key=id)
+
+
+def _min_years(question: str) -> Optional[float]:
+    years = [float(next(g for g in m.groups() if g)) for m in _MIN_YEARS.finditer(question)
+             if not _NOT_MIN.search(question[max(0, m.start() - 24):m.start()])]
+    return max(years) if years else None
+
+
+def _skill_mentions(question: str) -> Dict[str, str]:
+    """
+    How the question uses each skill it names: "required" ("with Python and Django"),
+    "excluded" ("without Java") or "soft" (in passing, or offered as alternatives: "Python or Go").
+    A skill joined to the previous one by "and" or a comma shares its reading.
+    """
+    mentions: Dict[str, str] = {}
+    chain: List[str] = []
+    state, prev_end = "soft", 0
+    for start, end, skill in get_matcher().find(question):
+        between = question[prev_end:start]
+        if chain and _AND.fullmatch(between):
+            pass
+        elif chain and _OR.fullmatch(between):
+            if state == "required":
+                mentions.update((s, "soft") for s in chain)
+                state = "soft"
+        else:
+            chain = []
+            state = "excluded" if _NEGATE.search(between) else "required" if _REQUIRE.search(between) else "soft"
+        chain.append(skill)
+        if mentions.get(skill) in (None, "soft"):
+            mentions[skill] = state
+        prev_end = end
+    return mentions
+
+
+def boost_skills(question: str) -> Tuple[str, ...]:
+    """Skills the question mentions without requiring or excluding them (for boost_results)."""
+    return tuple(skill for skill, state in _skill_mentions(question).items() if state == "soft")
+
+
+def parse_filter(question: str, locations: Iterable[str] = ()) -> AttributeFilter:
+    """
+    Constraints stated explicitly in a recruiter question, e.g. "at least 5 years of
+    experience with Python and a Master's degree". Upper bounds and time windows
+    ("under 2 years", "in the last 3 years") are not minimums; skills are only required
+    after "with", "skilled in" and similar, never when negated or given as alternatives
+    (see boost_skills for the rest). Locations are only recognised if some indexed CV has
+    them (`locations`).
+    """
+    words = re.findall(r"[a-z]+", question.lower())
+    known = set(locations)
+    location = next((" ".join(words[i:i + n]) for n in (3, 2, 1) for i in range(len(words) - n + 1)
+                     if " ".join(words[i:i + n]) in known), None)
+    return AttributeFilter(
+        min_years=_min_years(question),
+        min_degree=_degree_level(question) or None,
+        location=location,
+        skills=tuple(skill for skill, state in _skill_mentions(question).items() if state == "required"),
+    )
+
+
+class AttributeIndex:
+    """
+    Columnar index of CV attributes for pre-filtering before vector search.
+
+    Attributes are collected per CV in `<dir>/attributes.sqlite` during ingestion.
+    `compile()` writes them as column arrays (years float32, degree int8, location code int32)
+    plus one packed bitmap per skill, opened memory-mapped. A filter is a few vectorized
+    comparisons and a bitwise AND of the skill bitmaps, so it stays in milliseconds at 1M CVs.
+    """
+
+    def __init__(self, path: str = "attribute_index"):
+        self.path = path
+        self._conn = None
+        self._snapshot = None
+        self._snapshot_name = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config) -> "AttributeIndex":
+        return cls(getattr(config, "ATTRIBUTE_INDEX_PATH", "attribute_index"))
+
+    # --- attribute store (writer side) ---------------------------------------
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(self.path, exist_ok=True)
+            self._conn = sqlite3.connect(os.path.join(self.path, "attributes.sqlite"),
+                                         check_same_thread=False, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS attributes (key TEXT PRIMARY KEY, data TEXT NOT NULL)")
+            self._conn.commit()
+        return self._conn
+
+    def put(self, attributes: Dict[str, dict]):
+        """Store attributes per CV key (the chunk's `gcs_uri`, or a local CV ID)."""
+        with self._lock:
+            db = self._db()
+            db.executemany("INSERT OR REPLACE INTO attributes (key, data) VALUES (?, ?)",
+                           [(key, json.dumps(attrs)) for key, attrs in attributes.items()])
+            db.commit()
+
+    def delete(self, keys: Sequence[str]):
+        with self._lock:
+            db = self._db()
+            db.executemany("DELETE FROM attributes WHERE key = ?", [(k,) for k in keys])
+            db.commit()
+
+    def compile(self) -> int:
+        """Write a fresh column snapshot from the attribute store; returns the number of CVs."""
+        with self._lock:
+            rows = self._db().execute("SELECT key, data FROM attributes ORDER BY key").fetchall()
+        n = len(rows)
+        keys = [key for key, _ in rows]
+        years = np.full(n, np.nan, dtype=np.float32)
+        degree = np.zeros(n, dtype=np.int8)
+        location = np.full(n, -1, dtype=np.int32)
+        locations: Dict[str, int] = {}
+        skill_rows: Dict[str, List[int]] = {}
+        for i, (_, data) in enumerate(rows):
+            attrs = json.loads(data)
+            if attrs.get("cv_years") is not None:
+                years[i] = attrs["cv_years"]
+            degree[i] = attrs.get("cv_degree", 0)
+            if attrs.get("cv_location"):
+                location[i] = locations.setdefault(attrs["cv_location"], len(locations))
+            for skill in attrs.get("cv_skills", ()):
+                skill_rows.setdefault(skill, []).append(i)
+        skills = sorted(skill_rows)
+        bits = np.zeros((len(skills), math.ceil(n / 8)), dtype=np.uint8)
+        for s, skill in enumerate(skills):
+            column = np.zeros(n, dtype=bool)
+            column[skill_rows[skill]] = True
+            bits[s] = np.packbits(column)
+
+        # New versioned snapshot directory, then point CURRENT at it (readers pick it up on next use)
+        name = f"snapshot-{time.time_ns()}"
+        target = os.path.join(self.path, name)
+        os.makedirs(target)
+        for array_name, array in [("years", years), ("degree", degree), ("location", location),
+                                  ("skill_bits", bits)]:
+            np.save(os.path.join(target, f"{array_name}.npy"), array)
+        with open(os.path.join(target, "vocab.json"), "w") as f:
+            json.dump({"keys": keys, "locations": sorted(locations, key=locations.get), "skills": skills}, f)
+        tmp = os.path.join(self.path, "CURRENT.tmp")
+        with open(tmp, "w") as f:
+            f.write(name)
+        os.replace(tmp, os.path.join(self.path, "CURRENT"))
+        for old in os.listdir(self.path):
+            if old.startswith("snapshot-") and old != name:
+                shutil.rmtree(os.path.join(self.path, old), ignore_errors=True)
+        return n
+
+    # --- filtering (reader side) -----------------------------------------------
+    def _current(self) -> Optional[dict]:
+        current = os.path.join(self.path, "CURRENT")
+        if not os.path.exists(current):
+            return None
+        with open(current) as f:
+            name = f.read().strip()
+        if name != self._snapshot_name:
+            target = os.path.join(self.path, name)
+            snapshot = {a: np.load(os.path.join(target, f"{a}.npy"), mmap_mode="r")
+                        for a in ("years", "degree", "location", "skill_bits")}
+            with open(os.path.join(target, "vocab.json")) as f:
+                vocab = json.load(f)
+            snapshot["keys"] = vocab["keys"]
+            snapshot["locations"] = {loc: i for i, loc in enumerate(vocab["locations"])}
+            snapshot["skills"] = {skill: i for i, skill in enumerate(vocab["skills"])}
+            self._snapshot, self._snapshot_name = snapshot, name
+        return self._snapshot
+
+    def available(self) -> bool:
+        return os.path.exists(os.path.join(self.path, "CURRENT"))
+
+    def locations(self) -> List[str]:
+        snap = self._current()
+        return list(snap["locations"]) if snap else []
+
+    def match(self, flt: AttributeFilter) -> np.ndarray:
+        """Boolean mask over the indexed CVs (in `keys` order) that satisfy every constraint."""
+        snap = self._current()
+        if snap is None:
+            return np.zeros(0, dtype=bool)
+        n = len(snap["keys"])
+        if flt.skills:
+            # AND the packed bitmaps first, unpack once
+            packed = None
+            for skill in flt.skills:
+                row = snap["skills"].get(skill)
+                if row is None:
+                    return np.zeros(n, dtype=bool)
+                packed = snap["skill_bits"][row] if packed is None else packed & snap["skill_bits"][row]
+            mask = np.unpackbits(packed, count=n).astype(bool)
+        else:
+            mask = np.ones(n, dtype=bool)
+        if flt.min_years is not None:
+            mask &= snap["years"] >= flt.min_years   # unknown (NaN) never matches
+        if flt.min_degree is not None:
+            mask &= snap["degree"] >= flt.min_degree
+        if flt.location:
+            code = snap["locations"].get(flt.location)
+            if code is None:
+                return np.zeros(n, dtype=bool)
+            mask &= snap["location"] == code
+        return mask
+
+    def count(self, flt: AttributeFilter) -> int:
+        return int(np.count_nonzero(self.match(flt)))
+
+    def keys(self, mask: np.ndarray) -> List[str]:
+        snap = self._current()
+        if snap is None:
+            return []
+        return [snap["keys"][i] for i in np.flatnonzero(mask)]
+
+    def all_keys(self) -> List[str]:
+        """Every indexed CV key (gcs_uri), in row order."""
+        snap = self._current()
+        return snap["keys"] if snap else []
+
+    def skill_counts(self, skills: Sequence[str]) -> Dict[str, int]:
+        """How many CVs have each skill (popcount of its bitmap); 0 for unknown skills."""
+        snap = self._current()
+        counts = {}
+        for skill in skills:
+            row = snap["skills"].get(skill) if snap else None
+            counts[skill] = 0 if row is None else int(np.unpackbits(snap["skill_bits"][row]).sum())
+        return counts
+
+
+def vertex_filters(flt: AttributeFilter, index: Optional[AttributeIndex] = None) -> dict:
+    """
+    Vector Search restricts for `flt`, as keyword arguments for similarity_search_by_vector_with_score.
+    Only the rarest required skill becomes a restrict (per the local index, when available);
+    the others are checked on the results with `AttributeFilter.accepts`.
+    """
+    from google.cloud.aiplatform.matching_engine.matching_engine_index_endpoint import (
+        Namespace, NumericNamespace)
+    restricts, numeric = [], []
+    if flt.skills:
+        counts = index.skill_counts(flt.skills) if index is not None and index.available() else {}
+        rarest = min(flt.skills, key=lambda s: counts.get(s, 0)) if counts else flt.skills[0]
+        restricts.append(Namespace(name="cv_skills", allow_tokens=[rarest], deny_tokens=[]))
+    if flt.location:
+        restricts.append(Namespace(name="cv_location", allow_tokens=[flt.location], deny_tokens=[]))
+    if flt.min_years is not None:
+        numeric.append(NumericNamespace(name="cv_years", value_float=float(flt.min_years), op="GREATER_EQUAL"))
+    if flt.min_degree is not None:
+        numeric.append(NumericNamespace(name="cv_degree", value_int=int(flt.min_degree), op="GREATER_EQUAL"))
+    kwargs = {}
+    if restricts:
+        kwargs["filter"] = restricts
+    if numeric:
+        kwargs["numeric_filter"] = numeric
+    return kwargs
@@ -0,0 +1,247 @@
+# file: bm25_index.py
+import json
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+import zlib
+from collections import Counter
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from candidates import RRF_K
+
+_TOKEN = re.compile(r"[a-z0-9][a-z0-9+#]*(?:\.[a-z0-9]+)*")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it of on or that the this to was were "
+    "will with who whose me find show list candidates candidate people someone any all".split())
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased terms; keeps tokens like c++, c#, node.js and asp.net intact. No stemming,
+    so exact certification and product names match exactly."""
+    return [t for t in _TOKEN.findall(text.lower()) if t not in _STOPWORDS]
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[Tuple[object, float]]], key, k: int = RRF_K):
+    """
+    Fuse ranked (item, score) lists: each item scores sum(1 / (k + rank)) over the lists it
+    appears in. `key(item)` identifies the same item across lists. Returns fused (item, score).
+    """
+    fused: Dict[object, list] = {}
+    for ranking in rankings:
+        for rank, (item, _) in enumerate(ranking):
+            entry = fused.setdefault(key(item), [item, 0.0])
+            entry[1] += 1.0 / (k + rank + 1)
+    return sorted(((item, score) for item, score in fused.values()), key=lambda x: -x[1])
+
+
+class BM25Index:
+    """
+    Local BM25 inverted index over the same chunks that go to the vector store.
+
+    Chunks live in `<dir>/chunks.sqlite` (incremental add/delete during ingestion).
+    `compile()` turns them into a read-optimized snapshot: for every term a posting list of
+    (row, term frequency) stored as flat int32/uint16 NumPy arrays plus per-term offsets,
+    opened memory-mapped. A query accumulates BM25 scores over the postings of its terms
+    with vectorized NumPy and takes the top-k with argpartition.
+    """
+
+    def __init__(self, path: str = "bm25_index", k1: float = 1.2, b: float = 0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._conn = None
+        self._snapshot = None
+        self._snapshot_name = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config) -> "BM25Index":
+        return cls(getattr(config, "BM25_INDEX_PATH", "bm25_index"))
+
+    # --- chunk store (writer side) ------------------------------------------
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(self.path, exist_ok=True)
+            self._conn = sqlite3.connect(os.path.join(self.path, "chunks.sqlite"),
+                                         check_same_thread=False, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            # Compiled snapshots refer to chunks by row: rows are never reused (AUTOINCREMENT)
+            # and keep their number when a chunk is replaced (see add)
+            schema = ("CREATE TABLE IF NOT EXISTS {} ("
+                      " row INTEGER PRIMARY KEY AUTOINCREMENT, chunk_id TEXT UNIQUE NOT NULL, length INTEGER NOT NULL,"
+                      " terms BLOB NOT NULL, text TEXT NOT NULL, metadata TEXT NOT NULL)")
+            old = self._conn.execute("SELECT sql FROM sqlite_master WHERE name = 'chunks'").fetchone()
+            if old is not None and "AUTOINCREMENT" not in old[0]:
+                # Stores created before rows were stable: copy them over, keeping every row number
+                with self._conn:
+                    self._conn.execute(schema.format("chunks_v2"))
+                    self._conn.execute("INSERT INTO chunks_v2 SELECT * FROM chunks")
+                    self._conn.execute("DROP TABLE chunks")
+                    self._conn.execute("ALTER TABLE chunks_v2 RENAME TO chunks")
+            self._conn.execute(schema.format("chunks"))
+            # source_chunks looks chunks up by their CV
+            self._conn.execute("CREATE INDEX IF NOT EXISTS chunks_source"
+                               " ON chunks (json_extract(metadata, '$.gcs_uri'))")
+            self._conn.commit()
+        return self._conn
+
+    def add(self, ids: Sequence[str], texts: Sequence[str], metadatas: Sequence[dict]):
+        rows = []
+        for chunk_id, text, metadata in zip(ids, texts, metadatas):
+            terms = tokenize(text)
+            blob = zlib.compress(json.dumps(Counter(terms)).encode("utf-8"))
+            rows.append((chunk_id, len(terms), blob, text, json.dumps(metadata)))
+        with self._lock:
+            db = self._db()
+            db.executemany(
+                "INSERT INTO chunks (chunk_id, length, terms, text, metadata) VALUES (?, ?, ?, ?, ?)"
+                " ON CONFLICT(chunk_id) DO UPDATE SET length = excluded.length, terms = excluded.terms,"
+                " text = excluded.text, metadata = excluded.metadata",
+                rows)
+            db.commit()
+
+    def delete(self, ids: Sequence[str]):
+        with self._lock:
+            db = self._db()
+            db.executemany("DELETE FROM chunks WHERE chunk_id = ?", [(i,) for i in ids])
+            db.commit()
+
+    def compile(self) -> int:
+        """Write a fresh posting-list snapshot from the chunk store; returns the number of chunks."""
+        with self._lock:
+            rows = self._db().execute("SELECT row, length, terms FROM chunks ORDER BY row").fetchall()
+        postings: Dict[str, Tuple[list, list]] = {}
+        doc_rows = np.empty(len(rows), dtype=np.int64)
+        doc_lens = np.empty(len(rows), dtype=np.int32)
+        for doc, (row, length, blob) in enumerate(rows):
+            doc_rows[doc] = row
+            doc_lens[doc] = length
+            for term, tf in json.loads(zlib.decompress(blob)).items():
+                docs, tfs = postings.setdefault(term, ([], []))
+                docs.append(doc)
+                tfs.append(tf)
+
+        vocab = sorted(postings)
+        offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        for t, term in enumerate(vocab):
+            offsets[t + 1] = offsets[t] + len(postings[term][0])
+        post_docs = np.empty(offsets[-1], dtype=np.int32)
+        post_tfs = np.empty(offsets[-1], dtype=np.uint16)
+        for t, term in enumerate(vocab):
+            docs, tfs = postings[term]
+            post_docs[offsets[t]:offsets[t + 1]] = docs
+            post_tfs[offsets[t]:offsets[t + 1]] = np.minimum(tfs, 65535)
+        n = max(len(rows), 1)
+        df = np.diff(offsets)
+        idf = np.log(1 + (n - df + 0.5) / (df + 0.5)).astype(np.float32)
+
+        # Write a new versioned snapshot directory, then point CURRENT at it
+        name = f"snapshot-{time.time_ns()}"
+        target = os.path.join(self.path, name)
+        os.makedirs(target)
+        for array_name, array in [("doc_rows", doc_rows), ("doc_lens", doc_lens), ("offsets", offsets),
+                                  ("post_docs", post_docs), ("post_tfs", post_tfs), ("idf", idf)]:
+            np.save(os.path.join(target, f"{array_name}.npy"), array)
+        with open(os.path.join(target, "vocab.json"), "w") as f:
+            json.dump(vocab, f)
+        current = os.path.join(self.path, "CURRENT")
+        previous = None
+        if os.path.exists(current):
+            with open(current) as f:
+                previous = f.read().strip()
+        tmp = os.path.join(self.path, "CURRENT.tmp")
+        with open(tmp, "w") as f:
+            f.write(name)
+        os.replace(tmp, current)
+        # Readers may still be loading or searching the previous snapshot: it goes on the next compile
+        for old in os.listdir(self.path):
+            if old.startswith("snapshot-") and old not in (name, previous):
+                shutil.rmtree(os.path.join(self.path, old), ignore_errors=True)
+        return len(rows)
+
+    # --- search (reader side) --------------------------------------------------
+    def _current(self) -> Optional[dict]:
+        """The latest compiled snapshot, reloaded when ingestion publishes a new one."""
+        current = os.path.join(self.path, "CURRENT")
+        if not os.path.exists(current):
+            return None
+        with open(current) as f:
+            name = f.read().strip()
+        if name != self._snapshot_name:
+            target = os.path.join(self.path, name)
+            snapshot = {a: np.load(os.path.join(target, f"{a}.npy"), mmap_mode="r")
+                        for a in ("doc_rows", "doc_lens", "offsets", "post_docs", "post_tfs", "idf")}
+            with open(os.path.join(target, "vocab.json")) as f:
+                snapshot["vocab"] = {term: t for t, term in enumerate(json.load(f))}
+            lens = snapshot["doc_lens"]
+            snapshot["avgdl"] = float(lens.mean()) if len(lens) else 1.0
+            self._snapshot, self._snapshot_name = snapshot, name
+        return self._snapshot
+
+    def available(self) -> bool:
+        return os.path.exists(os.path.join(self.path, "CURRENT"))
+
+    def search(self, query: str, k: int) -> List[Tuple[int, float]]:
+        """Top-k (chunk row, BM25 score), best first."""
+        snap = self._current()
+        if snap is None:
+            return []
+        terms = [snap["vocab"][t] for t in set(tokenize(query)) if t in snap["vocab"]]
+        if not terms:
+            return []
+        scores = np.zeros(len(snap["doc_lens"]), dtype=np.float32)
+        norm = self.k1 * (1 - self.b + self.b * np.asarray(snap["doc_lens"], dtype=np.float32) / snap["avgdl"])
+        for t in terms:
+            start, end = snap["offsets"][t], snap["offsets"][t + 1]
+            docs = snap["post_docs"][start:end]
+            tfs = snap["post_tfs"][start:end].astype(np.float32)
+            scores[docs] += snap["idf"][t] * tfs * (self.k1 + 1) / (tfs + norm[docs])
+        k = min(k, int(np.count_nonzero(scores)))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(snap["doc_rows"][d]), float(scores[d])) for d in top]
+
+    def chunks(self, rows: Sequence[int]) -> Dict[int, Tuple[str, str, dict]]:
+        """row -> (chunk_id, text, metadata) for the given rows."""
+        if not rows:
+            return {}
+        conn = sqlite3.connect(f"file:{os.path.abspath(os.path.join(self.path, 'chunks.sqlite'))}?mode=ro",
+                               uri=True)
+        try:
+            marks = ",".join("?" * len(rows))
+            return {row: (chunk_id, text, json.loads(metadata)) for row, chunk_id, text, metadata in conn.execute(
+                f"SELECT row, chunk_id, text, metadata FROM chunks WHERE row IN ({marks})", list(rows))}
+        finally:
+            conn.close()
+
+    def source_chunks(self, gcs_uri: str) -> List[Tuple[str, dict]]:
+        """(text, metadata) of every chunk of one CV, in document order."""
+        path = os.path.join(self.path, "chunks.sqlite")
+        if not os.path.exists(path):
+            return []
+        conn = sqlite3.connect(f"file:{os.path.abspath(path)}?mode=ro", uri=True)
+        try:
+            rows = conn.execute("SELECT text, metadata FROM chunks WHERE json_extract(metadata, '$.gcs_uri') = ?",
+                                (gcs_uri,)).fetchall()
+        finally:
+            conn.close()
+        chunks = [(text, json.loads(metadata)) for text, metadata in rows]
+        return sorted(chunks, key=lambda c: c[1].get("start_index", 0))
+
+    def search_documents(self, query: str, k: int) -> list:
+        """Top-k as LangChain (Document, score) pairs, like the vector store returns."""
+        from langchain_core.documents import Document
+        hits = self.search(query, k)
+        found = self.chunks([row for row, _ in hits])
+        results = []
+        for row, score in hits:
+            if row in found:
+                chunk_id, text, metadata = found[row]
+                results.append((Document(page_content=text, metadata=dict(metadata, chunk_id=chunk_id)), score))
+        return results
@@ -0,0 +1,84 @@
+# file: candidates.py
+import math
+import uuid
+from typing import Dict, List, Tuple
+
+# Fixed namespace so a CV always gets the same candidate ID across requests
+CANDIDATE_NAMESPACE = uuid.UUID("a3c9e0d2-6b7f-4e15-8d0c-1f2b3a4c5d6e")
+
+# Standard reciprocal-rank-fusion damping constant
+RRF_K = 60
+
+
+def candidate_key(doc) -> str:
+    """The source file a chunk came from."""
+    return doc.metadata.get("gcs_uri") or doc.metadata.get("filename", "")
+
+
+def candidate_id(key: str) -> str:
+    return str(uuid.uuid5(CANDIDATE_NAMESPACE, key))
+
+
+def candidate_name(filename: str) -> str:
+    # A simple cleanup: remove '.pdf' and common separators
+    return filename.replace('.pdf', '').replace('_', ' ').replace('-', ' ').title()
+
+
+class CandidateGroup:
+    """All retrieved chunks of one CV, with a fused score and its best snippets."""
+
+    def __init__(self, key: str, first_doc):
+        self.key = key
+        self.id = candidate_id(key)
+        self.filename = first_doc.metadata.get("filename", "")
+        self.score = 0.0
+        self.best_rank = None
+        self.hits: List[Tuple[object, float]] = []   # (doc, raw score) in rank order
+
+    def snippets(self, n: int) -> list:
+        return [doc for doc, _ in self.hits[:n]]
+
+
+def group_candidates(scored_docs: List[Tuple[object, float]], limit: int,
+                     fusion: str = "max") -> List[CandidateGroup]:
+    """
+    Collapse ranked (doc, score) pairs into one group per source CV.
+    fusion="max": a candidate ranks by its best chunk (score = that chunk's score).
+    fusion="rrf": sum of 1 / (RRF_K + rank) over the candidate's chunks, so CVs
+    with several strong chunks move up.
+    Returns at most `limit` groups, best first.
+    """
+    groups: Dict[str, CandidateGroup] = {}
+    for rank, (doc, score) in enumerate(scored_docs):
+        key = candidate_key(doc)
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = CandidateGroup(key, doc)
+            group.best_rank = rank
+            if fusion == "max":
+                group.score = float(score)
+        if fusion == "rrf":
+            group.score += 1.0 / (RRF_K + rank + 1)
+        group.hits.append((doc, score))
+
+    if fusion == "rrf":
+        ordered = sorted(groups.values(), key=lambda g: (-g.score, g.best_rank))
+    elif fusion == "max":
+        # Results arrive ranked, so the first chunk seen is each candidate's best
+        ordered = sorted(groups.values(), key=lambda g: g.best_rank)
+    else:
+        raise ValueError(f"Unknown fusion '{fusion}', expected 'max' or 'rrf'")
+    return ordered[:limit]
+
+
+def count_candidates(scored_docs: List[Tuple[object, float]]) -> int:
+    return len({candidate_key(doc) for doc, _ in scored_docs})
+
+
+def refetch_size(fetched: int, distinct: int, wanted: int, max_k: int) -> int:
+    """
+    How many chunks to fetch next time to reach `wanted` distinct candidates,
+    extrapolating the chunks-per-candidate ratio seen in the first fetch (+20% slack).
+    """
+    per_candidate = fetched / max(distinct, 1)
+    return min(max_k, math.ceil(wanted * per_candidate * 1.2))
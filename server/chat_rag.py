@@ -1,55 +1,48 @@
 # file: chat_rag.py
-from typing import List
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.chat_history import BaseChatMessageHistory
-from langchain_core.chat_history import InMemoryChatMessageHistory
-from langchain_google_vertexai import ChatVertexAI, VertexAIEmbeddings
-from langchain_google_vertexai.vectorstores import VectorSearchVectorStore
-from google.cloud import aiplatform
-import uuid  # <-- ADD THIS IMPORT
-from typing import List, Dict  # You might want to add Dict for type hinting too
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+import asyncio
+import importlib
+import logging
+import os
+import threading
+import time
+from functools import partial
+from typing import TYPE_CHECKING, AsyncIterator, Dict, Optional
 from config_manager import ConfigManager
+from upstream_limits import UpstreamLimits
+from retrieval_cache import SemanticRetrievalCache
+from skill_extractor import extract_skills
+from candidates import candidate_id, candidate_name, count_candidates, group_candidates, refetch_size
+from context_packer import pack_prompt
+from bm25_index import BM25Index, reciprocal_rank_fusion
+from attribute_index import (AttributeFilter, AttributeIndex, boost_results, boost_skills, filter_results,
+                             parse_filter)
+from vector_backends import create_embeddings, create_vector_backend
+from metrics import STAGE_SECONDS, span
+from response_format import ResultStore, merge_chunks
+from singleflight import SingleFlight, messages_key, question_key
+
+if TYPE_CHECKING:
+    from langchain_core.chat_history import BaseChatMessageHistory
 
 # Get the single instance of the configuration
 config = ConfigManager()
+logger = logging.getLogger(__name__)
 
 PROJECT_ID = config.PROJECT_ID
 BUCKET = "cv-rag-west-4"
 REGION = config.REGION
-INDEX_ID = "3037589987731177472"
 INDEX_DISPLAY_NAME = "cv-index-rag"
-ENDPOINT_ID = "7123093721570082816"
-
-aiplatform.init(project=PROJECT_ID, location=REGION)
-
-# Embeddings (must match index dims used at ingestion)
-emb = VertexAIEmbeddings(
-    model_name="text-embedding-005",
-    project=PROJECT_ID,
-    location=REGION,
-)
-
-# Vector store / retriever
-index = aiplatform.MatchingEngineIndex(INDEX_ID)
-endpoint = aiplatform.MatchingEngineIndexEndpoint(ENDPOINT_ID)
-vector_store = VectorSearchVectorStore.from_components(
-    embedding=emb,
-    index_id=INDEX_ID,
-    endpoint_id=ENDPOINT_ID,
-    gcs_bucket_name=BUCKET,
-    project_id=PROJECT_ID,
-    region=REGION,
-)
-retriever = vector_store.as_retriever(search_kwargs={"k": 20}, score_threshold = {0.2})
-
-# Chat model (Gemini on Vertex AI)
-llm = ChatVertexAI(
-    model="gemini-2.5-flash", 
-    project=PROJECT_ID,
-    location=REGION,
-    temperature=0.2,
-)
+TOP_CANDIDATES = getattr(config, "TOP_CANDIDATES", 10)        # distinct CVs per answer
+CANDIDATE_OVERFETCH = getattr(config, "CANDIDATE_OVERFETCH", 2)  # chunks fetched per wanted CV at first
+MAX_FETCH_K = getattr(config, "MAX_FETCH_K", 200)               # upper bound when re-fetching
+CANDIDATE_FUSION = getattr(config, "CANDIDATE_FUSION", "max")    # "max" or "rrf", see candidates.py
+RETRIEVAL_MODE = getattr(config, "RETRIEVAL_MODE", "hybrid")     # "vector", "lexical" or "hybrid"
+ATTRIBUTE_FILTERS = getattr(config, "ATTRIBUTE_FILTERS", False)  # constraints parsed from the question
+SINGLE_FLIGHT = getattr(config, "SINGLE_FLIGHT", True)           # identical concurrent calls share one upstream call
+HISTORY_COMPACTION = getattr(config, "HISTORY_COMPACTION", False) # fold old turns into a summary, see history_compaction.py
+SNIPPETS_PER_CANDIDATE = 2                                      # best chunks kept per CV
+CONTEXT_TOKEN_BUDGET = getattr(config, "CONTEXT_TOKEN_BUDGET", 6000)  # history + context + question
+HISTORY_TOKEN_SHARE = getattr(config, "HISTORY_TOKEN_SHARE", 0.4)     # max share of it for history
 
 # System prompt for recruiter-style answers with citations back to files
 SYSTEM = """You are a helpful CV assistant for a recruiting team.
@@ -58,96 +51,560 @@ Return brief, structured results with candidate summaries.
 Always include the source filename(s) for each suggestion from metadata.filename.
 If the user asks for people "with X", list top matches with 1–2 bullets each."""
 
-prompt = ChatPromptTemplate.from_messages([
-    ("system", SYSTEM),
-    MessagesPlaceholder("history"),
-    ("human", "{question}"),
-    ("system", "Context chunks:\n{context}")
-])
+# --- Lazy clients ------------------------------------------------------------
+# Nothing below talks to GCP or imports LangChain/Vertex AI until first use, so
+# importing this module (and starting app.py) is fast. Factories are thread-safe:
+# concurrent first requests build each client exactly once.
+_clients: Dict[str, object] = {}
+_clients_lock = threading.RLock()
 
-# file: chat_rag.py
-# ... (keep previous imports)
-def ask(question: str, history: BaseChatMessageHistory) -> dict:
+
+def _lazy(name: str, factory):
+    client = _clients.get(name)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(name)
+            if client is None:
+                client = _clients[name] = factory()
+    return client
+
+
+def _init_aiplatform():
+    from google.cloud import aiplatform
+    aiplatform.init(project=PROJECT_ID, location=REGION)
+    return aiplatform
+
+
+def get_embedding_cache():
+    """The local embedding cache (no network), also used for /stats."""
+    def factory():
+        from embedding_cache import EmbeddingCache
+        return EmbeddingCache.from_config(config)
+    return _lazy("embedding_cache", factory)
+
+
+def get_embeddings():
     """
-    Sends a question to the RAG chatbot and returns a structured response.
+    Embeddings (must match index dims used at ingestion), cached so repeated questions skip the model.
+    Vertex AI or a local model, per EMBEDDING_BACKEND (see vector_backends.py).
+    """
+    return _lazy("embeddings", lambda: create_embeddings(config, get_embedding_cache()))
+
+
+def get_vector_store():
+    """
+    Vector backend (queried by vector so the retrieval cache can sit in between):
+    Vertex AI Vector Search or a local FAISS index, per VECTOR_BACKEND.
     """
-    print(f"\n--- New Question: '{question}' ---")  # Debug print
+    return _lazy("vector_store", lambda: create_vector_backend(
+        config, embeddings=get_embeddings(), attribute_index=get_attribute_index()))
 
-    # Retrieve relevant documents
-    docs = retriever.invoke(question)
-    print(f"Number of CV chunks found: {len(docs)}")  # Debug print
 
-    # Format context for the LLM
-    context = "\n\n---\n\n".join(
-        f"[{i+1}] {d.page_content[:1200]}\n(source: {d.metadata.get('filename')})"
-        for i, d in enumerate(docs)
-    )
+def get_llm():
+    """Chat model (Gemini on Vertex AI)."""
+    def factory():
+        _lazy("aiplatform", _init_aiplatform)
+        from langchain_google_vertexai import ChatVertexAI
+        return ChatVertexAI(
+            model="gemini-2.5-flash",
+            project=PROJECT_ID,
+            location=REGION,
+            temperature=0.2,
+        )
+    return _lazy("llm", factory)
 
-    # Build the messages for the LLM
-    msgs = prompt.format_messages(history=history.messages, question=question, context=context)
 
-    # Get the LLM's text response
-    resp = llm.invoke(msgs)
+def get_lexical_index():
+    """Local BM25 index written by ingest_cvs.py (no network)."""
+    return _lazy("lexical_index", lambda: BM25Index.from_config(config))
 
-    # Update history
-    history.add_user_message(question)
-    history.add_ai_message(resp.content)
-
-    # --- NEW LOGIC: Always return structured data if we found CVs ---
-    if docs:  # Simplified condition: if we found any CV chunks
-        print("Found CVs. Returning candidate cards data.")  # Debug print
-        candidate_list = []
-        for doc in docs:
-            filename = doc.metadata.get('filename', '')
-            # A simple cleanup: remove '.pdf' and common separators
-            name_from_file = filename.replace('.pdf', '').replace('_', ' ').replace('-', ' ').title()
-            
-            # Try to extract a first name from the filename as a fallback
-            name_parts = name_from_file.split()
-            first_name = name_parts[0] if name_parts else "Candidate"
-
-            # Create a candidate object for the frontend card.
-            candidate_data = {
-                "id": str(uuid.uuid4()),
-                "name": name_from_file,
-                "role": "AI Candidate",  # You can make this more dynamic based on the content
-                "avatar": "",
-                "skills": extract_skills_from_text(doc.page_content),  # See function below
-                "location": "", 
-                "experience": "",
-                "cvUrl": f"gs://{BUCKET}/{filename}",  # Or doc.metadata.get('gcs_uri', '')
-                "initials": ''.join([n[0] for n in name_from_file.split()[:2]]).upper(),
-                "gradientFrom": "#667eea",
-                "gradientTo": "#764ba2",
-                "text": doc.page_content[:500] + "..." if len(doc.page_content) > 500 else doc.page_content
-            }
-            candidate_list.append(candidate_data)
-        
+
+def get_attribute_index():
+    """Local per-CV attribute columns written by ingest_cvs.py (no network)."""
+    return _lazy("attribute_index", lambda: AttributeIndex.from_config(config))
+
+
+def get_history_compactor():
+    """Folds old turns of long sessions into a running summary (LLM call, run in the background)."""
+    def factory():
+        from history_compaction import HistoryCompactor
+        return HistoryCompactor.from_config(config, get_llm, limits)
+    return _lazy("history_compactor", factory)
+
+
+def get_prompt():
+    def factory():
+        from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+        return ChatPromptTemplate.from_messages([
+            ("system", SYSTEM),
+            MessagesPlaceholder("history"),
+            ("human", "{question}"),
+            ("system", "Context chunks:\n{context}")
+        ])
+    return _lazy("prompt", factory)
+
+
+# Everything /ask needs, in build order
+_WARMUP = [
+    ("prompt", get_prompt),
+    ("embeddings", get_embeddings),
+    ("vector_store", get_vector_store),
+    ("llm", get_llm),
+]
+
+
+def warmup() -> Dict[str, float]:
+    """Build every client now; returns seconds spent per client (0 if it already existed)."""
+    timings = {}
+    for name, factory in _WARMUP:
+        started = time.perf_counter()
+        factory()
+        timings[name] = round(time.perf_counter() - started, 4)
+    return timings
+
+
+def _prefetch(path: str):
+    """Ask the kernel to read a file (or every file under a directory) into the page cache."""
+    paths = [path] if os.path.isfile(path) else [os.path.join(root, name) for root, _, names in os.walk(path)
+                                                 for name in names]
+    for name in paths:
+        fd = os.open(name, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        finally:
+            os.close(fd)
+
+
+def preload() -> Dict[str, float]:
+    """
+    The fork-safe part of `warmup`, for servers that import the app once and then fork
+    workers (serve.py): imports the client libraries, builds the prompt and pulls the local
+    index files into the page cache, so every worker starts with them hot and shares
+    those pages through mmap. gRPC clients and SQLite connections must not cross a fork,
+    so each worker still builds its own with `warmup`.
+    """
+    timings = {}
+    started = time.perf_counter()
+    for module in ("langchain_core.documents", "langchain_google_vertexai", "google.cloud.aiplatform", "faiss"):
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            pass
+    get_prompt()
+    timings["imports"] = round(time.perf_counter() - started, 4)
+
+    started = time.perf_counter()
+    for path in (f'{getattr(config, "FAISS_INDEX_PATH", "chunk_index")}.faiss',
+                 getattr(config, "BM25_INDEX_PATH", "bm25_index"),
+                 getattr(config, "ATTRIBUTE_INDEX_PATH", "attribute_index")):
+        if os.path.exists(path) and hasattr(os, "posix_fadvise"):
+            _prefetch(path)
+    timings["indexes"] = round(time.perf_counter() - started, 4)
+    return timings
+
+
+def is_ready() -> bool:
+    return all(name in _clients for name, _ in _WARMUP)
+
+
+# Per-upstream concurrency caps for the async path, so a burst of questions queues
+# here instead of overloading the embedding service, Vector Search or Gemini
+limits = UpstreamLimits({
+    "embedding": getattr(config, "MAX_CONCURRENT_EMBEDDING", 32),
+    "vector_search": getattr(config, "MAX_CONCURRENT_VECTOR_SEARCH", 32),
+    "llm": getattr(config, "MAX_CONCURRENT_LLM", 64),
+})
+
+# Near-duplicate questions reuse earlier search results (see retrieval_cache.py)
+retrieval_cache = SemanticRetrievalCache.from_config(config)
+
+# Concurrent identical retrievals / prompts wait on one in-flight call (see singleflight.py)
+retrieval_flights = SingleFlight("retrieve")
+llm_flights = SingleFlight("llm")
+
+# Candidate lists for paging and ID -> CV lookups for /candidates (see response_format.py)
+results = ResultStore.from_config(config)
+
+
+async def in_thread(fn, *args, **kwargs):
+    """Run a blocking local call (SQLite stores, BM25, attribute index) on the default executor."""
+    return await asyncio.get_running_loop().run_in_executor(None, partial(fn, *args, **kwargs))
+
+
+def _needs_refetch(scored_docs: list, k: int) -> bool:
+    # A full page with too few distinct CVs means one CV's chunks crowded out the rest
+    return len(scored_docs) == k and k < MAX_FETCH_K and count_candidates(scored_docs) < TOP_CANDIDATES
+
+
+def resolve_filter(question: str, filters: Optional[AttributeFilter] = None) -> Optional[AttributeFilter]:
+    """
+    Hard constraints for this question: `filters` from the request if given, otherwise (with
+    ATTRIBUTE_FILTERS) those the question states explicitly ("at least 5 years, with Python").
+    Request filters are always kept, even if no CV satisfies them (no candidates then).
+    Parsed ones are only a reading of the question: the attribute index counts the matching
+    CVs in milliseconds, and if none match, search runs unfiltered instead.
+    """
+    if filters is not None:
+        return None if filters.empty else filters
+    if not ATTRIBUTE_FILTERS:
+        return None
+    index = get_attribute_index()
+    filters = parse_filter(question, index.locations())
+    if filters.empty:
+        return None
+    if index.available():
+        with span("attribute_filter"):
+            matches = index.count(filters)
+        logger.debug("Attribute filter %s matches %d CVs", filters, matches)
+        if matches == 0:
+            return None
+    return filters
+
+
+def boost_mentioned(scored_docs: list, question: str, filters: Optional[AttributeFilter] = None) -> list:
+    """With ATTRIBUTE_FILTERS, skills the question only mentions lift matching CVs instead of filtering."""
+    if filters is not None or not ATTRIBUTE_FILTERS:
+        return scored_docs
+    return boost_results(scored_docs, boost_skills(question))
+
+
+def _search(query_vec, k: int, flt: Optional[AttributeFilter] = None) -> list:
+    with span("vector_search"):
+        return get_vector_store().search(query_vec, k, flt)
+
+
+async def _asearch(query_vec, k: int, flt: Optional[AttributeFilter] = None) -> list:
+    with span("vector_search"):
+        return await get_vector_store().asearch(query_vec, k, flt)
+
+
+def chunk_key(doc):
+    """Identifies the same chunk in vector and lexical results."""
+    return doc.metadata.get("chunk_id") or (doc.metadata.get("gcs_uri"), doc.metadata.get("start_index"),
+                                            doc.page_content[:64])
+
+
+def lexical_retrieve(question: str, flt: Optional[AttributeFilter] = None) -> list:
+    """BM25 over the local index; cheap enough to fetch the full over-fetch budget at once."""
+    index = get_lexical_index()
+    if not index.available():
+        return []
+    with span("lexical_search"):
+        return filter_results(index.search_documents(question, MAX_FETCH_K), flt)
+
+
+def _combine(mode: str, vector_docs: list, question: str, flt: Optional[AttributeFilter]) -> list:
+    if mode == "hybrid":
+        lexical_docs = lexical_retrieve(question, flt)
+        if lexical_docs:
+            return reciprocal_rank_fusion([vector_docs, lexical_docs], key=chunk_key)
+    return vector_docs
+
+
+def _check_mode(mode: Optional[str]) -> str:
+    mode = mode or RETRIEVAL_MODE
+    if mode not in ("vector", "lexical", "hybrid"):
+        raise ValueError(f"Unknown retrieval mode '{mode}', expected vector, lexical or hybrid")
+    return mode
+
+
+def retrieve(question: str, mode: Optional[str] = None, flt: Optional[AttributeFilter] = None) -> list:
+    """
+    Ranked (chunk, score) pairs for the question. Vector results come from the retrieval
+    cache or Vector Search, over-fetching just enough to fill TOP_CANDIDATES distinct CVs;
+    in hybrid mode they are fused with BM25 results by reciprocal rank.
+    `flt` (see resolve_filter) limits results to CVs that satisfy it.
+    """
+    mode = _check_mode(mode)
+    if mode == "lexical":
+        return lexical_retrieve(question, flt)
+    with span("embed"):
+        query_vec = get_embeddings().embed_query(question)
+    scored_docs = retrieval_cache.get(query_vec, scope=flt)
+    if scored_docs is None:
+        started = time.perf_counter()
+        k = TOP_CANDIDATES * CANDIDATE_OVERFETCH
+        scored_docs = _search(query_vec, k, flt)
+        if _needs_refetch(scored_docs, k):
+            k = refetch_size(k, count_candidates(scored_docs), TOP_CANDIDATES, MAX_FETCH_K)
+            scored_docs = _search(query_vec, k, flt)
+        retrieval_cache.put(query_vec, scored_docs, time.perf_counter() - started, scope=flt)
+    return _combine(mode, scored_docs, question, flt)
+
+
+async def aretrieve(question: str, mode: Optional[str] = None, flt: Optional[AttributeFilter] = None) -> list:
+    """
+    Async `retrieve`, with each upstream call under its concurrency limit. Concurrent
+    calls for the same normalized question, mode and filter share one embedding call and search.
+    Vertex AI embeddings and Vector Search have no async client, so LangChain runs them on
+    its executor; the local lookups run on threads too, keeping the event loop free.
+    """
+    mode = _check_mode(mode)
+    if not SINGLE_FLIGHT:
+        return await _aretrieve(question, mode, flt)
+    return await retrieval_flights.do((question_key(question), mode, flt), lambda: _aretrieve(question, mode, flt))
+
+
+async def _aretrieve(question: str, mode: str, flt: Optional[AttributeFilter]) -> list:
+    if mode == "lexical":
+        return await in_thread(lexical_retrieve, question, flt)
+    async with limits("embedding"):
+        with span("embed"):
+            query_vec = await get_embeddings().aembed_query(question)
+    scored_docs = retrieval_cache.get(query_vec, scope=flt)
+    if scored_docs is None:
+        started = time.perf_counter()
+        k = TOP_CANDIDATES * CANDIDATE_OVERFETCH
+        async with limits("vector_search"):
+            scored_docs = await _asearch(query_vec, k, flt)
+            if _needs_refetch(scored_docs, k):
+                k = refetch_size(k, count_candidates(scored_docs), TOP_CANDIDATES, MAX_FETCH_K)
+                scored_docs = await _asearch(query_vec, k, flt)
+        retrieval_cache.put(query_vec, scored_docs, time.perf_counter() - started, scope=flt)
+    if mode == "hybrid":
+        return await in_thread(_combine, mode, scored_docs, question, flt)
+    return scored_docs
+
+
+def context_docs(groups: list) -> list:
+    """The best snippets of every candidate, in candidate order, for the LLM context."""
+    return [doc for group in groups for doc in group.snippets(SNIPPETS_PER_CANDIDATE)]
+
+
+def prompt_messages(question: str, history: "BaseChatMessageHistory", groups: list):
+    """
+    Build the LLM messages within CONTEXT_TOKEN_BUDGET: history and retrieved snippets
+    share one budget, and snippets are packed by relevance/novelty (see context_packer.py).
+    Returns (messages, token usage).
+    """
+    messages = history.messages
+    # A compaction summary always goes in; trimming only drops the oldest verbatim turns
+    pinned = messages[:1] if messages and "summary" in messages[0].additional_kwargs else []
+    with span("context"):
+        history_msgs, context, usage = pack_prompt(
+            SYSTEM, question, messages[len(pinned):], context_docs(groups),
+            budget=CONTEXT_TOKEN_BUDGET, history_share=HISTORY_TOKEN_SHARE, pinned=pinned)
+        msgs = get_prompt().format_messages(history=history_msgs, question=question, context=context)
+    return msgs, usage
+
+
+def remember_turn(history: "BaseChatMessageHistory", question: str, answer: str, groups: list):
+    """
+    Append the question and answer to the history. With HISTORY_COMPACTION the answer also
+    records the IDs and names of the candidates shown, which outlive its text once folded.
+    """
+    if not HISTORY_COMPACTION:
+        history.add_user_message(question)
+        history.add_ai_message(answer)
+        return
+    from history_compaction import add_turn
+    add_turn(history, question, answer, [(group.id, candidate_name(group.filename)) for group in groups])
+
+
+def cv_url(doc) -> str:
+    """Where the CV file lives: bucket CVs only; uploaded ones (upload://<hash>) have no URL yet."""
+    source = doc.metadata.get("gcs_uri")
+    if source is None:
+        return f"gs://{BUCKET}/{doc.metadata.get('filename', '')}"   # chunks indexed before gcs_uri was stored
+    return source if source.startswith("gs://") else ""
+
+
+def build_cards(groups) -> list:
+    """One frontend card per grouped candidate."""
+    candidate_list = []
+    for group in groups:
+        best = group.hits[0][0]
+        filename = group.filename
+        name_from_file = candidate_name(filename)
+
+        # Skills of the candidate's best snippets, in order, deduplicated
+        skills = []
+        for doc in group.snippets(SNIPPETS_PER_CANDIDATE):
+            skills.extend(s for s in chunk_skills(doc) if s not in skills)
+
+        # Create a candidate object for the frontend card (one per CV, stable ID).
+        candidate_data = {
+            "id": group.id,
+            "name": name_from_file,
+            "role": "AI Candidate",  # You can make this more dynamic based on the content
+            "avatar": "",
+            "skills": skills[:5],
+            "location": best.metadata.get("cv_location", "").title(),
+            "experience": f"{best.metadata['cv_years']:g} years" if "cv_years" in best.metadata else "",
+            "cvUrl": cv_url(best),
+            "initials": ''.join([n[0] for n in name_from_file.split()[:2]]).upper(),
+            "gradientFrom": "#667eea",
+            "gradientTo": "#764ba2",
+            "score": round(group.score, 4),
+            "matchedChunks": len(group.hits),
+            "text": best.page_content[:500] + "..." if len(best.page_content) > 500 else best.page_content
+        }
+        candidate_list.append(candidate_data)
+    results.remember({group.id: group.key for group in groups})
+    return candidate_list
+
+
+def build_response(groups, answer: str) -> dict:
+    """Turn grouped candidates plus the LLM answer into the payload the frontend expects."""
+    # --- Always return structured data if we found CVs ---
+    if groups:  # Simplified condition: if we found any CV chunks
         # Return structured data for candidate cards
         return {
             "type": "candidates",
-            "content": candidate_list,
-            "llmResponse": resp.content  # Also include the LLM's text summary
+            "content": build_cards(groups),
+            "llmResponse": answer  # Also include the LLM's text summary
         }
     else:
         # If no CVs were found, return just the text
-        print("No CVs found. Returning text response only.")  # Debug print
         return {
             "type": "text",
-            "content": resp.content
+            "content": answer
         }
 
+
+def ask(question: str, history: "BaseChatMessageHistory", mode: Optional[str] = None,
+        filters: Optional[AttributeFilter] = None) -> dict:
+    """
+    Sends a question to the RAG chatbot and returns a structured response.
+    `mode` picks vector, lexical (BM25) or hybrid retrieval; defaults to RETRIEVAL_MODE.
+    `filters` are hard constraints on the CVs; with ATTRIBUTE_FILTERS they are parsed from the question.
+    """
+    logger.debug("New question: %r", question)
+
+    # Retrieve relevant chunks and collapse them into candidates
+    flt = resolve_filter(question, filters)
+    scored_docs = boost_mentioned(retrieve(question, mode, flt), question, filters)
+    groups = group_candidates(scored_docs, TOP_CANDIDATES, CANDIDATE_FUSION)
+    logger.debug("Retrieved %d chunks from %d candidates", len(scored_docs), len(groups))
+
+    # Build the messages for the LLM (token-budgeted)
+    msgs, usage = prompt_messages(question, history, groups)
+
+    # Get the LLM's text response
+    with span("llm"):
+        resp = get_llm().invoke(msgs)
+
+    # Update history
+    remember_turn(history, question, resp.content, groups)
+
+    with span("cards"):
+        response = build_response(groups, resp.content)
+    response["tokens"] = usage
+    response["filters"] = flt._asdict() if flt else None
+    return response
+
+
+async def aask(question: str, history: "BaseChatMessageHistory", mode: Optional[str] = None,
+               filters: Optional[AttributeFilter] = None) -> dict:
+    """
+    Async version of `ask`: every upstream call is awaited under its own concurrency
+    limit. Only the Gemini call is natively async; embedding, Vector Search and the local
+    SQLite/BM25 lookups block, so they run on executor threads rather than the event loop.
+    """
+    logger.debug("New question: %r", question)
+
+    # Embed the question, then search by vector (separate limits per upstream)
+    flt = await in_thread(resolve_filter, question, filters)
+    scored_docs = boost_mentioned(await aretrieve(question, mode, flt), question, filters)
+    groups = group_candidates(scored_docs, TOP_CANDIDATES, CANDIDATE_FUSION)
+    logger.debug("Retrieved %d chunks from %d candidates", len(scored_docs), len(groups))
+
+    msgs, usage = prompt_messages(question, history, groups)
+    resp = await _ainvoke_llm(msgs)
+
+    remember_turn(history, question, resp.content, groups)
+
+    with span("cards"):
+        response = await in_thread(build_response, groups, resp.content)
+    response["tokens"] = usage
+    response["filters"] = flt._asdict() if flt else None
+    return response
+
+async def _ainvoke_llm(msgs: list):
+    """The LLM answer; identical prompts in flight at the same time (same history, context, question) share one call."""
+    async def call():
+        async with limits("llm"):
+            with span("llm"):
+                return await get_llm().ainvoke(msgs)
+    if not SINGLE_FLIGHT:
+        return await call()
+    return await llm_flights.do(messages_key(msgs), call)
+
+
+async def aask_stream(question: str, history: "BaseChatMessageHistory", mode: Optional[str] = None,
+                      filters: Optional[AttributeFilter] = None) -> AsyncIterator[dict]:
+    """
+    Streaming `aask`: yields the candidate cards as soon as retrieval is done
+    ({"type": "candidates"}, or {"type": "text"} without matches), then the summary as
+    {"type": "token"} pieces, then {"type": "done"} with the full answer. History is only
+    updated once the answer is complete, so an abandoned stream leaves it untouched.
+    """
+    logger.debug("New streamed question: %r", question)
+
+    flt = await in_thread(resolve_filter, question, filters)
+    scored_docs = boost_mentioned(await aretrieve(question, mode, flt), question, filters)
+    groups = group_candidates(scored_docs, TOP_CANDIDATES, CANDIDATE_FUSION)
+    msgs, usage = prompt_messages(question, history, groups)
+
+    with span("cards"):
+        cards = await in_thread(build_cards, groups) if groups else None
+        head = {"type": "candidates", "content": cards} if groups else {"type": "text"}
+    head["tokens"] = usage
+    head["filters"] = flt._asdict() if flt else None
+    yield head
+
+    parts = []
+    async with limits("llm"):
+        with span("llm"):
+            started = time.perf_counter()
+            async for chunk in get_llm().astream(msgs):
+                if not chunk.content:
+                    continue
+                if not parts:
+                    STAGE_SECONDS.observe(time.perf_counter() - started, stage="llm_first_token")
+                parts.append(chunk.content)
+                yield {"type": "token", "content": chunk.content}
+
+    answer = "".join(parts)
+    remember_turn(history, question, answer, groups)
+    yield {"type": "done", "llmResponse": answer}
+
+
+_candidate_keys: Dict[str, object] = {"snapshot": None, "keys": {}}
+
+
+def candidate_source(cid: str) -> Optional[str]:
+    """The gcs_uri behind a candidate ID: recently returned cards first, else every indexed CV."""
+    key = results.source(cid)
+    if key is not None:
+        return key
+    keys = get_attribute_index().all_keys()
+    if _candidate_keys["snapshot"] is not keys:
+        _candidate_keys["keys"] = {candidate_id(k): k for k in keys}
+        _candidate_keys["snapshot"] = keys
+    return _candidate_keys["keys"].get(cid)
+
+
+def candidate_text(cid: str) -> Optional[str]:
+    """Full text of a candidate's CV, stitched back together from its indexed chunks."""
+    key = candidate_source(cid)
+    if key is None:
+        return None
+    chunks = get_lexical_index().source_chunks(key)
+    if not chunks:
+        return None
+    return merge_chunks([(metadata.get("start_index", 0), text) for text, metadata in chunks])
+
+
 # Helper function to extract skills (optional but makes cards much better)
 def extract_skills_from_text(text: str) -> list:
-    """A simple function to extract potential skills from CV text."""
-    skills_keywords = ["python", "java", "react", "node", "js", "javascript", "machine learning", "ai", 
-                      "tensorflow", "pytorch", "sql", "aws", "docker", "kubernetes", "git", 
-                      "c++", "html", "css", "fastapi", "django", "flask", "vue", "angular"]
-    found_skills = []
-    text_lower = text.lower()
-    for skill in skills_keywords:
-        if skill in text_lower:
-            # Capitalize the skill for display
-            found_skills.append(skill.title())
-    # Return unique skills, max 5 to not overcrowd the card
-    return list(set(found_skills))[:5]
\ No newline at end of file
+    """Skills found in CV text, in order of appearance, max 5 to not overcrowd the card."""
+    return extract_skills(text, limit=5)
+
+
+def chunk_skills(doc) -> list:
+    """Skills stored on the chunk at ingest time; only chunks ingested before that are scanned."""
+    skills = doc.metadata.get("skills")
+    if skills is None:
+        return extract_skills_from_text(doc.page_content)
+    return list(skills)[:5]
@@ -0,0 +1,82 @@
+# file: cold_start_benchmark.py
+"""
+Cold-start benchmark for the API: import time of app.py, the slowest imports,
+and first-request latency of /, /new_session and /warmup, each in a fresh process.
+
+    python cold_start_benchmark.py --runs 5 --json cold_start.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Runs inside a fresh interpreter; prints one JSON line of timings
+_PROBE = r"""
+import json, time
+t0 = time.perf_counter()
+import app
+timings = {"import_app": time.perf_counter() - t0}
+from fastapi.testclient import TestClient
+with TestClient(app.app) as client:
+    for name, method, path in [("first_root", "get", "/"),
+                               ("first_new_session", "get", "/new_session"),
+                               ("warmup", "post", "/warmup" if WARMUP else None)]:
+        if path is None:
+            continue
+        t0 = time.perf_counter()
+        getattr(client, method)(path)
+        timings[name] = time.perf_counter() - t0
+print(json.dumps(timings))
+"""
+
+
+def _probe(warmup: bool) -> dict:
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    # Don't let a startup warmup thread race the measurements
+    code = f"WARMUP = {warmup}\nimport config_manager\nconfig_manager.ConfigManager().WARMUP_ON_STARTUP = False\n" + _PROBE
+    out = subprocess.run([sys.executable, "-c", code], cwd=HERE, env=env,
+                         capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def slowest_imports(top: int = 15) -> list:
+    """Top cumulative import times for `import app`, from python -X importtime."""
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"], cwd=HERE,
+                         capture_output=True, text=True)
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append({"module": name.strip(), "cumulative_ms": int(cumulative_us) / 1000})
+    rows.sort(key=lambda r: r["cumulative_ms"], reverse=True)
+    return rows[:top]
+
+
+def run(runs: int = 5, warmup: bool = False) -> dict:
+    samples = [_probe(warmup) for _ in range(runs)]
+    summary = {}
+    for key in samples[0]:
+        values = [s[key] for s in samples]
+        summary[key] = {"median_s": round(statistics.median(values), 4),
+                        "max_s": round(max(values), 4)}
+    return {"runs": runs, "timings": summary, "slowest_imports": slowest_imports()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import-time and first-request latency of app.py")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--warmup", action="store_true",
+                        help="also time POST /warmup (builds the real Vertex AI clients)")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    result = run(args.runs, args.warmup)
+    print(json.dumps(result, indent=2))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
@@ -0,0 +1,127 @@
+# file: context_packer.py
+import math
+import re
+from typing import List, Sequence, Set, Tuple
+
+_SENTENCE_END = re.compile(r"(?<=[.!?;])\s+|\n+")
+_WORD = re.compile(r"[a-z0-9+#.]+")
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token for English CV text); no model call."""
+    return max(1, math.ceil(len(text) / 4)) if text else 0
+
+
+def split_sentences(text: str) -> List[str]:
+    return [s.strip() for s in _SENTENCE_END.split(text) if s and s.strip()]
+
+
+def _word_set(text: str) -> Set[str]:
+    return set(_WORD.findall(text.lower()))
+
+
+def _similarity(a: Set[str], b: Set[str]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def trim_history(messages: Sequence, budget: int) -> Tuple[list, int]:
+    """
+    Newest whole turns (a human message and the answers after it) that fit in `budget`
+    tokens, kept in order, and the tokens they use; an answer never loses its question.
+    """
+    turns: List[list] = []
+    for message in messages:
+        if not turns or getattr(message, "type", None) == "human":
+            turns.append([])
+        turns[-1].append(message)
+    kept, used = [], 0
+    for turn in reversed(turns):
+        cost = sum(estimate_tokens(str(m.content)) for m in turn)
+        if used + cost > budget:
+            break
+        kept.append(turn)
+        used += cost
+    return [m for turn in reversed(kept) for m in turn], used
+
+
+def pack_chunks(docs: Sequence, budget: int, mmr_lambda: float = 0.7,
+                duplicate_threshold: float = 0.8) -> Tuple[str, dict]:
+    """
+    Choose and pack chunks into at most `budget` tokens.
+    `docs` arrive ranked by relevance. Chunks are picked greedily by MMR
+    (relevance vs. word overlap with what is already packed), near-duplicates
+    (overlap >= duplicate_threshold) are dropped, and chunks are cut at sentence
+    boundaries when the budget runs out.
+    """
+    n = len(docs)
+    words = [_word_set(d.page_content) for d in docs]
+    relevance = [1.0 - i / max(n, 1) for i in range(n)]
+    remaining = list(range(n))
+    selected: List[int] = []
+    parts: List[str] = []
+    used = 0
+    duplicates = 0
+
+    while remaining and used < budget:
+        best, best_score = None, -math.inf
+        for i in list(remaining):
+            redundancy = max((_similarity(words[i], words[j]) for j in selected), default=0.0)
+            if redundancy >= duplicate_threshold:
+                remaining.remove(i)
+                duplicates += 1
+                continue
+            score = mmr_lambda * relevance[i] - (1 - mmr_lambda) * redundancy
+            if score > best_score:
+                best, best_score = i, score
+        if best is None:
+            break
+        remaining.remove(best)
+
+        # Whole sentences only, as many as still fit
+        doc = docs[best]
+        source = f"(source: {doc.metadata.get('filename')})"
+        header_cost = estimate_tokens(source) + 2
+        sentences = []
+        cost = header_cost
+        for sentence in split_sentences(doc.page_content):
+            sentence_cost = estimate_tokens(sentence) + 1
+            if used + cost + sentence_cost > budget:
+                break
+            sentences.append(sentence)
+            cost += sentence_cost
+        if not sentences:
+            continue   # doesn't fit; shorter, lower-ranked chunks still may
+        selected.append(best)
+        parts.append(f"[{len(parts) + 1}] {' '.join(sentences)}\n{source}")
+        used += cost
+
+    return "\n\n---\n\n".join(parts), {
+        "context": used,
+        "chunks": len(selected),
+        "duplicates_dropped": duplicates,
+    }
+
+
+def pack_prompt(system: str, question: str, history: Sequence, docs: Sequence,
+                budget: int, history_share: float = 0.4, pinned: Sequence = ()) -> Tuple[list, str, dict]:
+    """
+    Split one token budget between the prompt parts: system prompt, question and `pinned`
+    history (e.g. a conversation summary) first, then the newest history (up to
+    `history_share` of the budget), then retrieved context.
+    Returns (history messages to send, packed context, token usage).
+    """
+    fixed = estimate_tokens(system) + estimate_tokens(question) + sum(estimate_tokens(str(m.content)) for m in pinned)
+    history_budget = max(0, min(int(budget * history_share), budget - fixed))
+    kept_history, history_tokens = trim_history(history, history_budget)
+    kept_history = list(pinned) + kept_history
+    context, usage = pack_chunks(docs, max(0, budget - fixed - history_tokens))
+    usage.update({
+        "budget": budget,
+        "fixed": fixed,
+        "history": history_tokens,
+        "history_messages": len(kept_history) - len(pinned),
+        "total": fixed + history_tokens + usage["context"],
+    })
+    return kept_history, context, usage
@@ -1,40 +1,215 @@
+import argparse
 import json
-import faiss
+import shutil
+import threading
+from typing import Optional
 import numpy as np
-from sentence_transformers import SentenceTransformer
+import ann_benchmark
+from faiss_store import INDEX_TYPES, FaissStore, search_params
+from config_manager import ConfigManager
+from embedding_cache import CachedEmbeddings, EmbeddingCache
+from bm25_index import BM25Index, reciprocal_rank_fusion
+from attribute_index import AttributeFilter, AttributeIndex, extract_attributes
 
-# 1. Load CVs
-with open("cvs.json", "r") as f:
-    cvs = json.load(f)
+config = ConfigManager()
 
-# 2. Load embedding model
-model = SentenceTransformer("all-MiniLM-L6-v2")  # lightweight, fast
+# The index is built once (`python cv_search.py build`) and then only opened from disk
+INDEX_PATH = getattr(config, "CV_INDEX_PATH", "cv_index")
+INDEX_TYPE = getattr(config, "CV_INDEX_TYPE", "flat")   # flat | ivf | ivfpq | hnsw
+MODEL_NAME = "all-MiniLM-L6-v2"  # lightweight, fast
 
-# 3. Create embeddings for CVs
-cv_texts = [cv["text"] for cv in cvs]
-cv_embeddings = model.encode(cv_texts)
+_model = None
+_store = None
+_lexical = None
+_attributes = None
+_lock = threading.Lock()
 
-# Convert to numpy float32 (FAISS requirement)
-cv_embeddings = np.array(cv_embeddings).astype("float32")
 
-# 4. Initialize FAISS index
-dim = cv_embeddings.shape[1]
-index = faiss.IndexFlatL2(dim)  # L2 distance
-index.add(cv_embeddings)
+# 1. Load embedding model lazily (cached on disk, so reruns skip the model for known texts)
+def get_model() -> CachedEmbeddings:
+    global _model
+    if _model is None:
+        with _lock:
+            if _model is None:
+                from sentence_transformers import SentenceTransformer
+                _model = CachedEmbeddings(
+                    SentenceTransformer(MODEL_NAME),
+                    model_name=MODEL_NAME,
+                    dimensions=384,
+                    cache=EmbeddingCache.from_config(config),
+                )
+    return _model
 
-# 5. Search function
-def search(query, top_k=2):
-    query_vec = model.encode([query]).astype("float32")
-    distances, indices = index.search(query_vec, top_k)
-    results = []
-    for idx in indices[0]:
-        results.append(cvs[idx])
-    return results
 
-# 6. Try a query
+# 2. Open the persisted index memory-mapped (shared by every worker process)
+def get_store() -> FaissStore:
+    global _store
+    if _store is None:
+        with _lock:
+            if _store is None:
+                _store = FaissStore.open(INDEX_PATH, mmap=True)
+    else:
+        _store.reload_if_changed()
+    return _store
+
+
+def lexical_index(index_path: str = INDEX_PATH) -> BM25Index:
+    """BM25 index kept next to the FAISS index, keyed by the same CV IDs."""
+    return BM25Index(f"{index_path}_bm25")
+
+
+def get_lexical() -> BM25Index:
+    global _lexical
+    if _lexical is None:
+        with _lock:
+            if _lexical is None:
+                _lexical = lexical_index()
+    return _lexical
+
+
+def attribute_index(index_path: str = INDEX_PATH) -> AttributeIndex:
+    """Per-CV years / degree / location / skills, keyed by the same CV IDs."""
+    return AttributeIndex(f"{index_path}_attributes")
+
+
+def get_attributes() -> AttributeIndex:
+    global _attributes
+    if _attributes is None:
+        with _lock:
+            if _attributes is None:
+                _attributes = attribute_index()
+    return _attributes
+
+
+def _index_text(index_path: str, ids, cvs: list):
+    lexical = lexical_index(index_path)
+    lexical.add([str(i) for i in ids], [cv["text"] for cv in cvs], [{} for _ in cvs])
+    lexical.compile()
+    attributes = attribute_index(index_path)
+    attributes.put({str(i): extract_attributes(cv["text"]) for i, cv in zip(ids, cvs)})
+    attributes.compile()
+
+
+# 3. Build command: encode every CV once and write index + ID->record sidecar
+def build(cvs_path: str = "cvs.json", index_path: str = INDEX_PATH,
+          index_type: str = INDEX_TYPE) -> FaissStore:
+    with open(cvs_path, "r") as f:
+        cvs = json.load(f)
+    cv_embeddings = get_model().encode([cv["text"] for cv in cvs])
+    store = FaissStore.build(index_path, cv_embeddings, cvs, index_type=index_type)
+    for side_index in (lexical_index(index_path), attribute_index(index_path)):
+        shutil.rmtree(side_index.path, ignore_errors=True)
+    _index_text(index_path, range(len(cvs)), cvs)
+    return store
+
+
+# 4. Incremental updates without a full rebuild
+def add(cvs: list, index_path: str = INDEX_PATH) -> list:
+    store = FaissStore.open(index_path, writable=True)
+    ids = store.add(get_model().encode([cv["text"] for cv in cvs]), cvs)
+    store.save()
+    _index_text(index_path, ids, cvs)
+    return ids
+
+
+def remove(ids: list, index_path: str = INDEX_PATH) -> int:
+    store = FaissStore.open(index_path, writable=True)
+    removed = store.remove(ids)
+    store.save()
+    for side_index in (lexical_index(index_path), attribute_index(index_path)):
+        side_index.delete([str(i) for i in ids])
+        side_index.compile()
+    return removed
+
+
+# 5. Search functions (nprobe / ef_search only apply to IVF / HNSW indexes)
+def _lexical_ranking(query: str, k: int) -> list:
+    """(CV ID, BM25 score) pairs, best first."""
+    lexical = get_lexical()
+    hits = lexical.search(query, k)
+    found = lexical.chunks([row for row, _ in hits])
+    return [(int(found[row][0]), score) for row, score in hits if row in found]
+
+
+def _allowed_ids(filters: Optional[AttributeFilter]) -> Optional[np.ndarray]:
+    """IDs of the CVs that satisfy `filters` (None = no filtering)."""
+    attributes = get_attributes()
+    if filters is None or filters.empty or not attributes.available():
+        return None
+    return np.array(attributes.keys(attributes.match(filters)), dtype="int64")
+
+
+def search_many(queries, top_k=2, nprobe=None, ef_search=None, mode="vector",
+                filters: Optional[AttributeFilter] = None):
+    """
+    One encode batch and one index.search call for all queries; one result list per query.
+    mode="lexical" ranks by BM25 only, mode="hybrid" fuses both rankings by reciprocal rank.
+    `filters` restricts every query to the CVs that satisfy them, before the vector search.
+    """
+    if not queries:
+        return []
+    if mode not in ("vector", "lexical", "hybrid"):
+        raise ValueError(f"Unknown search mode '{mode}', expected vector, lexical or hybrid")
+    store = get_store()
+    allowed = _allowed_ids(filters)
+    rankings = [[] for _ in queries]
+    if mode != "lexical":
+        query_vecs = get_model().encode(list(queries))
+        # Hybrid fetches a deeper vector list so fusion has something to re-rank
+        k = top_k if mode == "vector" else top_k * 5
+        if allowed is None:
+            params = search_params(store.index, nprobe=nprobe, ef_search=ef_search)
+            distances, indices = store.search(query_vecs, k, params=params)
+        else:
+            distances, indices = store.search_subset(query_vecs, k, allowed, nprobe=nprobe, ef_search=ef_search)
+        rankings = [[(idx, dist) for idx, dist in zip(row, drow) if idx >= 0]
+                    for row, drow in zip(indices.tolist(), distances.tolist())]
+    if mode != "vector" and get_lexical().available():
+        allowed_set = None if allowed is None else set(allowed.tolist())
+        for i, query in enumerate(queries):
+            lexical = _lexical_ranking(query, top_k * 5)
+            if allowed_set is not None:
+                lexical = [(idx, score) for idx, score in lexical if idx in allowed_set]
+            rankings[i] = lexical if mode == "lexical" else \
+                reciprocal_rank_fusion([rankings[i], lexical], key=lambda idx: idx)
+    rankings = [[idx for idx, _ in ranking[:top_k]] for ranking in rankings]
+    records = store.records(np.unique([idx for ranking in rankings for idx in ranking]))
+    return [[dict(records[idx], id=idx) for idx in ranking if idx in records]
+            for ranking in rankings]
+
+
+def search(query, top_k=2, nprobe=None, ef_search=None, mode="vector", filters=None):
+    return search_many([query], top_k, nprobe=nprobe, ef_search=ef_search, mode=mode, filters=filters)[0]
+
+
+# 6. Command line: build / add / remove, or try a query
 if __name__ == "__main__":
-    query = input("Enter your query: ")
-    results = search(query, top_k=2)
-    print("\nTop matches:")
-    for r in results:
-        print(f"- {r['name']}: {r['text']}")
+    parser = argparse.ArgumentParser(description="Local FAISS search over CVs")
+    sub = parser.add_subparsers(dest="command")
+    build_cmd = sub.add_parser("build", help="encode CVs and write the index to disk")
+    build_cmd.add_argument("--cvs", default="cvs.json")
+    build_cmd.add_argument("--index-type", default=INDEX_TYPE, choices=INDEX_TYPES)
+    add_cmd = sub.add_parser("add", help="add CVs from a JSON file to the existing index")
+    add_cmd.add_argument("cvs")
+    remove_cmd = sub.add_parser("remove", help="remove CVs by ID")
+    remove_cmd.add_argument("ids", nargs="+", type=int)
+    bench_cmd = sub.add_parser("bench", help="recall/latency benchmark of the ANN index types")
+    ann_benchmark.add_arguments(bench_cmd)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        store = build(args.cvs, index_type=args.index_type)
+        print(f"Wrote {store.ntotal} CVs to {INDEX_PATH}.faiss")
+    elif args.command == "add":
+        with open(args.cvs, "r") as f:
+            print(f"Added IDs: {add(json.load(f))}")
+    elif args.command == "remove":
+        print(f"Removed {remove(args.ids)} CVs")
+    elif args.command == "bench":
+        ann_benchmark.main(args)
+    else:
+        query = input("Enter your query: ")
+        results = search(query, top_k=2)
+        print("\nTop matches:")
+        for r in results:
+            print(f"- {r['name']}: {r['text']}")
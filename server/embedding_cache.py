@@ -0,0 +1,237 @@
+# file: embedding_cache.py
+import asyncio
+import hashlib
+import math
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# SQLite caps the number of bound parameters per statement
+_LOOKUP_BATCH = 500
+# Cache hits refresh last_used in batches: after this many hits or seconds, or before an eviction
+TOUCH_FLUSH_ENTRIES = 512
+TOUCH_FLUSH_SECONDS = 30.0
+
+
+def normalize_text(text: str) -> str:
+    """Whitespace/unicode normalization so trivially different strings share a cache entry."""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", text)).strip()
+
+
+class EmbeddingCache:
+    """
+    On-disk embedding store shared by every process on the machine.
+    Keys are sha256(model | dimensions | kind | normalized text), values are float16/float32 blobs.
+    Once the store grows past `max_bytes` the least recently used entries are evicted.
+    The total size lives in a one-row table kept current by triggers, so checking the
+    budget never scans the store, whichever process wrote last.
+    """
+
+    def __init__(self, path: str = "embedding_cache.sqlite", max_bytes: int = 1 << 30,
+                 dtype: str = "float16"):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.dtype = np.dtype(dtype)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._touched: Dict[bytes, float] = {}
+        self._flushed = time.monotonic()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        # One transaction, so the size row starts out matching the rows already stored
+        self._conn.executescript("""
+            BEGIN IMMEDIATE;
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key BLOB PRIMARY KEY, dtype TEXT NOT NULL, vec BLOB NOT NULL,
+                nbytes INTEGER NOT NULL, last_used REAL NOT NULL);
+            CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings(last_used);
+            CREATE TABLE IF NOT EXISTS cache_size (
+                id INTEGER PRIMARY KEY CHECK (id = 0), bytes INTEGER NOT NULL, entries INTEGER NOT NULL);
+            INSERT OR IGNORE INTO cache_size SELECT 0, COALESCE(SUM(nbytes), 0), COUNT(*) FROM embeddings;
+            CREATE TRIGGER IF NOT EXISTS embeddings_insert AFTER INSERT ON embeddings BEGIN
+                UPDATE cache_size SET bytes = bytes + NEW.nbytes, entries = entries + 1; END;
+            CREATE TRIGGER IF NOT EXISTS embeddings_update AFTER UPDATE OF nbytes ON embeddings BEGIN
+                UPDATE cache_size SET bytes = bytes + NEW.nbytes - OLD.nbytes; END;
+            CREATE TRIGGER IF NOT EXISTS embeddings_delete AFTER DELETE ON embeddings BEGIN
+                UPDATE cache_size SET bytes = bytes - OLD.nbytes, entries = entries - 1; END;
+            COMMIT;
+        """)
+
+    @classmethod
+    def from_config(cls, config) -> "EmbeddingCache":
+        return cls(
+            path=getattr(config, "EMBEDDING_CACHE_PATH", "embedding_cache.sqlite"),
+            max_bytes=int(getattr(config, "EMBEDDING_CACHE_MAX_MB", 1024)) << 20,
+            dtype=getattr(config, "EMBEDDING_CACHE_DTYPE", "float16"),
+        )
+
+    @staticmethod
+    def make_key(namespace: str, text: str) -> bytes:
+        return hashlib.sha256(f"{namespace}|{normalize_text(text)}".encode("utf-8")).digest()
+
+    def get_many(self, keys: Sequence[bytes]) -> List[Optional[np.ndarray]]:
+        """Batched lookup; returns float32 vectors, or None for misses."""
+        found: Dict[bytes, np.ndarray] = {}
+        unique = list(dict.fromkeys(keys))
+        with self._lock:
+            for start in range(0, len(unique), _LOOKUP_BATCH):
+                part = unique[start:start + _LOOKUP_BATCH]
+                marks = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT key, dtype, vec FROM embeddings WHERE key IN ({marks})", part).fetchall()
+                for key, dtype, vec in rows:
+                    found[key] = np.frombuffer(vec, dtype=dtype).astype(np.float32)
+            if found:
+                now = time.time()
+                self._touched.update((k, now) for k in found)
+                if (len(self._touched) >= TOUCH_FLUSH_ENTRIES
+                        or time.monotonic() - self._flushed >= TOUCH_FLUSH_SECONDS):
+                    self._flush_touches()
+                    self._conn.commit()
+            results = [found.get(k) for k in keys]
+            hits = sum(r is not None for r in results)
+            self.hits += hits
+            self.misses += len(results) - hits
+        return results
+
+    def put_many(self, keys: Sequence[bytes], vectors: Sequence[Sequence[float]]):
+        now = time.time()
+        rows = []
+        for key, vec in zip(keys, vectors):
+            blob = np.asarray(vec, dtype=self.dtype).tobytes()
+            rows.append((key, self.dtype.name, blob, len(blob), now))
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO embeddings (key, dtype, vec, nbytes, last_used) VALUES (?, ?, ?, ?, ?)"
+                " ON CONFLICT(key) DO UPDATE SET dtype = excluded.dtype, vec = excluded.vec,"
+                " nbytes = excluded.nbytes, last_used = excluded.last_used",
+                rows)
+            self._conn.commit()
+            self._evict()
+
+    def _flush_touches(self):
+        # Caller holds the lock and commits
+        if self._touched:
+            self._conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?",
+                                   [(t, k) for k, t in self._touched.items()])
+            self._touched.clear()
+        self._flushed = time.monotonic()
+
+    def _evict(self):
+        total, count = self._conn.execute("SELECT bytes, entries FROM cache_size").fetchone()
+        if total <= self.max_bytes or count == 0:
+            return
+        # Recent hits must count before choosing the least recently used
+        self._flush_touches()
+        # Trim to 90% of the budget so we don't evict again on the very next insert
+        n = math.ceil((total - self.max_bytes * 0.9) / (total / count))
+        cur = self._conn.execute(
+            "DELETE FROM embeddings WHERE key IN "
+            "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)", (n,))
+        self._conn.commit()
+        self.evictions += cur.rowcount
+
+    def stats(self) -> dict:
+        with self._lock:
+            size, entries = self._conn.execute("SELECT bytes, entries FROM cache_size").fetchone()
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": entries,
+                "bytes": size,
+            }
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Puts an EmbeddingCache in front of any embedder: a LangChain `Embeddings`
+    (e.g. VertexAIEmbeddings) or anything with `.encode` (e.g. SentenceTransformer).
+    Only cache misses are sent to the model, in one batch.
+    """
+
+    def __init__(self, embedder, model_name: str, dimensions: Optional[int] = None,
+                 cache: Optional[EmbeddingCache] = None):
+        self.embedder = embedder
+        self.model_name = model_name
+        self.dimensions = dimensions
+        self.cache = cache or EmbeddingCache()
+
+    def _namespace(self, kind: str) -> str:
+        # Query and document embeddings differ for task-typed models like text-embedding-005
+        return f"{self.model_name}|{self.dimensions}|{kind}"
+
+    def _compute(self, texts: List[str], kind: str) -> List[List[float]]:
+        if hasattr(self.embedder, "embed_documents"):
+            if kind == "query":
+                return [self.embedder.embed_query(t) for t in texts]
+            return self.embedder.embed_documents(texts)
+        return np.asarray(self.embedder.encode(texts), dtype=np.float32).tolist()
+
+    async def _acompute(self, texts: List[str], kind: str) -> List[List[float]]:
+        if hasattr(self.embedder, "aembed_documents"):
+            if kind == "query":
+                return [await self.embedder.aembed_query(t) for t in texts]
+            return await self.embedder.aembed_documents(texts)
+        return await asyncio.get_running_loop().run_in_executor(None, self._compute, texts, kind)
+
+    def _lookup(self, texts: List[str], kind: str):
+        namespace = self._namespace(kind)
+        keys = [EmbeddingCache.make_key(namespace, t) for t in texts]
+        cached = self.cache.get_many(keys)
+        # Misses are filled with a single model call (duplicates are embedded once)
+        missing: Dict[bytes, str] = {}
+        for key, text, vec in zip(keys, texts, cached):
+            if vec is None:
+                missing.setdefault(key, text)
+        return keys, cached, missing
+
+    def _merge(self, keys, cached, missing, vectors) -> List[List[float]]:
+        computed: Dict[bytes, List[float]] = {}
+        if missing:
+            computed = dict(zip(missing.keys(), vectors))
+            self.cache.put_many(list(computed.keys()), list(computed.values()))
+        return [vec.tolist() if vec is not None else list(computed[key])
+                for key, vec in zip(keys, cached)]
+
+    def _embed(self, texts: List[str], kind: str) -> List[List[float]]:
+        keys, cached, missing = self._lookup(texts, kind)
+        vectors = self._compute(list(missing.values()), kind) if missing else []
+        return self._merge(keys, cached, missing, vectors)
+
+    async def _aembed(self, texts: List[str], kind: str) -> List[List[float]]:
+        # SQLite may wait on another process's write lock, so it runs on a thread, not the event loop
+        loop = asyncio.get_running_loop()
+        keys, cached, missing = await loop.run_in_executor(None, self._lookup, texts, kind)
+        vectors = await self._acompute(list(missing.values()), kind) if missing else []
+        return await loop.run_in_executor(None, self._merge, keys, cached, missing, vectors)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed(texts, "document")
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed([text], "query")[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self._aembed(texts, "document")
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self._aembed([text], "query"))[0]
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """SentenceTransformer-style entry point used by cv_search."""
+        return np.asarray(self._embed(list(texts), "document"), dtype=np.float32)
+
+    def stats(self) -> dict:
+        return self.cache.stats()
@@ -0,0 +1,272 @@
+# file: faiss_store.py
+import json
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import faiss
+import numpy as np
+
+
+# Index types selectable for FaissStore.build / cv_search (see factory_string)
+INDEX_TYPES = ("flat", "ivf", "ivfpq", "hnsw")
+
+
+def factory_string(index_type: str, n: int, dim: int) -> str:
+    """FAISS factory string for `index_type`, sized for a corpus of `n` vectors."""
+    index_type = index_type.lower()
+    # ~4*sqrt(n) lists, but keep at least 39 training points per list
+    nlist = max(1, min(int(4 * n ** 0.5), n // 39))
+    if index_type == "flat":
+        return "Flat"
+    if index_type == "ivf":
+        return f"IVF{nlist},Flat"
+    if index_type == "ivfpq":
+        m = next(m for m in (dim // 8, dim // 4, dim // 2, dim) if m and dim % m == 0)
+        nbits = max(1, min(8, n.bit_length() - 1))   # 2**nbits centroids need as many points
+        return f"IVF{nlist},PQ{m}x{nbits}"
+    if index_type == "hnsw":
+        return "HNSW32"
+    raise ValueError(f"Unknown index type '{index_type}', expected one of {INDEX_TYPES}")
+
+
+def search_params(index, nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+                  ids: Optional[np.ndarray] = None):
+    """
+    Per-call search knobs (nprobe for IVF, efSearch for HNSW) and, if `ids` is given, a selector
+    restricting results to those IDs; None if nothing applies.
+    """
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap2) else index
+    kwargs = {}
+    if ids is not None:
+        kwargs["sel"] = faiss.IDSelectorBatch(np.asarray(ids, dtype="int64"))
+        if isinstance(inner, faiss.IndexHNSW):
+            # The graph walk skips filtered-out nodes, so it needs a wider beam to fill k
+            ef_search = max(ef_search or 0, 256)
+    if nprobe is not None and isinstance(inner, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(nprobe=nprobe, **kwargs)
+    if ef_search is not None and isinstance(inner, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(efSearch=ef_search, **kwargs)
+    return faiss.SearchParameters(**kwargs) if kwargs else None
+
+
+def build_index(vectors: np.ndarray, ids: np.ndarray, index_type: str = "flat",
+                train_size: int = 100_000):
+    """IDMap2-wrapped index of `index_type`, trained on a random sample of at most `train_size` vectors."""
+    n, dim = vectors.shape
+    index = faiss.index_factory(dim, f"IDMap2,{factory_string(index_type, n, dim)}")
+    if not index.is_trained:
+        sample = vectors
+        if n > train_size:
+            rows = np.random.default_rng(0).choice(n, train_size, replace=False)
+            sample = vectors[np.sort(rows)]
+        index.train(sample)
+    index.add_with_ids(vectors, ids)
+    return index
+
+
+def _mmap_flags() -> int:
+    # Newer FAISS can mmap flat codes directly; older versions only mmap IVF lists
+    return getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+
+class FaissStore:
+    """
+    A FAISS index persisted as `<path>.faiss` plus an ID -> record sidecar in `<path>.sqlite`.
+    Readers open the index memory-mapped, so every worker process shares the same pages.
+    Writers load a private copy, change it and atomically swap the file in; readers pick
+    the new version up through `reload_if_changed()`.
+    """
+
+    def __init__(self, path: str, index, writable: bool = False):
+        self.path = path
+        self.index = index
+        self.writable = writable
+        self._mtime = os.path.getmtime(self.index_path) if os.path.exists(self.index_path) else None
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._sidecar = self._connect(path, writable)
+
+    # --- paths / sidecar -------------------------------------------------
+    @property
+    def index_path(self) -> str:
+        return f"{self.path}.faiss"
+
+    @staticmethod
+    def sidecar_path(path: str) -> str:
+        return f"{path}.sqlite"
+
+    @classmethod
+    def _connect(cls, path: str, writable: bool) -> sqlite3.Connection:
+        if writable:
+            conn = sqlite3.connect(cls.sidecar_path(path), check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS records (id INTEGER PRIMARY KEY, data TEXT NOT NULL)")
+            conn.commit()
+            return conn
+        uri = f"file:{os.path.abspath(cls.sidecar_path(path))}?mode=ro"
+        return sqlite3.connect(uri, uri=True, check_same_thread=False)
+
+    # --- construction ----------------------------------------------------
+    @classmethod
+    def build(cls, path: str, vectors: np.ndarray, records: Sequence[dict],
+              ids: Optional[Sequence[int]] = None, index_type: str = "flat",
+              train_size: int = 100_000) -> "FaissStore":
+        """Create a fresh index from scratch and write it (plus sidecar) to disk."""
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        ids = np.arange(len(records), dtype="int64") if ids is None else np.asarray(ids, dtype="int64")
+        index = build_index(vectors, ids, index_type, train_size)
+
+        if os.path.exists(cls.sidecar_path(path)):
+            os.remove(cls.sidecar_path(path))
+        store = cls(path, index, writable=True)
+        store._put_records(ids, records)
+        store.save()
+        return store
+
+    @classmethod
+    def open(cls, path: str, mmap: bool = True, writable: bool = False) -> "FaissStore":
+        """Open a persisted index; read-only opens are memory-mapped by default."""
+        index_path = f"{path}.faiss"
+        if writable or not mmap:
+            index = faiss.read_index(index_path)
+        else:
+            try:
+                index = faiss.read_index(index_path, _mmap_flags())
+            except RuntimeError:
+                # Index type without mmap support: fall back to a private copy
+                index = faiss.read_index(index_path)
+        return cls(path, index, writable=writable)
+
+    def reload_if_changed(self) -> bool:
+        """Re-open the index if a writer swapped in a new file since we loaded it."""
+        if self.writable or not os.path.exists(self.index_path):
+            return False
+        mtime = os.path.getmtime(self.index_path)
+        if mtime == self._mtime:
+            return False
+        fresh = FaissStore.open(self.path)
+        with self._lock:
+            self.index, self._mtime = fresh.index, fresh._mtime
+        return True
+
+    # --- writes ------------------------------------------------------------
+    def _put_records(self, ids: Iterable[int], records: Iterable[dict]):
+        rows = [(int(i), json.dumps(r)) for i, r in zip(ids, records)]
+        with self._db_lock:
+            self._sidecar.executemany("INSERT OR REPLACE INTO records (id, data) VALUES (?, ?)", rows)
+            self._sidecar.commit()
+
+    def next_id(self) -> int:
+        with self._db_lock:
+            row = self._sidecar.execute("SELECT MAX(id) FROM records").fetchone()
+        return 0 if row[0] is None else row[0] + 1
+
+    def add(self, vectors: np.ndarray, records: Sequence[dict],
+            ids: Optional[Sequence[int]] = None) -> List[int]:
+        """Add vectors incrementally (no rebuild); call `save()` to publish them."""
+        if not self.writable:
+            raise RuntimeError("FaissStore was opened read-only")
+        if ids is None:
+            start = self.next_id()
+            ids = list(range(start, start + len(records)))
+        with self._lock:
+            self.index.add_with_ids(np.ascontiguousarray(vectors, dtype="float32"),
+                                    np.asarray(ids, dtype="int64"))
+        self._put_records(ids, records)
+        return list(ids)
+
+    def remove(self, ids: Sequence[int]) -> int:
+        """Remove vectors and their records by ID; call `save()` to publish."""
+        if not self.writable:
+            raise RuntimeError("FaissStore was opened read-only")
+        if not self.can_remove:
+            # Checked up front so the index and the sidecar never disagree
+            raise ValueError("HNSW indexes can't remove vectors; rebuild the index without them instead")
+        with self._lock:
+            removed = self.index.remove_ids(np.asarray(ids, dtype="int64"))
+        with self._db_lock:
+            self._sidecar.executemany("DELETE FROM records WHERE id = ?", [(int(i),) for i in ids])
+            self._sidecar.commit()
+        return removed
+
+    def save(self):
+        # Write next to the target and swap, so mmap readers keep a consistent old copy
+        tmp_path = f"{self.index_path}.tmp"
+        with self._lock:
+            faiss.write_index(self.index, tmp_path)
+        os.replace(tmp_path, self.index_path)
+        self._mtime = os.path.getmtime(self.index_path)
+
+    # --- reads -------------------------------------------------------------
+    def search(self, vectors: np.ndarray, k: int, params=None):
+        """Returns (distances, ids) arrays of shape (n_queries, k); missing hits have id -1."""
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        with self._lock:
+            index = self.index
+        if params is None:
+            return index.search(vectors, k)
+        return index.search(vectors, k, params=params)
+
+    def search_subset(self, vectors: np.ndarray, k: int, ids: np.ndarray, exact_limit: int = 5000,
+                      nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+        """
+        `search` restricted to `ids` (e.g. the CVs passing an attribute filter). Small subsets are
+        scored exactly from their reconstructed vectors; larger ones (and IVF indexes, which
+        can't reconstruct) search the index with an ID selector, probing every IVF list.
+        """
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        ids = np.asarray(ids, dtype="int64")
+        with self._lock:
+            index = self.index
+        inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap2) else index
+        if isinstance(inner, faiss.IndexIVF):
+            nprobe = inner.nlist
+        elif len(ids) <= exact_limit:
+            if not len(ids):
+                return np.full((len(vectors), k), np.inf, dtype="float32"), np.full((len(vectors), k), -1)
+            distances, rows = faiss.knn(vectors, index.reconstruct_batch(ids), min(k, len(ids)))
+            found = np.where(rows >= 0, ids[rows], -1)
+            if found.shape[1] < k:
+                pad = k - found.shape[1]
+                distances = np.pad(distances, ((0, 0), (0, pad)), constant_values=np.inf)
+                found = np.pad(found, ((0, 0), (0, pad)), constant_values=-1)
+            return distances, found
+        return index.search(vectors, k, params=search_params(index, nprobe, ef_search, ids=ids))
+
+    def records(self, ids: Iterable[int]) -> Dict[int, dict]:
+        """Fetch sidecar records for the given IDs in one query."""
+        ids = list({int(i) for i in ids if i >= 0})
+        found = {}
+        with self._db_lock:
+            for start in range(0, len(ids), 500):
+                part = ids[start:start + 500]
+                marks = ",".join("?" * len(part))
+                for i, data in self._sidecar.execute(
+                        f"SELECT id, data FROM records WHERE id IN ({marks})", part):
+                    found[i] = json.loads(data)
+        return found
+
+    def record_values(self, *paths: str) -> Dict[int, tuple]:
+        """ID -> the given JSON fields (e.g. "$.metadata.gcs_uri") of every record, without decoding whole records."""
+        columns = ", ".join("json_extract(data, ?)" for _ in paths)
+        with self._db_lock:
+            return {row[0]: tuple(row[1:]) for row in
+                    self._sidecar.execute(f"SELECT id, {columns} FROM records", paths)}
+
+    @property
+    def is_flat(self) -> bool:
+        """Exact index (no training), so vectors can be added and removed one batch at a time."""
+        inner = faiss.downcast_index(self.index.index) if isinstance(self.index, faiss.IndexIDMap2) else self.index
+        return isinstance(inner, faiss.IndexFlat)
+
+    @property
+    def can_remove(self) -> bool:
+        """Whether `remove` works: every index type except HNSW, whose graph can't drop nodes."""
+        inner = faiss.downcast_index(self.index.index) if isinstance(self.index, faiss.IndexIDMap2) else self.index
+        return not isinstance(inner, faiss.IndexHNSW)
+
+    @property
+    def ntotal(self) -> int:
+        return self.index.ntotal
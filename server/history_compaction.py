@@ -0,0 +1,166 @@
+# file: history_compaction.py
+import asyncio
+import logging
+from typing import Callable, List, Optional, Sequence, Set, Tuple
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+
+logger = logging.getLogger(__name__)
+
+# Most recently discussed candidates kept in the summary
+MAX_SUMMARY_CANDIDATES = 30
+
+SUMMARIZE_PROMPT = """You maintain a running summary of a recruiter's chat with a CV search assistant.
+Update the summary with the new turns below. Keep what the recruiter is looking for
+(role, skills, seniority, location, other constraints), decisions they made and candidates
+they liked or rejected. At most 150 words, plain text, no preamble.
+
+Current summary:
+{summary}
+
+New turns:
+{turns}"""
+
+
+def add_turn(history, question: str, answer: str, candidates: Sequence[Tuple[str, str]] = ()):
+    """Append a question/answer turn; the AI message carries the (id, name) of the candidates it showed."""
+    history.add_message(HumanMessage(content=question))
+    history.add_message(AIMessage(content=answer, additional_kwargs={"candidates": [list(c) for c in candidates]}))
+
+
+def is_summary(message: BaseMessage) -> bool:
+    return isinstance(message, SystemMessage) and "summary" in message.additional_kwargs
+
+
+def summary_message(summary: str, candidates: Sequence[Sequence[str]]) -> SystemMessage:
+    """The running summary as the first history message: text plus the candidates discussed so far."""
+    content = f"Summary of the earlier conversation: {summary}"
+    if candidates:
+        content += "\nCandidates already discussed: " + "; ".join(f"{name} ({cid})" for cid, name in candidates)
+    return SystemMessage(content=content, additional_kwargs={"summary": summary,
+                                                             "candidates": [list(c) for c in candidates]})
+
+
+def _merge_candidates(old: Sequence[Sequence[str]], turns: Sequence[BaseMessage]) -> List[List[str]]:
+    # Newest mention wins the position; oldest fall off past MAX_SUMMARY_CANDIDATES
+    merged = [list(c) for c in old]
+    for message in turns:
+        for cid, name in message.additional_kwargs.get("candidates", []):
+            merged = [c for c in merged if c[0] != cid] + [[cid, name]]
+    return merged[-MAX_SUMMARY_CANDIDATES:]
+
+
+def _turn_text(turns: Sequence[BaseMessage]) -> str:
+    lines = []
+    for message in turns:
+        if isinstance(message, HumanMessage):
+            lines.append(f"Recruiter: {message.content}")
+        elif isinstance(message, AIMessage):
+            shown = ", ".join(name for _, name in message.additional_kwargs.get("candidates", []))
+            lines.append(f"Assistant: {message.content}" + (f"\n(showed: {shown})" if shown else ""))
+    return "\n".join(lines)
+
+
+def _replace_prefix(sessions, session_id: str, prefix: list, new_summary: BaseMessage) -> bool:
+    """
+    Re-read the session and swap `prefix` for `new_summary`; False if the session is gone or the
+    prefix changed. The recruiter may have asked more in the meantime: later turns are kept.
+    """
+    history = sessions.get(session_id)
+    if history is None:
+        return False
+    messages = history.messages
+    if [(m.type, m.content) for m in messages[:len(prefix)]] != [(m.type, m.content) for m in prefix]:
+        return False
+    history.clear()
+    history.add_messages([new_summary] + messages[len(prefix):])
+    sessions.save(session_id, history)
+    return True
+
+
+class HistoryCompactor:
+    """
+    Bounds session history: the newest `verbatim_turns` question/answer turns stay as they
+    are, older ones are folded into one running-summary message at the start of the history
+    (plus the IDs of the candidates they showed). Folding calls the LLM, so it runs in the
+    background after the answer was sent, once `fold_batch` turns beyond the verbatim window
+    have piled up; until then the prompt just carries those few extra turns.
+    """
+
+    def __init__(self, get_llm: Callable, limits=None, verbatim_turns: int = 3, fold_batch: int = 2):
+        self.get_llm = get_llm
+        self.limits = limits
+        self.verbatim_turns = verbatim_turns
+        self.fold_batch = fold_batch
+        self._running: Set[str] = set()
+        self._tasks: Set[asyncio.Task] = set()
+        self.folds = 0
+        self.failures = 0
+
+    @classmethod
+    def from_config(cls, config, get_llm, limits=None) -> "HistoryCompactor":
+        return cls(get_llm, limits,
+                   verbatim_turns=getattr(config, "HISTORY_VERBATIM_TURNS", 3),
+                   fold_batch=getattr(config, "HISTORY_FOLD_BATCH", 2))
+
+    def _split(self, messages: Sequence[BaseMessage]) -> Tuple[Optional[BaseMessage], list, list]:
+        """(summary message or None, messages to fold, messages to keep verbatim)."""
+        summary = messages[0] if messages and is_summary(messages[0]) else None
+        turns = list(messages[1:] if summary is not None else messages)
+        keep = self.verbatim_turns * 2
+        if len(turns) < keep + self.fold_batch * 2:
+            return summary, [], turns
+        return summary, turns[:-keep] if keep else turns, turns[-keep:] if keep else []
+
+    def needs_fold(self, history) -> bool:
+        return bool(self._split(history.messages)[1])
+
+    async def _summarize(self, summary: Optional[BaseMessage], turns: list) -> BaseMessage:
+        previous = summary.additional_kwargs["summary"] if summary is not None else "(none yet)"
+        prompt = SUMMARIZE_PROMPT.format(summary=previous, turns=_turn_text(turns))
+        if self.limits is not None:
+            async with self.limits("llm"):
+                resp = await self.get_llm().ainvoke([HumanMessage(content=prompt)])
+        else:
+            resp = await self.get_llm().ainvoke([HumanMessage(content=prompt)])
+        old_candidates = summary.additional_kwargs["candidates"] if summary is not None else []
+        return summary_message(resp.content.strip(), _merge_candidates(old_candidates, turns))
+
+    async def compact(self, session_id: str, sessions):
+        """Fold the session's old turns into its summary and save it, unless it changed meanwhile."""
+        # Session stores may be SQLite-backed: keep their disk I/O off the event loop
+        loop = asyncio.get_running_loop()
+        history = await loop.run_in_executor(None, sessions.get, session_id)
+        if history is None:
+            return
+        summary, fold, _ = self._split(history.messages)
+        if not fold:
+            return
+        new_summary = await self._summarize(summary, fold)
+        prefix = ([summary] if summary is not None else []) + fold
+        if await loop.run_in_executor(None, _replace_prefix, sessions, session_id, prefix, new_summary):
+            self.folds += 1
+        else:
+            logger.debug("Session %s changed during compaction, retrying later", session_id)
+
+    def schedule(self, session_id: str, sessions, history):
+        """Start `compact` in the background if `history` (as just saved) has turns to fold."""
+        if session_id in self._running or not self.needs_fold(history):
+            return
+        self._running.add(session_id)
+
+        async def run():
+            try:
+                await self.compact(session_id, sessions)
+            except Exception:
+                self.failures += 1
+                logger.exception("History compaction failed for session %s", session_id)
+            finally:
+                self._running.discard(session_id)
+
+        task = asyncio.get_running_loop().create_task(run())
+        self._tasks.add(task)   # keep a reference until it's done
+        task.add_done_callback(self._tasks.discard)
+
+    def stats(self) -> dict:
+        return {"folds": self.folds, "failures": self.failures, "running": len(self._running)}
@@ -1,14 +1,15 @@
 # file: ingest_cvs.py
-import io, re, uuid
-from typing import List
-from google.cloud import storage, aiplatform
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_google_vertexai import VertexAIEmbeddings
-from langchain_google_vertexai.vectorstores import VectorSearchVectorStore
-from langchain.schema import Document
-from pypdf import PdfReader
+import time
+
+from google.cloud import storage
 
 from config_manager import ConfigManager
+from embedding_cache import EmbeddingCache
+from ingest_manifest import IngestManifest, blob_content_hash
+from ingest_pipeline import IngestItem, cv_pipeline, index_writer_lock
+from bm25_index import BM25Index
+from attribute_index import AttributeIndex
+from vector_backends import create_embeddings, create_vector_backend
 
 # Get the single instance of the configuration
 config = ConfigManager()
@@ -16,70 +17,121 @@ config = ConfigManager()
 PROJECT_ID = config.PROJECT_ID
 REGION = config.REGION
 BUCKET = "cv-rag-west-4"
-DIMENSIONS = config.DIMENSIONS
-GCS_PREFIX = ""   # where you uploaded CVs 
-INDEX_ID = "3037589987731177472"
+GCS_PREFIX = ""   # where you uploaded CVs
 INDEX_DISPLAY_NAME = "cv-index-rag"
-ENDPOINT_ID = "7123093721570082816"
-
-# 1) Init clients
-aiplatform.init(project=PROJECT_ID, location=REGION)
-gcs = storage.Client(project=PROJECT_ID)
-bucket = gcs.bucket(BUCKET)
-
-# 2) Helper: read PDF bytes from GCS and extract text
-def pdf_text_from_blob(blob) -> str:
-    bio = io.BytesIO(blob.download_as_bytes())
-    reader = PdfReader(bio)
-    pages = [p.extract_text() or "" for p in reader.pages]
-    return "\n".join(pages)
-
-# 3) List CV files
-blobs = list(gcs.list_blobs(BUCKET, prefix=GCS_PREFIX))
-pdf_blobs = [b for b in blobs if b.name.lower().endswith(".pdf")]
-
-# 4) Convert each PDF to LangChain Document with metadata
-docs: List[Document] = []
-for b in pdf_blobs:
-    text = pdf_text_from_blob(b)
-    # very light cleanup
-    text = re.sub(r"\s+\n", "\n", text)
-    docs.append(Document(
-        page_content=text,
-        metadata={
-            "gcs_uri": f"gs://{BUCKET}/{b.name}",
-            "filename": b.name.split("/")[-1]
-        }
-    ))
-
-# 5) Chunk for retrieval
-splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
-chunks = splitter.split_documents(docs)
-
-# 6) Embeddings (Vertex AI)
-emb = VertexAIEmbeddings(
-    model_name="text-embedding-005",  # or "gemini-embedding-001"
-    project=PROJECT_ID,
-    location=REGION,
-)
-
-# 7) Connect to the existing Vector Search index/endpoint
-index = aiplatform.MatchingEngineIndex(INDEX_ID)
-endpoint = aiplatform.MatchingEngineIndexEndpoint(ENDPOINT_ID)
-
-vector_store = VectorSearchVectorStore.from_components(
-    embedding=emb,
-    index_id=INDEX_ID,
-    endpoint_id=ENDPOINT_ID,
-    gcs_bucket_name=BUCKET,
-    project_id=PROJECT_ID,
-    region=REGION,
-)
-
-# 8) Upsert texts
-texts = [c.page_content for c in chunks]
-metas = [c.metadata for c in chunks]
-ids = [str(uuid.uuid4()) for _ in chunks]
-
-vector_store.add_texts(texts=texts, metadatas=metas, ids=ids)
-print(f"Upserted {len(ids)} chunks.")
+MANIFEST_PATH = getattr(config, "INGEST_MANIFEST_PATH", "ingest_manifest.json")
+# Publish the index and manifest this often during a run, so an interrupted run resumes;
+# each save rewrites the whole local FAISS index, so not per batch
+CHECKPOINT_SECONDS = getattr(config, "INGEST_CHECKPOINT_SECONDS", 600)
+
+# Pipeline sizing (all optional in config.json)
+DOWNLOAD_WORKERS = getattr(config, "INGEST_DOWNLOAD_WORKERS", 8)
+EXTRACT_WORKERS = getattr(config, "INGEST_EXTRACT_WORKERS", None)   # None = one per core
+QUEUE_SIZE = getattr(config, "INGEST_QUEUE_SIZE", 64)
+UPSERT_BATCH_SIZE = getattr(config, "INGEST_UPSERT_BATCH_SIZE", 256)
+
+
+def main():
+    # One writer at a time: the upload worker (upload_queue.py) publishes to the same indexes
+    with index_writer_lock(config):
+        sync()
+
+
+def sync():
+    # 1) Init clients
+    gcs = storage.Client(project=PROJECT_ID)
+
+    # 2) Embeddings (Vertex AI or local, per EMBEDDING_BACKEND), behind the local cache
+    #    so unchanged chunks are never re-embedded
+    emb = create_embeddings(config, EmbeddingCache.from_config(config))
+
+    # 3) Vector backend (Vertex AI Vector Search or local FAISS, per VECTOR_BACKEND)
+    vector_store = create_vector_backend(config, embeddings=emb, writable=True)
+
+    # Local BM25 index over the same chunks, for lexical/hybrid retrieval
+    lexical = BM25Index.from_config(config)
+    # Per-CV years / degree / location / skills, for pre-filtered search
+    attributes = AttributeIndex.from_config(config)
+
+    # 4) List CV files and diff them against the manifest (hashes come with the listing)
+    manifest = IngestManifest(MANIFEST_PATH)
+    pdf_blobs = {b.name: b for b in gcs.list_blobs(BUCKET, prefix=GCS_PREFIX)
+                 if b.name.lower().endswith(".pdf")}
+    listing = {name: blob_content_hash(b) for name, b in pdf_blobs.items()}
+    changed, removed = manifest.diff(listing)
+    # Old vectors of changed/removed files are recorded before anything is upserted, so
+    # they are still found (together with those of an earlier interrupted run) after a crash
+    manifest.schedule_delete(manifest.chunk_ids(changed + removed))
+    manifest.save()
+    print(f"{len(pdf_blobs)} CVs in bucket: {len(changed)} new or changed, {len(removed)} removed.")
+
+    items = (
+        IngestItem(
+            name=name,
+            content_hash=listing[name],
+            fetch=pdf_blobs[name].download_as_bytes,
+            metadata={
+                "gcs_uri": f"gs://{BUCKET}/{name}",
+                "filename": name.split("/")[-1],
+                "content_hash": listing[name],
+            },
+        )
+        for name in changed
+    )
+
+    # 5) Stream everything through the pipeline, recording files as they complete
+    completed = []
+    last_checkpoint = [time.monotonic()]
+
+    def on_file_done(item: IngestItem, ids):
+        completed.append(item.name)
+        manifest.record(item.name, item.content_hash, ids)
+        attributes.put({item.metadata["gcs_uri"]: {k: v for k, v in item.metadata.items() if k.startswith("cv_")}})
+        if time.monotonic() - last_checkpoint[0] >= CHECKPOINT_SECONDS:
+            # The manifest only lists files whose vectors are saved
+            vector_store.save()
+            manifest.save()
+            last_checkpoint[0] = time.monotonic()
+
+    def upsert(texts, vectors, metadatas, ids):
+        vector_store.add(texts, vectors, metadatas, ids)
+        lexical.add(ids, texts, metadatas)
+
+    pipeline = cv_pipeline(
+        emb.embed_documents,
+        upsert,
+        on_file_done=on_file_done,
+        download_workers=DOWNLOAD_WORKERS,
+        extract_workers=EXTRACT_WORKERS,
+        queue_size=QUEUE_SIZE,
+        batch_size=UPSERT_BATCH_SIZE,
+    )
+    try:
+        counts = pipeline.run(items)
+    except BaseException:
+        # Keep whatever finished, even if a later batch failed
+        vector_store.save()
+        manifest.save()
+        raise
+
+    # 6) Drop vectors of removed files and of the previous versions of re-ingested files.
+    #    Files that failed keep their old vectors and are retried on the next run.
+    for name in removed:
+        manifest.forget(name)
+    attributes.delete([f"gs://{BUCKET}/{name}" for name in removed])
+    stale_ids = manifest.stale_ids()
+    if stale_ids:
+        vector_store.delete(stale_ids)
+        lexical.delete(stale_ids)
+    vector_store.save()
+    manifest.retain_deletes(manifest.chunk_ids(set(changed) - set(completed)))
+    manifest.save()
+    lexical.compile()
+    attributes.compile()
+    print(f"Upserted {counts['upserted']} chunks from {counts['files_done']} CVs "
+          f"in {counts['seconds']}s ({counts['failed']} failed), deleted {len(stale_ids)} stale chunks.")
+    print(f"Embedding cache: {emb.stats()}")
+
+
+if __name__ == "__main__":
+    main()
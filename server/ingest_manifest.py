@@ -0,0 +1,89 @@
+# file: ingest_manifest.py
+import json
+import os
+import uuid
+from typing import Dict, Iterable, List, Set, Tuple
+
+# Fixed namespace so the same (file hash, offset) always maps to the same chunk ID
+CHUNK_NAMESPACE = uuid.UUID("5b0f4a7e-3c1d-4f7a-9a49-2f6d1c8e7b10")
+
+
+def chunk_id(file_hash: str, offset: int) -> str:
+    """Deterministic vector ID for the chunk starting at `offset` in a file with `file_hash`."""
+    return str(uuid.uuid5(CHUNK_NAMESPACE, f"{file_hash}:{offset}"))
+
+
+def blob_content_hash(blob) -> str:
+    """Content hash of a GCS blob taken from the listing, so unchanged files are never downloaded."""
+    if blob.md5_hash:
+        return f"md5:{blob.md5_hash}"
+    # Composite objects have no MD5, only a CRC32C
+    return f"crc32c:{blob.crc32c}"
+
+
+class IngestManifest:
+    """
+    Records every ingested blob with its content hash and the chunk IDs it produced.
+    Stored as a small JSON file next to the config so re-runs can diff against the bucket.
+    Chunk IDs of replaced or removed versions are kept as pending deletes until they are
+    gone from the vector store, so a run that dies halfway never leaves orphaned vectors.
+    """
+
+    def __init__(self, path: str = "ingest_manifest.json"):
+        self.path = path
+        self.entries: Dict[str, dict] = {}
+        self.pending_deletes: Set[str] = set()
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                data = json.load(f)
+            self.entries = data.get("entries", {})
+            self.pending_deletes = set(data.get("pending_deletes", []))
+
+    def diff(self, listing: Dict[str, str]) -> Tuple[List[str], List[str]]:
+        """
+        Compare a {blob name: content hash} listing with the manifest.
+        Returns (new or changed blob names, removed blob names).
+        """
+        changed = [name for name, h in listing.items()
+                   if self.entries.get(name, {}).get("hash") != h]
+        removed = [name for name in self.entries if name not in listing]
+        return changed, removed
+
+    def chunk_ids(self, names: Iterable[str]) -> List[str]:
+        """Chunk IDs currently recorded for `names`."""
+        ids = []
+        for name in names:
+            ids.extend(self.entries.get(name, {}).get("chunk_ids", []))
+        return ids
+
+    def live_ids(self) -> Set[str]:
+        """Every chunk ID still referenced by some entry (identical files share IDs)."""
+        live = set()
+        for entry in self.entries.values():
+            live.update(entry["chunk_ids"])
+        return live
+
+    def record(self, name: str, content_hash: str, chunk_ids: List[str], **extra):
+        self.entries[name] = {"hash": content_hash, "chunk_ids": list(chunk_ids), **extra}
+
+    def forget(self, name: str):
+        self.entries.pop(name, None)
+
+    def schedule_delete(self, ids: Iterable[str]):
+        """Mark chunk IDs for deletion; save before upserting their replacements."""
+        self.pending_deletes.update(ids)
+
+    def stale_ids(self) -> List[str]:
+        """Pending deletes no entry references any more (identical files share IDs)."""
+        return sorted(self.pending_deletes - self.live_ids())
+
+    def retain_deletes(self, ids: Iterable[str]):
+        """Keep only `ids` pending, e.g. old versions of files that failed to re-ingest."""
+        self.pending_deletes &= set(ids)
+
+    def save(self):
+        # Write to a temp file first so a crash never leaves a half-written manifest
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"entries": self.entries, "pending_deletes": sorted(self.pending_deletes)}, f)
+        os.replace(tmp_path, self.path)
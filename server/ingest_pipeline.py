@@ -0,0 +1,384 @@
+# file: ingest_pipeline.py
+import io
+import os
+import queue
+import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Callable, Dict, Iterable, NamedTuple, Optional
+
+from ingest_manifest import chunk_id
+
+try:
+    import fcntl
+except ImportError:   # Windows
+    fcntl = None
+    import msvcrt
+
+# Marks the end of a stage's input
+_DONE = object()
+
+
+class FileLock:
+    """
+    Exclusive lock on a file, held by at most one process on the machine at a time
+    (flock, or msvcrt on Windows); the OS releases it if the holder dies.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+
+    def acquire(self, blocking: bool = True, poll: float = 0.5, stop: Optional[threading.Event] = None) -> bool:
+        """Take the lock, polling every `poll` seconds; False if not blocking or `stop` was set first."""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        f = open(self.path, "a+")
+        while True:
+            try:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+                self._file = f
+                return True
+            except OSError:
+                if not blocking or (stop is not None and stop.is_set()):
+                    f.close()
+                    return False
+                if stop is not None:
+                    stop.wait(poll)
+                else:
+                    time.sleep(poll)
+
+    def release(self):
+        if self._file is None:
+            return
+        if fcntl is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+        else:
+            self._file.seek(0)
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        self._file.close()
+        self._file = None
+
+    def __enter__(self) -> "FileLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def index_writer_lock(config) -> FileLock:
+    """
+    The lock every writer of the chunk indexes (vector store, BM25, attributes, manifest)
+    holds while it changes them: ingest_cvs.py for a whole run, the upload worker per publish.
+    """
+    return FileLock(getattr(config, "INDEX_WRITER_LOCK", "index_writer.lock"))
+
+
+class IngestItem(NamedTuple):
+    """One CV to ingest: `fetch()` returns the raw PDF bytes."""
+    name: str
+    content_hash: str
+    fetch: Callable[[], bytes]
+    metadata: dict
+
+
+# Runs in the worker processes, so it must stay a top-level function
+def extract_pdf_text(data: bytes) -> str:
+    from pypdf import PdfReader
+    reader = PdfReader(io.BytesIO(data))
+    pages = [p.extract_text() or "" for p in reader.pages]
+    return "\n".join(pages)
+
+
+def clean_text(text: str) -> str:
+    # very light cleanup
+    return re.sub(r"\s+\n", "\n", text)
+
+
+class IngestPipeline:
+    """
+    Streaming list -> download -> extract -> clean/split -> embed -> upsert pipeline.
+    Every stage hands over through a bounded queue, so memory stays flat no matter how
+    many CVs are listed. Downloads run on threads, PDF parsing on a process pool.
+    """
+
+    def __init__(self, splitter, embed_fn, upsert_fn, on_file_done=None, chunk_metadata=None, file_metadata=None,
+                 download_workers: int = 8, extract_workers: int = None,
+                 queue_size: int = 64, batch_size: int = 256, report_every: float = 10.0, mp_context=None):
+        self.splitter = splitter
+        self.embed_fn = embed_fn          # texts -> vectors
+        self.upsert_fn = upsert_fn        # (texts, vectors, metadatas, ids) -> None
+        self.on_file_done = on_file_done  # (item, chunk ids) -> None, once all its chunks are upserted
+        self.chunk_metadata = chunk_metadata  # chunk text -> extra metadata computed once at ingest
+        self.file_metadata = file_metadata    # full CV text -> metadata added to the item and all its chunks
+        self.download_workers = download_workers
+        self.extract_workers = extract_workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.report_every = report_every
+        self.mp_context = mp_context      # e.g. spawn, when running inside a threaded server process
+
+        self.download_q = queue.Queue(maxsize=queue_size)
+        self.extract_q = queue.Queue(maxsize=queue_size)
+        self.split_q = queue.Queue(maxsize=queue_size)
+        self.embed_q = queue.Queue(maxsize=4)
+        self.upsert_q = queue.Queue(maxsize=4)
+
+        self.counts = {"listed": 0, "downloaded": 0, "extracted": 0, "failed": 0,
+                       "chunks": 0, "embedded": 0, "upserted": 0, "files_done": 0}
+        self._lock = threading.Lock()
+        self._error = None
+        # name -> [item, remaining chunk count, chunk ids]
+        self._pending: Dict[str, list] = {}
+
+    # --- helpers ---------------------------------------------------------
+    def _count(self, key: str, n: int = 1):
+        with self._lock:
+            self.counts[key] += n
+
+    def _fail(self, exc: BaseException):
+        if self._error is None:
+            self._error = exc
+
+    def _put(self, q: queue.Queue, item):
+        # Blocks on a full queue, but gives up once another stage has failed
+        while self._error is None:
+            try:
+                q.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def _get(self, q: queue.Queue):
+        # Blocks until an item arrives; ends the stage once another stage has failed
+        while True:
+            try:
+                return q.get(timeout=0.5)
+            except queue.Empty:
+                if self._error is not None:
+                    return _DONE
+
+    # --- stages -----------------------------------------------------------
+    def _list_stage(self, items: Iterable[IngestItem]):
+        try:
+            for item in items:
+                if self._error is not None:
+                    break
+                self._put(self.download_q, item)
+                self._count("listed")
+        except BaseException as e:
+            self._fail(e)
+        finally:
+            for _ in range(self.download_workers):
+                self._put(self.download_q, _DONE)
+
+    def _download_stage(self):
+        while True:
+            item = self._get(self.download_q)
+            if item is _DONE:
+                self._put(self.extract_q, _DONE)
+                return
+            try:
+                data = item.fetch()
+            except Exception as e:
+                print(f"Download failed for {item.name}: {e}")
+                self._count("failed")
+                continue
+            self._count("downloaded")
+            self._put(self.extract_q, (item, data))
+
+    def _extract_stage(self, pool: ProcessPoolExecutor):
+        in_flight = {}
+        finished_downloaders = 0
+        max_in_flight = self.extract_workers * 2
+
+        def drain(block: bool):
+            if not in_flight:
+                return
+            done, _ = wait(list(in_flight), timeout=None if block else 0, return_when=FIRST_COMPLETED)
+            for fut in done:
+                item = in_flight.pop(fut)
+                try:
+                    text = fut.result()
+                except Exception as e:
+                    print(f"Could not parse {item.name}: {e}")
+                    self._count("failed")
+                    continue
+                self._count("extracted")
+                self._put(self.split_q, (item, text))
+
+        try:
+            while finished_downloaders < self.download_workers and self._error is None:
+                got = self._get(self.extract_q)
+                if got is _DONE:
+                    finished_downloaders += 1
+                    continue
+                item, data = got
+                while len(in_flight) >= max_in_flight:
+                    drain(block=True)
+                in_flight[pool.submit(extract_pdf_text, data)] = item
+                drain(block=False)
+            while in_flight:
+                drain(block=True)
+        except BaseException as e:
+            self._fail(e)
+        finally:
+            self._put(self.split_q, _DONE)
+
+    def _split_stage(self):
+        batch = []
+        try:
+            while True:
+                got = self._get(self.split_q)
+                if got is _DONE:
+                    break
+                item, text = got
+                text = clean_text(text)
+                if self.file_metadata:
+                    item.metadata.update(self.file_metadata(text))
+                chunks = self.splitter.create_documents([text], metadatas=[dict(item.metadata)])
+                ids = [chunk_id(item.content_hash, c.metadata["start_index"]) for c in chunks]
+                with self._lock:
+                    self._pending[item.name] = [item, len(chunks), ids]
+                if not chunks:
+                    self._file_progress(item.name, 0)
+                for c, i in zip(chunks, ids):
+                    c.metadata["chunk_id"] = i
+                    if self.chunk_metadata:
+                        c.metadata.update(self.chunk_metadata(c.page_content))
+                    batch.append((item.name, i, c))
+                    if len(batch) >= self.batch_size:
+                        self._put(self.embed_q, batch)
+                        batch = []
+                self._count("chunks", len(chunks))
+            if batch:
+                self._put(self.embed_q, batch)
+        except BaseException as e:
+            self._fail(e)
+        finally:
+            self._put(self.embed_q, _DONE)
+
+    def _embed_stage(self):
+        try:
+            while True:
+                batch = self._get(self.embed_q)
+                if batch is _DONE:
+                    break
+                if self._error is not None:
+                    continue
+                vectors = self.embed_fn([c.page_content for _, _, c in batch])
+                self._count("embedded", len(batch))
+                self._put(self.upsert_q, (batch, vectors))
+        except BaseException as e:
+            self._fail(e)
+        finally:
+            self._put(self.upsert_q, _DONE)
+
+    def _upsert_stage(self):
+        try:
+            while True:
+                got = self._get(self.upsert_q)
+                if got is _DONE:
+                    break
+                if self._error is not None:
+                    continue
+                batch, vectors = got
+                self.upsert_fn(
+                    [c.page_content for _, _, c in batch],
+                    vectors,
+                    [c.metadata for _, _, c in batch],
+                    [i for _, i, _ in batch],
+                )
+                self._count("upserted", len(batch))
+                per_file: Dict[str, int] = {}
+                for name, _, _ in batch:
+                    per_file[name] = per_file.get(name, 0) + 1
+                for name, n in per_file.items():
+                    self._file_progress(name, n)
+        except BaseException as e:
+            self._fail(e)
+
+    def _file_progress(self, name: str, n_upserted: int):
+        with self._lock:
+            entry = self._pending[name]
+            entry[1] -= n_upserted
+            finished = entry[1] <= 0
+            if finished:
+                del self._pending[name]
+        if finished:
+            self._count("files_done")
+            if self.on_file_done:
+                self.on_file_done(entry[0], entry[2])
+
+    # --- reporting --------------------------------------------------------
+    def backlog(self) -> Dict[str, int]:
+        return {
+            "download": self.download_q.qsize(),
+            "extract": self.extract_q.qsize(),
+            "split": self.split_q.qsize(),
+            "embed": self.embed_q.qsize(),
+            "upsert": self.upsert_q.qsize(),
+        }
+
+    def _report(self, started: float, stop: threading.Event):
+        while not stop.wait(self.report_every):
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                counts = dict(self.counts)
+            print(f"[{elapsed:7.1f}s] files {counts['files_done']}/{counts['listed']} "
+                  f"({counts['files_done'] / elapsed:.1f}/s), chunks {counts['upserted']} "
+                  f"({counts['upserted'] / elapsed:.1f}/s), failed {counts['failed']}, "
+                  f"backlog {self.backlog()}")
+
+    def run(self, items: Iterable[IngestItem]) -> Dict[str, int]:
+        """Ingest `items` and return the final stage counters."""
+        started = time.perf_counter()
+        stop = threading.Event()
+        with ProcessPoolExecutor(max_workers=self.extract_workers, mp_context=self.mp_context) as pool:
+            threads = [threading.Thread(target=self._list_stage, args=(items,), daemon=True)]
+            threads += [threading.Thread(target=self._download_stage, daemon=True)
+                        for _ in range(self.download_workers)]
+            threads += [
+                threading.Thread(target=self._extract_stage, args=(pool,), daemon=True),
+                threading.Thread(target=self._split_stage, daemon=True),
+                threading.Thread(target=self._embed_stage, daemon=True),
+                threading.Thread(target=self._upsert_stage, daemon=True),
+            ]
+            reporter = threading.Thread(target=self._report, args=(started, stop), daemon=True)
+            reporter.start()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            stop.set()
+        if self._error is not None:
+            raise self._error
+        counts = dict(self.counts)
+        counts["seconds"] = round(time.perf_counter() - started, 2)
+        return counts
+
+
+def cv_pipeline(embed_fn, upsert_fn, on_file_done=None, **sizing) -> IngestPipeline:
+    """
+    The CV ingestion pipeline shared by ingest_cvs.py (bucket sync) and upload_queue.py
+    (uploaded files): the same chunking and metadata, so both produce identical chunks.
+    """
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    from attribute_index import extract_attributes
+    from skill_extractor import extract_skills
+    return IngestPipeline(
+        # Chunking for retrieval (start offsets make the chunk IDs deterministic)
+        splitter=RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50, add_start_index=True),
+        embed_fn=embed_fn,
+        upsert_fn=upsert_fn,
+        on_file_done=on_file_done,
+        # Skills are extracted once here and stored with the chunk, so /ask never scans for them
+        chunk_metadata=lambda text: {"skills": extract_skills(text)},
+        # CV-level attributes go on every chunk too, so Vector Search can filter on them
+        file_metadata=extract_attributes,
+        **sizing,
+    )
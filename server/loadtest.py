@@ -0,0 +1,372 @@
+# file: loadtest.py
+"""
+Load test for the API with stub embedder / retriever / LLM (no Vertex AI needed).
+
+Drives /new_session and /ask at a target concurrency (and optionally a fixed rate of
+new conversations) and reports throughput plus p50/p95/p99 per stage as JSON:
+
+    python loadtest.py --conversations 500 --concurrency 64 --json loadtest.json
+    python loadtest.py --rate 20 --llm-ms 1200 --threadpool        # LangChain-style sync fallbacks
+    python loadtest.py serve --port 8001                           # stubbed server only
+    python loadtest.py --url http://127.0.0.1:8001 ...             # drive an external server
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import resource
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from vector_backends import VectorBackend
+
+SKILLS = ["Python", "Java", "AWS", "React", "Docker", "Kubernetes", "SQL", "Go", "Azure", "TensorFlow"]
+
+
+class StageTimer:
+    """Collects latencies (seconds) per stage name; shared by the stubs and the client."""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float):
+        with self._lock:
+            self.samples[stage].append(seconds)
+
+    def summary(self) -> dict:
+        with self._lock:
+            samples = {stage: sorted(values) for stage, values in self.samples.items()}
+        return {stage: _percentiles(values) for stage, values in samples.items()}
+
+
+def _percentiles(values: List[float]) -> dict:
+    def pct(p):
+        return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))] * 1000
+    return {
+        "count": len(values),
+        "mean_ms": round(sum(values) / len(values) * 1000, 3),
+        "p50_ms": round(pct(50), 3),
+        "p95_ms": round(pct(95), 3),
+        "p99_ms": round(pct(99), 3),
+        "max_ms": round(values[-1] * 1000, 3),
+    }
+
+
+class _Latency:
+    """Fixed latency with +-jitter, slept either blocking or on the event loop."""
+
+    def __init__(self, ms: float, jitter: float):
+        self.ms = ms
+        self.jitter = jitter
+
+    def draw(self) -> float:
+        return max(0.0, self.ms * (1 + random.uniform(-self.jitter, self.jitter))) / 1000
+
+    def sleep(self):
+        time.sleep(self.draw())
+
+    async def asleep(self):
+        await asyncio.sleep(self.draw())
+
+
+def _seeded_vector(text: str, dim: int) -> List[float]:
+    seed = int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+    return np.random.default_rng(seed).standard_normal(dim).astype(np.float32).tolist()
+
+
+class StubEmbeddings:
+    """Deterministic pseudo-random query vectors after a simulated model call."""
+
+    def __init__(self, latency: _Latency, timer: StageTimer, dim: int = 768, threadpool: bool = False):
+        self.latency, self.timer, self.dim, self.threadpool = latency, timer, dim, threadpool
+
+    def embed_query(self, text: str) -> List[float]:
+        started = time.perf_counter()
+        self.latency.sleep()
+        self.timer.record("embed", time.perf_counter() - started)
+        return _seeded_vector(text, self.dim)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self.embed_query(t) for t in texts]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        if self.threadpool:
+            return await asyncio.get_running_loop().run_in_executor(None, self.embed_query, text)
+        started = time.perf_counter()
+        await self.latency.asleep()
+        self.timer.record("embed", time.perf_counter() - started)
+        return _seeded_vector(text, self.dim)
+
+
+class StubBackend(VectorBackend):
+    """A fixed pool of fake CV chunks; every search returns k of them after a simulated round trip."""
+
+    def __init__(self, latency: _Latency, timer: StageTimer, n_cvs: int = 1000,
+                 chunks_per_cv: int = 4, chunk_chars: int = 500, threadpool: bool = False):
+        from langchain_core.documents import Document
+        self.latency, self.timer, self.threadpool = latency, timer, threadpool
+        rng = random.Random(0)
+        self.docs = []
+        for cv in range(n_cvs):
+            skills = rng.sample(SKILLS, 3)
+            for c in range(chunks_per_cv):
+                text = (f"Candidate {cv} has worked with {', '.join(skills)}. " * 20)[:chunk_chars]
+                self.docs.append(Document(page_content=text, metadata={
+                    "filename": f"cv_{cv}.pdf", "gcs_uri": f"gs://stub/cv_{cv}.pdf",
+                    "chunk_id": f"{cv}-{c}", "start_index": c * chunk_chars, "skills": skills}))
+
+    def _pick(self, vector, k: int) -> list:
+        start = int(abs(vector[0]) * 1e6) % len(self.docs)
+        picked = [self.docs[(start + i * 7) % len(self.docs)] for i in range(k)]
+        return [(doc, 1.0 - i / (k + 1)) for i, doc in enumerate(picked)]
+
+    def add(self, texts, vectors, metadatas, ids):
+        raise NotImplementedError("StubBackend is read-only")
+
+    def delete(self, ids):
+        raise NotImplementedError("StubBackend is read-only")
+
+    def search(self, vector, k, flt=None):
+        started = time.perf_counter()
+        self.latency.sleep()
+        self.timer.record("search", time.perf_counter() - started)
+        return self._pick(vector, k)
+
+    async def asearch(self, vector, k, flt=None):
+        if self.threadpool:
+            return await super().asearch(vector, k, flt)
+        started = time.perf_counter()
+        await self.latency.asleep()
+        self.timer.record("search", time.perf_counter() - started)
+        return self._pick(vector, k)
+
+
+class StubLLM:
+    """Returns a canned answer of `answer_chars` characters after a simulated generation time."""
+
+    def __init__(self, latency: _Latency, timer: StageTimer, answer_chars: int = 800, threadpool: bool = False):
+        self.latency, self.timer, self.threadpool = latency, timer, threadpool
+        self.answer = ("Here are the strongest matches with their key skills. " * 40)[:answer_chars]
+
+    def invoke(self, messages):
+        from langchain_core.messages import AIMessage
+        started = time.perf_counter()
+        self.latency.sleep()
+        self.timer.record("llm", time.perf_counter() - started)
+        return AIMessage(content=self.answer)
+
+    async def ainvoke(self, messages):
+        from langchain_core.messages import AIMessage
+        if self.threadpool:
+            return await asyncio.get_running_loop().run_in_executor(None, self.invoke, messages)
+        started = time.perf_counter()
+        await self.latency.asleep()
+        self.timer.record("llm", time.perf_counter() - started)
+        return AIMessage(content=self.answer)
+
+    async def astream(self, messages):
+        """The canned answer word by word, spread over the simulated generation time."""
+        from langchain_core.messages import AIMessageChunk
+        started = time.perf_counter()
+        words = self.answer.split(" ")
+        step = self.latency.draw() / max(len(words), 1)
+        for i, word in enumerate(words):
+            await asyncio.sleep(step)
+            yield AIMessageChunk(content=word if i == 0 else " " + word)
+        self.timer.record("llm", time.perf_counter() - started)
+
+
+def install_stubs(args, timer: StageTimer):
+    """Swap the real clients in chat_rag for stubs and turn off the local indexes."""
+    import chat_rag
+    jitter = args.jitter
+    chat_rag._clients["embeddings"] = StubEmbeddings(_Latency(args.embed_ms, jitter), timer,
+                                                     threadpool=args.threadpool)
+    chat_rag._clients["vector_store"] = StubBackend(_Latency(args.search_ms, jitter), timer,
+                                                    n_cvs=args.cvs, threadpool=args.threadpool)
+    chat_rag._clients["llm"] = StubLLM(_Latency(args.llm_ms, jitter), timer,
+                                       answer_chars=args.answer_chars, threadpool=args.threadpool)
+    chat_rag.RETRIEVAL_MODE = "vector"
+    chat_rag.ATTRIBUTE_FILTERS = False
+    if args.no_retrieval_cache:
+        chat_rag.retrieval_cache.threshold = 2.0   # cosine similarity never reaches it
+
+
+def _timed_app(timer: StageTimer):
+    import app as app_module
+    app_module.config.WARMUP_ON_STARTUP = False
+
+    @app_module.app.middleware("http")
+    async def server_time(request, call_next):
+        started = time.perf_counter()
+        response = await call_next(request)
+        timer.record(f"server {request.url.path}", time.perf_counter() - started)
+        return response
+
+    return app_module
+
+
+def start_server(args, timer: StageTimer):
+    """Stubbed app on a uvicorn server in a background thread; returns (server, app module)."""
+    import uvicorn
+    install_stubs(args, timer)
+    app_module = _timed_app(timer)
+    server = uvicorn.Server(uvicorn.Config(app_module.app, host="127.0.0.1", port=args.port,
+                                           log_level="warning", access_log=False))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, app_module
+
+
+def _question(rng: random.Random, distinct: bool) -> str:
+    skills = rng.sample(SKILLS, 2)
+    suffix = f" (req {rng.randrange(10 ** 9)})" if distinct else ""
+    return f"Find candidates with {skills[0]} and {skills[1]} experience{suffix}"
+
+
+async def drive(base_url: str, timer: StageTimer, conversations: int, concurrency: int,
+                asks_per_conversation: int, rate: Optional[float], distinct: bool, stream: bool = False) -> dict:
+    """
+    Run `conversations` x (new_session + asks) with at most `concurrency` in flight.
+    With `stream` the asks go to /ask/stream and the time to the first line (the cards) is recorded too.
+    """
+    import httpx
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    slots = asyncio.Semaphore(concurrency)
+    counts = {"asks": 0, "errors": 0, "response_bytes": 0}
+    rng = random.Random(1)
+
+    async def timed(client, stage, method, path, **kwargs):
+        started = time.perf_counter()
+        response = await client.request(method, path, **kwargs)
+        timer.record(stage, time.perf_counter() - started)
+        return response
+
+    async def streamed(client, session_id):
+        started = time.perf_counter()
+        body, last = b"", {}
+        async with client.stream("POST", "/ask/stream", json={
+                "session_id": session_id, "question": _question(rng, distinct)}) as response:
+            async for line in response.aiter_lines():
+                if not body:
+                    timer.record("client /ask/stream first line", time.perf_counter() - started)
+                body += line.encode("utf-8") + b"\n"
+                last = json.loads(line)
+        timer.record("client /ask/stream", time.perf_counter() - started)
+        return response.status_code, body, last
+
+    async def conversation(client):
+        try:
+            response = await timed(client, "client /new_session", "GET", "/new_session")
+            session_id = response.json()["session_id"]
+            for _ in range(asks_per_conversation):
+                if stream:
+                    status, body, last = await streamed(client, session_id)
+                else:
+                    response = await timed(client, "client /ask", "POST", "/ask", json={
+                        "session_id": session_id, "question": _question(rng, distinct)})
+                    status, body = response.status_code, response.content
+                    last = response.json() if status == 200 else {}
+                counts["asks"] += 1
+                counts["response_bytes"] += len(body)
+                if status != 200 or last.get("type") == "error":
+                    counts["errors"] += 1
+        except Exception:
+            counts["errors"] += 1
+        finally:
+            slots.release()
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+        started = time.perf_counter()
+        tasks = []
+        for _ in range(conversations):
+            if rate:
+                await asyncio.sleep(rng.expovariate(rate))   # Poisson arrivals
+            await slots.acquire()
+            tasks.append(asyncio.create_task(conversation(client)))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+        stats = (await client.get("/stats")).json()
+
+    return {
+        "seconds": round(elapsed, 3),
+        "conversations_per_s": round(conversations / elapsed, 2),
+        "asks_per_s": round(counts["asks"] / elapsed, 2),
+        "asks": counts["asks"],
+        "errors": counts["errors"],
+        "mean_response_bytes": round(counts["response_bytes"] / max(counts["asks"], 1)),
+        "server_stats": stats,
+    }
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--url", help="drive this server instead of an in-process stubbed one")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--conversations", type=int, default=200)
+    parser.add_argument("--asks-per-conversation", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--rate", type=float, help="new conversations per second (default: as fast as possible)")
+    parser.add_argument("--embed-ms", type=float, default=30)
+    parser.add_argument("--search-ms", type=float, default=60)
+    parser.add_argument("--llm-ms", type=float, default=800)
+    parser.add_argument("--jitter", type=float, default=0.2, help="+- fraction of each stub latency")
+    parser.add_argument("--answer-chars", type=int, default=800)
+    parser.add_argument("--cvs", type=int, default=1000, help="CVs in the stub corpus")
+    parser.add_argument("--threadpool", action="store_true",
+                        help="stubs only block; async calls go through run_in_executor like LangChain's defaults")
+    parser.add_argument("--repeat-questions", action="store_true",
+                        help="reuse a small set of questions so the retrieval cache can hit")
+    parser.add_argument("--no-retrieval-cache", action="store_true")
+    parser.add_argument("--stream", action="store_true", help="ask through /ask/stream (NDJSON)")
+    parser.add_argument("--json", help="write the results to this file")
+
+
+def main(args) -> dict:
+    timer = StageTimer()
+    server = None
+    base_url = args.url
+    if base_url is None:
+        server, _ = start_server(args, timer)
+        base_url = f"http://127.0.0.1:{args.port}"
+    try:
+        result = asyncio.run(drive(base_url, timer, args.conversations, args.concurrency,
+                                   args.asks_per_conversation, args.rate, not args.repeat_questions,
+                                   args.stream))
+    finally:
+        if server is not None:
+            server.should_exit = True
+    result["config"] = {k: v for k, v in vars(args).items() if k not in ("json", "command")}
+    result["stages"] = timer.summary()
+    result["max_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    print(json.dumps(result, indent=2))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test for app.py with stub upstreams")
+    sub = parser.add_subparsers(dest="command")
+    serve_cmd = sub.add_parser("serve", help="only run the stubbed server (drive it with --url)")
+    add_arguments(serve_cmd)
+    add_arguments(parser)
+    args = parser.parse_args()
+    if args.command == "serve":
+        server, _ = start_server(args, StageTimer())
+        print(f"Stubbed API on http://127.0.0.1:{args.port} (Ctrl+C to stop)")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            server.should_exit = True
+    else:
+        main(args)
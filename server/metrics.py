@@ -0,0 +1,214 @@
+# file: metrics.py
+import bisect
+import glob
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Sequence, Tuple
+
+# Latency buckets in seconds: sub-millisecond local work up to slow LLM calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{str(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def snapshot(self) -> list:
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    def render(self, others: Sequence[list] = ()) -> List[str]:
+        """Exposition lines; `others` are snapshots of the same counter in other processes, added in."""
+        with self._lock:
+            values = dict(self._values)
+        for snap in others:
+            for key, value in snap:
+                values[tuple(key)] = values.get(tuple(key), 0.0) + value
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, key)} {value:g}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram; `observe` is a bisect and three adds under a lock."""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series: Dict[Tuple[str, ...], list] = {}   # labels -> [bucket counts, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def snapshot(self) -> list:
+        with self._lock:
+            return [[list(key), list(s[0]), s[1], s[2]] for key, s in self._series.items()]
+
+    def render(self, others: Sequence[list] = ()) -> List[str]:
+        """Exposition lines; `others` are snapshots of the same histogram in other processes, added in."""
+        series = {}
+        for snap in [self.snapshot(), *others]:
+            for key, counts, total, count in snap:
+                merged = series.setdefault(tuple(key), [[0] * len(counts), 0.0, 0])
+                merged[0] = [a + b for a, b in zip(merged[0], counts)]
+                merged[1] += total
+                merged[2] += count
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound:g}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {total:.6f}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+STAGE_SECONDS = Histogram("hirepal_stage_seconds", "Time spent per /ask stage.", ["stage"])
+REQUEST_SECONDS = Histogram("hirepal_request_seconds", "HTTP request latency by route.", ["route"])
+REQUESTS = Counter("hirepal_requests_total", "HTTP requests by route and status.", ["route", "status"])
+ERRORS = Counter("hirepal_errors_total", "Errors by where they were caught.", ["where"])
+COALESCED = Counter("hirepal_singleflight_total",
+                    "Calls that ran (leader) or joined an identical in-flight call (follower).", ["call", "role"])
+
+_metrics = [STAGE_SECONDS, REQUEST_SECONDS, REQUESTS, ERRORS, COALESCED]
+# name -> (type, help, label, callback returning {label value or "": number}, per_process); read at scrape time
+_collectors: Dict[str, Tuple[str, str, str, Callable[[], Dict[str, float]], bool]] = {}
+# Where worker processes publish snapshots for each other (see enable_multiprocess)
+_multiprocess_dir = None
+
+
+@contextmanager
+def span(stage: str):
+    """Time a block into hirepal_stage_seconds{stage=...} (also when it raises)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage=stage)
+
+
+def register_collector(name: str, kind: str, help: str, label: str, callback: Callable[[], Dict[str, float]],
+                       per_process: bool = True):
+    """
+    Export values that already live elsewhere (cache and session counters) without
+    double-counting them: `callback()` is called on every scrape, `kind` is counter or gauge.
+    `per_process=False` marks values that are already global (e.g. read from a shared
+    database), which are not summed across worker processes.
+    """
+    _collectors[name] = (kind, help, label, callback, per_process)
+
+
+def _snapshot() -> dict:
+    return {
+        "metrics": {m.name: m.snapshot() for m in _metrics},
+        "collectors": {name: (kind, callback()) for name, (kind, _, _, callback, per_process) in _collectors.items()
+                       if per_process},
+    }
+
+
+def _publish():
+    path = os.path.join(_multiprocess_dir, f"{os.getpid()}.json")
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(_snapshot(), f)
+    os.replace(f"{path}.tmp", path)
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def enable_multiprocess(directory: str, interval: float = 5.0):
+    """
+    Several worker processes behind one port: each publishes its snapshot to `directory`
+    every `interval` seconds (and when scraped), and `/metrics` on any worker adds up all
+    of them. Counters of exited workers keep counting toward the totals; their gauges are dropped.
+    Call once per worker process, after the fork.
+    """
+    global _multiprocess_dir
+    os.makedirs(directory, exist_ok=True)
+    _multiprocess_dir = directory
+
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                _publish()
+            except OSError:
+                pass
+
+    threading.Thread(target=loop, name="metrics-publisher", daemon=True).start()
+
+
+def _other_snapshots() -> List[Tuple[bool, dict]]:
+    """(alive, snapshot) of every other worker process that published one."""
+    if _multiprocess_dir is None:
+        return []
+    _publish()
+    snapshots = []
+    for path in glob.glob(os.path.join(_multiprocess_dir, "*.json")):
+        pid = int(os.path.basename(path).split(".")[0])
+        if pid == os.getpid():
+            continue
+        try:
+            with open(path) as f:
+                snapshots.append((_alive(pid), json.load(f)))
+        except (OSError, ValueError):
+            continue   # being replaced right now
+    return snapshots
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format (summed over worker processes)."""
+    others = _other_snapshots()
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render([snap["metrics"].get(metric.name, []) for _, snap in others]))
+    for name, (kind, help, label, callback, per_process) in _collectors.items():
+        values = dict(callback())
+        if per_process:
+            for alive, snap in others:
+                if name not in snap["collectors"] or (kind == "gauge" and not alive):
+                    continue
+                for key, value in snap["collectors"][name][1].items():
+                    values[key] = values.get(key, 0.0) + value
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} {kind}")
+        for key, value in values.items():
+            lines.append(f'{name}{{{label}="{key}"}} {value:g}' if key else f"{name} {value:g}")
+    return "\n".join(lines) + "\n"
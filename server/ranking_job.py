@@ -0,0 +1,458 @@
+# file: ranking_job.py
+"""
+Bulk ranking: score every CV of the chunk corpus /ask searches (filled by ingest_cvs.py and
+POST /cvs uploads) against one or many job descriptions and write the ranked list per JD as
+CSV or Parquet. A CV scores as its best chunk (max over its chunks), like /ask's "max" fusion.
+
+The chunk vectors must be local: this needs "VECTOR_BACKEND": "faiss" (the chunk store at
+FAISS_INDEX_PATH). Vectors in Vertex AI Vector Search can't be exported, so with "vertex"
+jobs are refused rather than ranking some other corpus.
+
+    python ranking_job.py jds.json --out ranked.parquet --top-k 1000
+
+jds.json is a list of JD texts or of {"id": ..., "text": ..., "filters": {...}} objects
+(filters as in /ask: min_years, min_degree, location, skills).
+
+The chunk vectors are exported from the FAISS index once per index version into a flat
+.npy next to it, ordered by CV; a process pool then scores shards of whole CVs (memory-mapped,
+so the workers share one copy) against all JDs with one matrix product per shard, keeps each
+CV's best chunk and writes cosine similarities into a shared scores file.
+Filtered-out CVs score NaN and are not listed. cv_id is the candidate ID /ask cards use.
+app.py runs the same thing as a background job (POST /rank, GET /rank/{job_id}).
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+from typing import List, Optional
+
+import numpy as np
+
+from candidates import candidate_id, candidate_name
+
+# Chunk rows per process-pool task (rounded to whole CVs)
+SHARD_ROWS = 50_000
+# Rows reconstructed from the FAISS index per step while exporting
+EXPORT_BATCH = 100_000
+RESULT_FORMATS = ("csv", "parquet")
+# A running job whose process stopped sending heartbeats for this long is queued again
+HEARTBEAT_SECONDS = 15
+STALE_SECONDS = 120
+NEEDS_FAISS = ("Ranking needs the chunk vectors locally (\"VECTOR_BACKEND\": \"faiss\"); "
+               "vectors in Vertex AI Vector Search can't be exported.")
+
+logger = logging.getLogger(__name__)
+
+
+def check_backend(config):
+    """Raise ValueError unless the chunk corpus is the local FAISS store."""
+    if getattr(config, "VECTOR_BACKEND", "vertex") != "faiss":
+        raise ValueError(NEEDS_FAISS)
+
+
+# --- vector export -----------------------------------------------------------
+def export_path(index_path: str) -> str:
+    return f"{index_path}_export"
+
+
+def export_vectors(index_path: str) -> str:
+    """
+    Every chunk of `<index_path>.faiss` grouped by CV, in `<index_path>_export/`: vectors.npy
+    (float32) and norms.npy in CV order, starts.npy (first row of each CV, plus the total) and
+    cvs.json ([{"key": gcs_uri, "filename"}]). Redone only when the index file changed.
+    """
+    import faiss
+    from faiss_store import FaissStore
+    target = export_path(index_path)
+    version = str(os.path.getmtime(f"{index_path}.faiss"))
+    version_file = os.path.join(target, "VERSION")
+    if os.path.exists(version_file):
+        with open(version_file) as f:
+            if f.read() == version:
+                return target
+
+    os.makedirs(target, exist_ok=True)
+    store = FaissStore.open(index_path, mmap=False)   # a private copy: IVF needs a direct map
+    index = store.index
+    ids = faiss.vector_to_array(index.id_map).astype("int64")
+    # The CV of every chunk (as in candidates.candidate_key); chunks without a record are skipped
+    sources = store.record_values("$.metadata.gcs_uri", "$.metadata.filename")
+    keys = [(sources[i][0] or sources[i][1] or "") if i in sources else None for i in ids.tolist()]
+    rows = np.array([r for r, key in enumerate(keys) if key], dtype="int64")
+    cv_keys, group = np.unique(np.array([keys[r] for r in rows], dtype=object), return_inverse=True)
+    order = np.argsort(group, kind="stable")
+    starts = np.concatenate([[0], np.cumsum(np.bincount(group, minlength=len(cv_keys)))]).astype("int64")
+    position = np.full(len(ids), -1, dtype="int64")   # index row -> exported row
+    position[rows[order]] = np.arange(len(rows))
+
+    inner = faiss.downcast_index(index.index)
+    if isinstance(inner, faiss.IndexIVF):
+        inner.make_direct_map()
+    vectors = np.lib.format.open_memmap(os.path.join(target, "vectors.tmp.npy"), mode="w+",
+                                        dtype="float32", shape=(len(rows), inner.d))
+    for start in range(0, inner.ntotal, EXPORT_BATCH):
+        count = min(EXPORT_BATCH, inner.ntotal - start)
+        where = position[start:start + count]
+        keep = where >= 0
+        vectors[where[keep]] = inner.reconstruct_n(start, count)[keep]
+    norms = np.linalg.norm(vectors, axis=1).astype("float32")
+    vectors.flush()
+    del vectors
+
+    filenames = {}
+    for r in rows.tolist():
+        filenames.setdefault(keys[r], sources[int(ids[r])][1] or "")
+    np.save(os.path.join(target, "norms.npy"), norms)
+    np.save(os.path.join(target, "starts.npy"), starts)
+    with open(os.path.join(target, "cvs.json"), "w") as f:
+        json.dump([{"key": key, "filename": filenames[key]} for key in cv_keys.tolist()], f)
+    os.replace(os.path.join(target, "vectors.tmp.npy"), os.path.join(target, "vectors.npy"))
+    with open(version_file, "w") as f:
+        f.write(version)
+    return target
+
+
+def cv_shards(starts: np.ndarray, rows: int = SHARD_ROWS) -> list:
+    """(first CV, last CV + 1) ranges of about `rows` chunks each, never splitting a CV."""
+    shards, cv, n = [], 0, len(starts) - 1
+    while cv < n:
+        stop = int(np.searchsorted(starts, starts[cv] + rows, side="right")) - 1
+        stop = min(max(stop, cv + 1), n)
+        shards.append((cv, stop))
+        cv = stop
+    return shards
+
+
+# --- scoring (runs in the pool processes) ---------------------------------------
+def _score_shard(export_dir: str, job_dir: str, start: int, stop: int) -> int:
+    """Best chunk cosine similarity of CVs [start, stop) with every JD, NaN where a JD's filter excludes the CV."""
+    vectors = np.load(os.path.join(export_dir, "vectors.npy"), mmap_mode="r")
+    norms = np.load(os.path.join(export_dir, "norms.npy"), mmap_mode="r")
+    starts = np.load(os.path.join(export_dir, "starts.npy"))
+    queries = np.load(os.path.join(job_dir, "queries.npy"))          # unit vectors, (n_jds, dim)
+    scores = np.load(os.path.join(job_dir, "scores.npy"), mmap_mode="r+")
+    first, last = starts[start], starts[stop]
+    block = np.asarray(vectors[first:last]) @ queries.T
+    block /= np.maximum(np.asarray(norms[first:last]), 1e-12)[:, None]
+    best = np.maximum.reduceat(block, starts[start:stop] - first, axis=0)   # one row per CV
+    masks_file = os.path.join(job_dir, "masks.npy")
+    if os.path.exists(masks_file):
+        masks = np.load(masks_file, mmap_mode="r")                   # packed bits, (n_jds, ceil(n_cvs / 8))
+        lo, hi = start // 8, (stop + 7) // 8
+        bits = np.unpackbits(np.asarray(masks[:, lo:hi]), axis=1)[:, start - lo * 8:stop - lo * 8]
+        best[~bits.T.astype(bool)] = np.nan
+    scores[start:stop] = best
+    scores.flush()
+    return stop - start
+
+
+# --- jobs -------------------------------------------------------------------------
+def parse_jds(items: list) -> list:
+    """JD texts or dicts -> [{"id", "text", "filters"}]."""
+    jds = []
+    for i, item in enumerate(items):
+        if isinstance(item, str):
+            item = {"text": item}
+        jds.append({"id": str(item.get("id", i)), "text": item["text"], "filters": item.get("filters") or None})
+    return jds
+
+
+def _write_status(job_dir: str, status: dict):
+    path = os.path.join(job_dir, "status.json")
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(status, f)
+    os.replace(f"{path}.tmp", path)
+
+
+def read_status(jobs_dir: str, job_id: str) -> Optional[dict]:
+    """Status of a job, from its directory (so any worker process can answer a poll)."""
+    path = os.path.join(jobs_dir, os.path.basename(job_id), "status.json")
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def _filter_masks(jds: list, cv_keys: List[str], attributes) -> Optional[np.ndarray]:
+    """Packed (n_jds, n_cvs) bitmaps of the CVs each JD's filters allow; None if no JD has filters."""
+    from attribute_index import AttributeFilter
+    if not any(jd["filters"] for jd in jds) or not attributes.available():
+        return None
+    keys = np.array(attributes.all_keys(), dtype=object)
+    cvs = np.array(cv_keys, dtype=object)
+    masks = np.ones((len(jds), len(cvs)), dtype=bool)
+    for j, jd in enumerate(jds):
+        flt = AttributeFilter.from_dict(jd["filters"]) if jd["filters"] else None
+        if flt is None or flt.empty:
+            continue
+        masks[j] = np.isin(cvs, keys[attributes.match(flt)])
+    return np.packbits(masks, axis=1)
+
+
+def _write_results(path: str, fmt: str, jds: list, cvs: list, scores: np.ndarray, top_k: Optional[int]) -> int:
+    """Ranked rows (jd_id, rank, cv_id, name, score), best first per JD; returns the number written."""
+    columns = {"jd_id": [], "rank": [], "cv_id": [], "name": [], "score": []}
+    for j, jd in enumerate(jds):
+        column = np.asarray(scores[:, j])
+        valid = np.flatnonzero(~np.isnan(column))
+        if top_k and len(valid) > top_k:
+            valid = valid[np.argpartition(-column[valid], top_k - 1)[:top_k]]
+        ranked = valid[np.argsort(-column[valid], kind="stable")]
+        columns["jd_id"].extend([jd["id"]] * len(ranked))
+        columns["rank"].extend(range(1, len(ranked) + 1))
+        columns["cv_id"].extend(candidate_id(cvs[c]["key"]) for c in ranked)
+        columns["name"].extend(candidate_name(cvs[c]["filename"]) for c in ranked)
+        columns["score"].extend(np.round(column[ranked].astype(np.float64), 6).tolist())
+    if fmt == "parquet":
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        pq.write_table(pa.table(columns), path)
+    else:
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            writer.writerows(zip(*columns.values()))
+    return len(columns["rank"])
+
+
+def run_job(job_dir: str, jds: list, index_path: str, top_k: Optional[int] = 1000, fmt: str = "csv",
+            workers: Optional[int] = None, encode=None, attributes=None) -> dict:
+    """
+    Rank every CV of the chunk store at `index_path` for every JD; progress and the outcome go
+    to `job_dir/status.json`. `encode` (texts -> vectors) and `attributes` (AttributeIndex)
+    default to the embeddings and attribute index /ask uses.
+    """
+    if fmt not in RESULT_FORMATS:
+        raise ValueError(f"Unknown result format '{fmt}', expected one of {RESULT_FORMATS}")
+    os.makedirs(job_dir, exist_ok=True)
+    status = {"state": "running", "index": index_path, "jds": len(jds), "cvs": None, "top_k": top_k, "format": fmt,
+              "progress": {"shards_done": 0, "shards": None}, "started": time.time(),
+              "finished": None, "result": None, "rows": None, "error": None}
+    _write_status(job_dir, status)
+    try:
+        if encode is None or attributes is None:
+            import chat_rag
+            encode = encode or (lambda texts: [chat_rag.get_embeddings().embed_query(t) for t in texts])
+            attributes = attributes or chat_rag.get_attribute_index()
+        if not os.path.exists(f"{index_path}.faiss"):
+            raise ValueError(f"No chunk index at {index_path}.faiss; ingest CVs first")
+
+        export_dir = export_vectors(index_path)
+        starts = np.load(os.path.join(export_dir, "starts.npy"))
+        with open(os.path.join(export_dir, "cvs.json")) as f:
+            cvs = json.load(f)
+        n = len(cvs)
+        queries = np.asarray(encode([jd["text"] for jd in jds]), dtype="float32")
+        queries /= np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        np.save(os.path.join(job_dir, "queries.npy"), queries)
+        masks = _filter_masks(jds, [cv["key"] for cv in cvs], attributes)
+        if masks is not None:
+            np.save(os.path.join(job_dir, "masks.npy"), masks)
+        np.lib.format.open_memmap(os.path.join(job_dir, "scores.npy"), mode="w+",
+                                  dtype="float32", shape=(n, len(jds))).flush()
+
+        shards = cv_shards(starts)
+        status.update(cvs=n, progress={"shards_done": 0, "shards": len(shards)})
+        _write_status(job_dir, status)
+        # spawn, not fork: the API process has threads and gRPC channels that must not be forked
+        with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn")) as pool:
+            futures = [pool.submit(_score_shard, export_dir, job_dir, start, stop) for start, stop in shards]
+            for future in as_completed(futures):
+                future.result()
+                status["progress"]["shards_done"] += 1
+                _write_status(job_dir, status)
+
+        scores = np.load(os.path.join(job_dir, "scores.npy"), mmap_mode="r")
+        result = os.path.join(job_dir, f"ranked.{fmt}")
+        status["rows"] = _write_results(result, fmt, jds, cvs, scores, top_k)
+        del scores
+        for name in ("queries.npy", "masks.npy", "scores.npy"):
+            if os.path.exists(os.path.join(job_dir, name)):
+                os.remove(os.path.join(job_dir, name))
+        status.update(state="done", result=result)
+    except Exception as e:
+        traceback.print_exc()
+        status.update(state="failed", error=str(e))
+    status["finished"] = time.time()
+    status["seconds"] = round(status["finished"] - status["started"], 3)
+    _write_status(job_dir, status)
+    return status
+
+
+class RankingJobs:
+    """
+    Ranking job queue shared by every process on the machine. Jobs are rows in
+    `jobs_dir/jobs.sqlite`, with their JDs and status.json in `jobs_dir/<job_id>/`, so they
+    survive restarts, and at most `max_running` run at once across all server workers (each
+    job already uses every core through its process pool). Every process polls for queued
+    jobs on a background thread; a job whose process died is queued again.
+    """
+
+    def __init__(self, jobs_dir: str = "ranking_jobs", index_path: str = "chunk_index", workers: Optional[int] = None,
+                 max_running: int = 1, poll_seconds: float = 2.0, backend: str = "faiss"):
+        self.jobs_dir = jobs_dir
+        self.index_path = index_path
+        self.backend = backend
+        self.workers = workers
+        self.max_running = max_running
+        self.poll_seconds = poll_seconds
+        self._lock = threading.Lock()
+        self._pid = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._db()
+
+    @classmethod
+    def from_config(cls, config) -> "RankingJobs":
+        return cls(getattr(config, "RANKING_JOBS_DIR", "ranking_jobs"),
+                   getattr(config, "FAISS_INDEX_PATH", "chunk_index"),
+                   getattr(config, "RANKING_WORKERS", None),
+                   getattr(config, "RANKING_MAX_RUNNING", 1),
+                   backend=getattr(config, "VECTOR_BACKEND", "vertex"))
+
+    def _db(self) -> sqlite3.Connection:
+        # One connection per process (see SqliteSessionStore); transactions are explicit
+        if self._pid != os.getpid():
+            os.makedirs(self.jobs_dir, exist_ok=True)
+            self._conn = sqlite3.connect(os.path.join(self.jobs_dir, "jobs.sqlite"), check_same_thread=False,
+                                         timeout=30, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, state TEXT NOT NULL,"
+                               " created REAL NOT NULL, heartbeat REAL)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs(state, created)")
+            self._pid = os.getpid()
+        return self._conn
+
+    def submit(self, jds: list, top_k: Optional[int] = 1000, fmt: str = "csv") -> str:
+        """Queue a job; raises ValueError if the chunk vectors aren't local (see check_backend)."""
+        if self.backend != "faiss":
+            raise ValueError(NEEDS_FAISS)
+        if fmt not in RESULT_FORMATS:
+            raise ValueError(f"Unknown result format '{fmt}', expected one of {RESULT_FORMATS}")
+        job_id = uuid.uuid4().hex
+        job_dir = os.path.join(self.jobs_dir, job_id)
+        os.makedirs(job_dir)
+        with open(os.path.join(job_dir, "job.json"), "w") as f:
+            json.dump({"jds": jds, "top_k": top_k, "format": fmt}, f)
+        _write_status(job_dir, {"state": "queued", "index": self.index_path, "jds": len(jds), "top_k": top_k,
+                                "format": fmt, "progress": {"shards_done": 0, "shards": None},
+                                "result": None, "error": None})
+        with self._lock:
+            self._db().execute("INSERT INTO jobs (id, state, created) VALUES (?, 'queued', ?)", (job_id, time.time()))
+        self.start()
+        return job_id
+
+    def _claim(self) -> Optional[str]:
+        """Requeue jobs of dead processes, then take the oldest queued job if a run slot is free."""
+        with self._lock:
+            db = self._db()
+            if db.execute("SELECT 1 FROM jobs WHERE state IN ('queued', 'running') LIMIT 1").fetchone() is None:
+                return None
+            now = time.time()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                stale = [row[0] for row in db.execute(
+                    "SELECT id FROM jobs WHERE state = 'running' AND heartbeat < ?", (now - STALE_SECONDS,))]
+                db.executemany("UPDATE jobs SET state = 'queued' WHERE id = ?", [(job_id,) for job_id in stale])
+                job = None
+                if db.execute("SELECT COUNT(*) FROM jobs WHERE state = 'running'").fetchone()[0] < self.max_running:
+                    job = db.execute("SELECT id FROM jobs WHERE state = 'queued' ORDER BY created LIMIT 1").fetchone()
+                    if job is not None:
+                        db.execute("UPDATE jobs SET state = 'running', heartbeat = ? WHERE id = ?", (now, job[0]))
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        for job_id in stale:
+            logger.warning("Ranking job %s lost its process, queued again", job_id)
+            status = self.status(job_id) or {}
+            _write_status(os.path.join(self.jobs_dir, job_id),
+                          dict(status, state="queued", progress={"shards_done": 0, "shards": None}))
+        return job[0] if job is not None else None
+
+    def _heartbeat(self, job_id: str, done: threading.Event):
+        while not done.wait(HEARTBEAT_SECONDS):
+            with self._lock:
+                self._db().execute("UPDATE jobs SET heartbeat = ? WHERE id = ?", (time.time(), job_id))
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                job_id = self._claim()
+            except sqlite3.Error:
+                logger.exception("Could not poll the ranking job queue")
+                job_id = None
+            if job_id is None:
+                self._stop.wait(self.poll_seconds)
+                continue
+            job_dir = os.path.join(self.jobs_dir, job_id)
+            done = threading.Event()
+            threading.Thread(target=self._heartbeat, args=(job_id, done), daemon=True).start()
+            try:
+                with open(os.path.join(job_dir, "job.json")) as f:
+                    spec = json.load(f)
+                state = run_job(job_dir, spec["jds"], self.index_path, spec["top_k"], spec["format"],
+                                self.workers)["state"]
+            except Exception:
+                logger.exception("Ranking job %s failed", job_id)
+                state = "failed"
+            finally:
+                done.set()
+            with self._lock:
+                self._db().execute("UPDATE jobs SET state = ? WHERE id = ?", (state, job_id))
+
+    def start(self):
+        """Start polling for jobs in this process (idempotent)."""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="ranking-jobs", daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def status(self, job_id: str) -> Optional[dict]:
+        return read_status(self.jobs_dir, job_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = dict(self._db().execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+        return {state: counts.get(state, 0) for state in ("queued", "running", "done", "failed")}
+
+
+if __name__ == "__main__":
+    from config_manager import ConfigManager
+    config = ConfigManager()
+    parser = argparse.ArgumentParser(description="Rank every CV against job descriptions")
+    parser.add_argument("jds", help="JSON list of JD texts or {id, text, filters} objects")
+    parser.add_argument("--out", default="ranked.csv", help="result file (.csv or .parquet)")
+    parser.add_argument("--top-k", type=int, default=1000, help="CVs listed per JD (0 = all that pass the filters)")
+    parser.add_argument("--workers", type=int, help="scoring processes (default: one per core)")
+    parser.add_argument("--index", default=getattr(config, "FAISS_INDEX_PATH", "chunk_index"),
+                        help="FAISS chunk store (default: FAISS_INDEX_PATH)")
+    args = parser.parse_args()
+    try:
+        check_backend(config)
+    except ValueError as e:
+        raise SystemExit(str(e))
+
+    with open(args.jds) as f:
+        jds = parse_jds(json.load(f))
+    fmt = "parquet" if args.out.endswith(".parquet") else "csv"
+    job_dir = os.path.join(getattr(config, "RANKING_JOBS_DIR", "ranking_jobs"), uuid.uuid4().hex)
+    status = run_job(job_dir, jds, args.index, args.top_k or None, fmt, args.workers)
+    if status["state"] == "done":
+        os.replace(status["result"], args.out)
+        status["result"] = args.out
+    shutil.rmtree(job_dir, ignore_errors=True)
+    print(json.dumps(status, indent=2))
@@ -0,0 +1,182 @@
+# file: response_format.py
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+# Card fields that are the same on every card (or only used by the full web UI)
+_CONSTANT_FIELDS = ("role", "avatar", "gradientFrom", "gradientTo", "initials", "cvUrl")
+
+
+def compact_card(card: dict) -> dict:
+    """A card without constant or empty fields; the excerpt moves to `snippet` (see paginate)."""
+    return {k: v for k, v in card.items() if k not in _CONSTANT_FIELDS and v not in ("", None, [])}
+
+
+class ResultStore:
+    """
+    Recent /ask candidate lists, so clients can page through them with a cursor and
+    fetch a candidate's full text by ID later. Bounded and short-lived: a cursor that
+    has expired gets a 410 and the client re-asks. Per process; with several worker
+    processes use SqliteResultStore so any worker can serve any cursor.
+    """
+
+    def __init__(self, max_results: int = 2000, ttl: float = 900.0):
+        self.max_results = max_results
+        self.ttl = ttl
+        self._results: "OrderedDict[str, tuple]" = OrderedDict()   # result id -> (cards, compact, created)
+        self._sources: "OrderedDict[str, str]" = OrderedDict()      # candidate id -> source key (gcs_uri)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config) -> "ResultStore":
+        """In memory, or in SQLite if config.json sets "RESULT_STORE_PATH"."""
+        limits = (getattr(config, "RESULT_STORE_MAX_RESULTS", 2000), getattr(config, "RESULT_STORE_TTL_SECONDS", 900))
+        path = getattr(config, "RESULT_STORE_PATH", None)
+        return SqliteResultStore(path, *limits) if path else cls(*limits)
+
+    def put(self, cards: List[dict], compact: bool) -> str:
+        result_id = uuid.uuid4().hex
+        with self._lock:
+            self._results[result_id] = (cards, compact, time.time())
+            while len(self._results) > self.max_results:
+                self._results.popitem(last=False)
+        return result_id
+
+    def remember(self, sources: Dict[str, str]):
+        """Candidate ID -> source key (gcs_uri) of cards just handed out."""
+        with self._lock:
+            for candidate_id, key in sources.items():
+                self._sources[candidate_id] = key
+                self._sources.move_to_end(candidate_id)
+            while len(self._sources) > self.max_results * 20:
+                self._sources.popitem(last=False)
+
+    def get(self, result_id: str) -> Optional[Tuple[List[dict], bool]]:
+        with self._lock:
+            entry = self._results.get(result_id)
+            if entry is None or time.time() - entry[2] > self.ttl:
+                self._results.pop(result_id, None)
+                return None
+            return entry[0], entry[1]
+
+    def source(self, candidate_id: str) -> Optional[str]:
+        with self._lock:
+            return self._sources.get(candidate_id)
+
+
+class SqliteResultStore(ResultStore):
+    """ResultStore in a local SQLite file, shared by every worker process on the machine."""
+
+    def __init__(self, path: str = "results.sqlite", max_results: int = 2000, ttl: float = 900.0):
+        super().__init__(max_results, ttl)
+        self.path = path
+        self._pid = None
+        self._db()
+
+    def _db(self) -> sqlite3.Connection:
+        # One connection per process (see SqliteSessionStore)
+        if self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS results ("
+                               " id TEXT PRIMARY KEY, cards TEXT NOT NULL, compact INTEGER NOT NULL, created REAL NOT NULL)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS results_created ON results(created)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS sources ("
+                               " id TEXT PRIMARY KEY, key TEXT NOT NULL, used REAL NOT NULL)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS sources_used ON sources(used)")
+            self._conn.commit()
+            self._pid = os.getpid()
+        return self._conn
+
+    def put(self, cards, compact):
+        result_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            db.execute("INSERT INTO results (id, cards, compact, created) VALUES (?, ?, ?, ?)",
+                       (result_id, json.dumps(cards, separators=(",", ":")), int(compact), now))
+            db.execute("DELETE FROM results WHERE created < ?", (now - self.ttl,))
+            db.commit()
+        return result_id
+
+    def remember(self, sources):
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            db.executemany("INSERT OR REPLACE INTO sources (id, key, used) VALUES (?, ?, ?)",
+                           [(cid, key, now) for cid, key in sources.items()])
+            db.execute("DELETE FROM sources WHERE used < ?", (now - self.ttl,))
+            db.commit()
+
+    def get(self, result_id):
+        with self._lock:
+            row = self._db().execute("SELECT cards, compact, created FROM results WHERE id = ?",
+                                     (result_id,)).fetchone()
+        if row is None or time.time() - row[2] > self.ttl:
+            return None
+        return json.loads(row[0]), bool(row[1])
+
+    def source(self, candidate_id):
+        with self._lock:
+            row = self._db().execute("SELECT key FROM sources WHERE id = ?", (candidate_id,)).fetchone()
+        return row[0] if row else None
+
+
+def encode_cursor(result_id: str, offset: int) -> str:
+    return f"{result_id}.{offset}"
+
+
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+    result_id, _, offset = cursor.partition(".")
+    if not result_id or not offset.isdigit():
+        raise ValueError("Malformed cursor.")
+    return result_id, int(offset)
+
+
+def paginate(cards: List[dict], compact: bool, offset: int, page_size: Optional[int],
+             result_id: Optional[str]) -> dict:
+    """
+    One page of cards plus `next_cursor` (None on the last page). In compact mode every
+    distinct excerpt is sent once in `snippets` and cards refer to it by index.
+    """
+    end = len(cards) if page_size is None else min(len(cards), offset + page_size)
+    page = cards[offset:end]
+    body = {"total": len(cards),
+            "next_cursor": encode_cursor(result_id, end) if result_id and end < len(cards) else None}
+    if not compact:
+        body["content"] = page
+        return body
+    snippets: List[str] = []
+    index: Dict[str, int] = {}
+    content = []
+    for card in page:
+        card = dict(card)
+        text = card.pop("text", None)
+        if text:
+            if text not in index:
+                index[text] = len(snippets)
+                snippets.append(text)
+            card["snippet"] = index[text]
+        content.append(card)
+    body["content"] = content
+    body["snippets"] = snippets
+    return body
+
+
+def merge_chunks(chunks: List[Tuple[int, str]]) -> str:
+    """Rebuild a document from overlapping (start offset, text) chunks."""
+    text = ""
+    for start, chunk in sorted(chunks):
+        if start > len(text) and text:
+            text += "\n" + chunk   # the splitter dropped whitespace between chunks
+        elif start >= len(text):
+            text += chunk
+        elif start + len(chunk) > len(text):
+            text += chunk[len(text) - start:]
+    return text
@@ -0,0 +1,125 @@
+# file: retrieval_cache.py
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional
+
+import numpy as np
+
+
+class SemanticRetrievalCache:
+    """
+    Caches vector-search results keyed by the query embedding.
+    A lookup hits when a cached query has cosine similarity >= `threshold` with the new one,
+    so near-identical recruiter questions skip the Vector Search round trip.
+    Entries expire after `ttl` seconds, the least recently used go first once `max_entries`
+    is reached, and everything is dropped when `generation_path` (the ingestion manifest) changes.
+    """
+
+    def __init__(self, threshold: float = 0.95, max_entries: int = 1024, ttl: float = 600.0,
+                 generation_path: Optional[str] = None):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.generation_path = generation_path
+        self._generation = self._current_generation()
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()  # id -> (unit vector, docs, created, latency, scope)
+        self._matrix = None   # stacked unit vectors of _entries, rebuilt lazily
+        self._matrix_ids: List[int] = []
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.seconds_saved = 0.0
+
+    @classmethod
+    def from_config(cls, config) -> "SemanticRetrievalCache":
+        return cls(
+            threshold=getattr(config, "RETRIEVAL_CACHE_SIMILARITY", 0.95),
+            max_entries=getattr(config, "RETRIEVAL_CACHE_MAX_ENTRIES", 1024),
+            ttl=getattr(config, "RETRIEVAL_CACHE_TTL_SECONDS", 600),
+            generation_path=getattr(config, "INGEST_MANIFEST_PATH", "ingest_manifest.json"),
+        )
+
+    def _current_generation(self):
+        if self.generation_path and os.path.exists(self.generation_path):
+            return os.path.getmtime(self.generation_path)
+        return None
+
+    @staticmethod
+    def _unit(vec) -> np.ndarray:
+        vec = np.asarray(vec, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+            self.invalidations += 1
+
+    def _expire(self, now: float):
+        # Called with the lock held
+        generation = self._current_generation()
+        if generation != self._generation:
+            self._generation = generation
+            self._entries.clear()
+            self._matrix = None
+            self.invalidations += 1
+            return
+        expired = [i for i, entry in self._entries.items() if now - entry[2] > self.ttl]
+        for i in expired:
+            del self._entries[i]
+        if expired:
+            self._matrix = None
+
+    def get(self, query_vec, scope=None) -> Optional[list]:
+        """
+        Cached docs of the most similar cached query, or None on a miss.
+        Only entries stored with the same `scope` (e.g. the attribute filter) can hit.
+        """
+        unit = self._unit(query_vec)
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            if self._entries:
+                if self._matrix is None:
+                    self._matrix_ids = list(self._entries.keys())
+                    self._matrix = np.stack([self._entries[i][0] for i in self._matrix_ids])
+                sims = self._matrix @ unit
+                sims = np.where([self._entries[i][4] == scope for i in self._matrix_ids], sims, -np.inf)
+                best = int(np.argmax(sims))
+                if sims[best] >= self.threshold:
+                    entry_id = self._matrix_ids[best]
+                    self._entries.move_to_end(entry_id)
+                    self.hits += 1
+                    self.seconds_saved += self._entries[entry_id][3]
+                    return list(self._entries[entry_id][1])
+            self.misses += 1
+            return None
+
+    def put(self, query_vec, docs: list, latency: float, scope=None):
+        """Store search results; `latency` is what a future hit saves."""
+        with self._lock:
+            self._entries[self._next_id] = (self._unit(query_vec), list(docs), time.time(), latency, scope)
+            self._next_id += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            self._matrix = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "seconds_saved": round(self.seconds_saved, 3),
+            }
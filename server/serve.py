@@ -0,0 +1,120 @@
+# file: serve.py
+"""
+Production server for app.py: N worker processes behind one port (gunicorn + uvicorn workers).
+
+    python serve.py --workers 4 --port 8000
+
+`uvicorn app:app --reload` stays the way to develop. Here the app is imported once in the
+master and the fork-safe part of warmup (libraries, prompt, local index pages) is done there
+before forking, so workers start hot; each worker then builds its own network clients.
+State that must be shared between workers is moved out of process memory:
+sessions and paged /ask results go to SQLite, metrics are summed across workers.
+On SIGTERM workers stop accepting connections and finish in-flight /ask calls
+(up to DRAIN_TIMEOUT_SECONDS) before exiting.
+With "UPLOAD_WORKER": "process" the master also runs the one upload worker (upload_queue.py).
+"""
+import argparse
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from config_manager import ConfigManager
+
+config = ConfigManager()
+logger = logging.getLogger("serve")
+
+
+def share_state(workers: int):
+    """Point per-process state at stores every worker can see; before app.py is imported."""
+    if workers <= 1:
+        return
+    if getattr(config, "SESSION_BACKEND", "memory") == "memory":
+        logger.warning("SESSION_BACKEND 'memory' is per process; using 'sqlite' for %d workers", workers)
+        config.SESSION_BACKEND = "sqlite"
+    if not getattr(config, "RESULT_STORE_PATH", None):
+        config.RESULT_STORE_PATH = "results.sqlite"
+    if not getattr(config, "METRICS_MULTIPROCESS_DIR", None):
+        config.METRICS_MULTIPROCESS_DIR = os.path.join(tempfile.gettempdir(), "hirepal-metrics")
+    if getattr(config, "UPLOAD_WORKER", "external") == "thread":
+        logger.warning("UPLOAD_WORKER 'thread' would start one per worker; using 'process' for %d workers", workers)
+        config.UPLOAD_WORKER = "process"
+
+
+def _worker_class() -> str:
+    # The worker moved out of uvicorn into its own package; use whichever is installed
+    try:
+        import uvicorn_worker  # noqa: F401
+        return "uvicorn_worker.UvicornWorker"
+    except ImportError:
+        return "uvicorn.workers.UvicornWorker"
+
+
+def run(args):
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        raise SystemExit("serve.py needs gunicorn (pip install gunicorn); for development use "
+                         "`uvicorn app:app --reload`")
+
+    share_state(args.workers)
+    metrics_dir = getattr(config, "METRICS_MULTIPROCESS_DIR", None)
+    upload_worker = []
+
+    def on_starting(server):
+        # Snapshots of a previous run would be added to this run's counters
+        if metrics_dir:
+            shutil.rmtree(metrics_dir, ignore_errors=True)
+        # One upload worker for the whole server, owned by the master
+        if getattr(config, "UPLOAD_WORKER", "external") == "process":
+            script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "upload_queue.py")
+            upload_worker.append(subprocess.Popen([sys.executable, script]))
+
+    def on_exit(server):
+        for proc in upload_worker:
+            proc.terminate()   # it publishes its current batch before exiting
+            try:
+                proc.wait(timeout=getattr(config, "UPLOAD_STOP_TIMEOUT", 120))
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+    class Server(BaseApplication):
+        def load_config(self):
+            options = {
+                "bind": f"{args.host}:{args.port}",
+                "workers": args.workers,
+                "worker_class": _worker_class(),
+                "preload_app": True,
+                "graceful_timeout": args.drain_timeout,
+                "timeout": args.drain_timeout + 30,
+                "keepalive": 5,
+                "on_starting": on_starting,
+                "on_exit": on_exit,
+            }
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            import app
+            from chat_rag import preload
+            logger.warning("Preloaded before forking %d workers: %s", args.workers, preload())
+            return app.app
+
+    Server().run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run app.py with several worker processes")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", 8000)))
+    parser.add_argument("--workers", type=int, default=getattr(config, "WORKERS", os.cpu_count() or 1),
+                        help="worker processes (default: one per core)")
+    parser.add_argument("--drain-timeout", type=int, default=getattr(config, "DRAIN_TIMEOUT_SECONDS", 60),
+                        help="seconds a stopping worker waits for in-flight requests")
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+# file: session_store.py
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+from typing import Optional
+
+from langchain_core.chat_history import BaseChatMessageHistory, InMemoryChatMessageHistory
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+# Compact role tags used in the serialized form
+_ROLE_TAGS = {"human": "h", "ai": "a", "system": "s"}
+_TAG_TYPES = {"h": HumanMessage, "a": AIMessage, "s": SystemMessage}
+
+
+def serialize_history(history: BaseChatMessageHistory, max_messages: Optional[int] = None) -> bytes:
+    """
+    zlib-compressed JSON list of [role tag, content] (plus additional_kwargs if any, e.g. the
+    candidate IDs of an answer), keeping only the newest `max_messages`.
+    """
+    messages = history.messages
+    if max_messages is not None and len(messages) > max_messages:
+        messages = messages[-max_messages:]
+    rows = [[_ROLE_TAGS.get(m.type, "s"), m.content] + ([m.additional_kwargs] if m.additional_kwargs else [])
+            for m in messages]
+    return zlib.compress(json.dumps(rows, separators=(",", ":")).encode("utf-8"))
+
+
+def deserialize_history(blob: bytes) -> InMemoryChatMessageHistory:
+    history = InMemoryChatMessageHistory()
+    for tag, content, *extra in json.loads(zlib.decompress(blob)):
+        history.add_message(_TAG_TYPES[tag](content=content, additional_kwargs=extra[0] if extra else {}))
+    return history
+
+
+class SessionStore:
+    """
+    Chat sessions with an idle TTL, a cap on the number of sessions (least recently used
+    are evicted first) and a cap on messages kept per session.
+    `get` returns a fresh history object; call `save` after changing it.
+    """
+
+    def __init__(self, idle_ttl: float = 3600.0, max_sessions: int = 10_000, max_messages: int = 50):
+        self.idle_ttl = idle_ttl
+        self.max_sessions = max_sessions
+        self.max_messages = max_messages
+        self.created = 0
+        self.evicted = 0
+        self.expired = 0
+
+    def create(self) -> str:
+        raise NotImplementedError
+
+    def get(self, session_id: str) -> Optional[BaseChatMessageHistory]:
+        raise NotImplementedError
+
+    def save(self, session_id: str, history: BaseChatMessageHistory):
+        raise NotImplementedError
+
+    def delete(self, session_id: str):
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        return {"created": self.created, "evicted": self.evicted, "expired": self.expired}
+
+
+class InMemorySessionStore(SessionStore):
+    """Per-process store; sessions are kept serialized so idle ones cost only a few hundred bytes."""
+
+    def __init__(self, **limits):
+        super().__init__(**limits)
+        self._sessions: "OrderedDict[str, list]" = OrderedDict()   # id -> [blob, last_used]
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def _sweep(self, now: float):
+        # Oldest entries sit at the front, so stop at the first one still alive
+        while self._sessions:
+            session_id, (blob, last_used) = next(iter(self._sessions.items()))
+            if now - last_used <= self.idle_ttl:
+                break
+            self._drop(session_id)
+            self.expired += 1
+
+    def _drop(self, session_id: str):
+        blob, _ = self._sessions.pop(session_id)
+        self._bytes -= len(blob)
+
+    def create(self) -> str:
+        session_id = str(uuid.uuid4())
+        blob = serialize_history(InMemoryChatMessageHistory())
+        now = time.time()
+        with self._lock:
+            self._sweep(now)
+            self._sessions[session_id] = [blob, now]
+            self._bytes += len(blob)
+            self.created += 1
+            while len(self._sessions) > self.max_sessions:
+                self._drop(next(iter(self._sessions)))
+                self.evicted += 1
+        return session_id
+
+    def get(self, session_id: str) -> Optional[BaseChatMessageHistory]:
+        now = time.time()
+        with self._lock:
+            self._sweep(now)
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            entry[1] = now
+            self._sessions.move_to_end(session_id)
+            blob = entry[0]
+        return deserialize_history(blob)
+
+    def save(self, session_id: str, history: BaseChatMessageHistory):
+        blob = serialize_history(history, self.max_messages)
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return  # evicted while the request was running
+            self._bytes += len(blob) - len(entry[0])
+            entry[0], entry[1] = blob, time.time()
+            self._sessions.move_to_end(session_id)
+
+    def delete(self, session_id: str):
+        with self._lock:
+            if session_id in self._sessions:
+                self._drop(session_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(super().stats(), backend="memory", sessions=len(self._sessions), bytes=self._bytes)
+
+
+class SqliteSessionStore(SessionStore):
+    """Local SQLite store, shared by every worker process on the machine and kept across restarts."""
+
+    def __init__(self, path: str = "sessions.sqlite", **limits):
+        super().__init__(**limits)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self._db()
+
+    def _db(self) -> sqlite3.Connection:
+        # One connection per process: a connection must not be used across fork (preloaded app servers)
+        if self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                " id TEXT PRIMARY KEY, data BLOB NOT NULL, last_used REAL NOT NULL)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS sessions_last_used ON sessions(last_used)")
+            self._conn.commit()
+            self._pid = os.getpid()
+        return self._conn
+
+    def _sweep(self, db: sqlite3.Connection, now: float):
+        # Called with the lock held, on session creation only (keeps reads cheap)
+        cur = db.execute("DELETE FROM sessions WHERE last_used < ?", (now - self.idle_ttl,))
+        self.expired += cur.rowcount
+        count = db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+        if count > self.max_sessions:
+            cur = db.execute(
+                "DELETE FROM sessions WHERE id IN (SELECT id FROM sessions ORDER BY last_used LIMIT ?)",
+                (count - self.max_sessions,))
+            self.evicted += cur.rowcount
+
+    def create(self) -> str:
+        session_id = str(uuid.uuid4())
+        blob = serialize_history(InMemoryChatMessageHistory())
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            db.execute("INSERT INTO sessions (id, data, last_used) VALUES (?, ?, ?)",
+                       (session_id, blob, now))
+            self._sweep(db, now)
+            db.commit()
+            self.created += 1
+        return session_id
+
+    def get(self, session_id: str) -> Optional[BaseChatMessageHistory]:
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            row = db.execute("SELECT data, last_used FROM sessions WHERE id = ?",
+                             (session_id,)).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.idle_ttl:
+                db.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+                db.commit()
+                self.expired += 1
+                return None
+            db.execute("UPDATE sessions SET last_used = ? WHERE id = ?", (now, session_id))
+            db.commit()
+        return deserialize_history(row[0])
+
+    def save(self, session_id: str, history: BaseChatMessageHistory):
+        blob = serialize_history(history, self.max_messages)
+        with self._lock:
+            db = self._db()
+            db.execute("UPDATE sessions SET data = ?, last_used = ? WHERE id = ?",
+                       (blob, time.time(), session_id))
+            db.commit()
+
+    def delete(self, session_id: str):
+        with self._lock:
+            db = self._db()
+            db.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+            db.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            db = self._db()
+            count, size = db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0) FROM sessions").fetchone()
+        return dict(super().stats(), backend="sqlite", sessions=count, bytes=size)
+
+
+def create_session_store(config) -> SessionStore:
+    """Pick the backend from config.json ("SESSION_BACKEND": "memory" or "sqlite")."""
+    limits = {
+        "idle_ttl": getattr(config, "SESSION_IDLE_TTL_SECONDS", 3600),
+        "max_sessions": getattr(config, "SESSION_MAX_SESSIONS", 10_000),
+        "max_messages": getattr(config, "SESSION_MAX_MESSAGES", 50),
+    }
+    backend = getattr(config, "SESSION_BACKEND", "memory")
+    if backend == "sqlite":
+        return SqliteSessionStore(getattr(config, "SESSION_DB_PATH", "sessions.sqlite"), **limits)
+    if backend == "memory":
+        return InMemorySessionStore(**limits)
+    raise ValueError(f"Unknown SESSION_BACKEND '{backend}', expected 'memory' or 'sqlite'")
@@ -0,0 +1,57 @@
+# file: singleflight.py
+import asyncio
+import hashlib
+import json
+import re
+import unicodedata
+from typing import Awaitable, Callable, Dict, Hashable, Sequence, Tuple
+
+from metrics import COALESCED
+
+
+class SingleFlight:
+    """
+    Concurrent calls with the same key share one in-flight computation: the first caller
+    (leader) starts it, callers arriving before it finishes (followers) await the same
+    result or exception. Nothing is kept afterwards, so this is not a cache.
+    The computation runs as its own task, so a leader whose client disconnects
+    doesn't cancel it for the followers.
+
+        answer = await flights.do(("llm", key), lambda: llm.ainvoke(msgs))
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: Dict[Tuple[int, Hashable], asyncio.Future] = {}
+        self.leaders = 0
+        self.followers = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable]):
+        loop = asyncio.get_running_loop()
+        slot = (id(loop), key)   # futures belong to one event loop
+        task = self._inflight.get(slot)
+        if task is None:
+            self.leaders += 1
+            COALESCED.inc(call=self.name, role="leader")
+            task = self._inflight[slot] = loop.create_task(fn())
+            task.add_done_callback(lambda _: self._inflight.pop(slot, None))
+        else:
+            self.followers += 1
+            COALESCED.inc(call=self.name, role="follower")
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        total = self.leaders + self.followers
+        return {"leaders": self.leaders, "followers": self.followers, "in_flight": len(self._inflight),
+                "coalesced_rate": round(self.followers / total, 4) if total else 0.0}
+
+
+def question_key(question: str) -> str:
+    """Questions that differ only in case, whitespace or unicode form coalesce (as in embedding_cache)."""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", question)).strip().casefold()
+
+
+def messages_key(messages: Sequence) -> str:
+    """Digest of a full LLM prompt (history, context and question), which determines the answer."""
+    rows = [[m.type, m.content] for m in messages]
+    return hashlib.sha256(json.dumps(rows, separators=(",", ":")).encode("utf-8")).hexdigest()
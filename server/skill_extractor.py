@@ -0,0 +1,121 @@
+# file: skill_extractor.py
+import json
+import os
+import threading
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+TAXONOMY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "skills.json")
+
+
+def _is_word_char(c: str) -> bool:
+    # '+' and '#' count as part of a word so "c" never matches inside "c++" or "c#"
+    return c.isalnum() or c in "+#"
+
+
+class SkillMatcher:
+    """
+    Aho-Corasick matcher over a skill taxonomy {display name: [aliases]}.
+    Finds every alias in one pass over the text, keeps only whole-word matches
+    (so "js" doesn't match "json"), prefers the longest match at each position
+    and maps aliases to their display name ("node.js" -> "Node").
+    Only the aliases are matched: a display name that is also an ordinary word
+    ("Go", "R", "Express") is left out of its aliases on purpose.
+    """
+
+    def __init__(self, taxonomy: Dict[str, List[str]]):
+        # Trie as parallel lists: transitions, failure link, (alias length, skill) outputs
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[Tuple[int, str]]] = [[]]
+        self._names = {skill.lower(): skill for skill in taxonomy}
+        for skill, aliases in taxonomy.items():
+            for alias in set(a.lower() for a in aliases):
+                self._insert(alias, skill)
+        self._build_links()
+
+    def _insert(self, pattern: str, skill: str):
+        node = 0
+        for c in pattern:
+            nxt = self._goto[node].get(c)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][c] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            node = nxt
+        self._out[node].append((len(pattern), skill))
+
+    def _build_links(self):
+        # Breadth-first so every failure link points at an already finished node
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for c, child in self._goto[node].items():
+                queue.append(child)
+                if node == 0:
+                    continue  # depth-1 nodes fail back to the root
+                f = self._fail[node]
+                while f and c not in self._goto[f]:
+                    f = self._fail[f]
+                self._fail[child] = self._goto[f].get(c, 0)
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+
+    def find(self, text: str) -> List[Tuple[int, int, str]]:
+        """All whole-word matches as (start, end, skill), non-overlapping, longest first."""
+        text = text.lower()
+        n = len(text)
+        matches = []
+        node = 0
+        for i, c in enumerate(text):
+            while node and c not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(c, 0)
+            for length, skill in self._out[node]:
+                start, end = i - length + 1, i + 1
+                if (start == 0 or not _is_word_char(text[start - 1])) and \
+                        (end == n or not _is_word_char(text[end])):
+                    matches.append((start, end, skill))
+
+        # Resolve overlaps: leftmost first, then the longest alias at that position
+        matches.sort(key=lambda m: (m[0], m[0] - m[1]))
+        kept = []
+        last_end = -1
+        for start, end, skill in matches:
+            if start >= last_end:
+                kept.append((start, end, skill))
+                last_end = end
+        return kept
+
+    def extract(self, text: str, limit: Optional[int] = None) -> List[str]:
+        """Distinct skills in order of first appearance."""
+        skills = list(dict.fromkeys(skill for _, _, skill in self.find(text)))
+        return skills[:limit] if limit is not None else skills
+
+    def canonical(self, name: str) -> str:
+        """Display name for a skill named on its own (e.g. in an API filter): display name or alias."""
+        return self._names.get(name.strip().lower()) or next(iter(self.extract(name)), name)
+
+
+_default_matcher = None
+_lock = threading.Lock()
+
+
+def get_matcher() -> SkillMatcher:
+    """Matcher for skills.json, built once per process."""
+    global _default_matcher
+    if _default_matcher is None:
+        with _lock:
+            if _default_matcher is None:
+                with open(TAXONOMY_PATH, "r") as f:
+                    _default_matcher = SkillMatcher(json.load(f))
+    return _default_matcher
+
+
+def extract_skills(text: str, limit: Optional[int] = None) -> List[str]:
+    return get_matcher().extract(text, limit)
+
+
+def canonical_skill(name: str) -> str:
+    return get_matcher().canonical(name)
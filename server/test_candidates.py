@@ -0,0 +1,57 @@
+# file: test_candidates.py
+from types import SimpleNamespace
+
+import pytest
+
+from candidates import RRF_K, candidate_id, count_candidates, group_candidates, refetch_size
+
+
+def chunk(source: str, text: str = ""):
+    return SimpleNamespace(page_content=text, metadata={"gcs_uri": f"gs://cvs/{source}", "filename": source})
+
+
+# One strong chunk for a.pdf, several good ones for b.pdf
+RANKED = [(chunk("a.pdf"), 0.95), (chunk("b.pdf"), 0.90), (chunk("b.pdf"), 0.89),
+          (chunk("c.pdf"), 0.88), (chunk("b.pdf"), 0.87)]
+
+
+def test_max_fusion_ranks_by_best_chunk():
+    groups = group_candidates(RANKED, limit=10, fusion="max")
+    assert [g.filename for g in groups] == ["a.pdf", "b.pdf", "c.pdf"]
+    assert [g.score for g in groups] == [0.95, 0.90, 0.88]
+    assert [len(g.hits) for g in groups] == [1, 3, 1]
+
+
+def test_rrf_fusion_rewards_several_strong_chunks():
+    groups = group_candidates(RANKED, limit=10, fusion="rrf")
+    assert [g.filename for g in groups] == ["b.pdf", "a.pdf", "c.pdf"]
+    assert groups[0].score == pytest.approx(1 / (RRF_K + 2) + 1 / (RRF_K + 3) + 1 / (RRF_K + 5))
+
+
+def test_limit_and_unknown_fusion():
+    assert [g.filename for g in group_candidates(RANKED, limit=2)] == ["a.pdf", "b.pdf"]
+    with pytest.raises(ValueError):
+        group_candidates(RANKED, limit=2, fusion="sum")
+
+
+def test_candidate_ids_are_stable():
+    first = group_candidates(RANKED, limit=10)
+    again = group_candidates(list(reversed(RANKED)), limit=10, fusion="rrf")
+    assert {g.filename: g.id for g in first} == {g.filename: g.id for g in again}
+    assert first[0].id == candidate_id("gs://cvs/a.pdf")
+    assert len({g.id for g in first}) == 3
+
+
+def test_count_candidates():
+    assert count_candidates(RANKED) == 3
+    assert count_candidates([]) == 0
+
+
+@pytest.mark.parametrize("fetched, distinct, wanted, max_k, expected", [
+    (30, 3, 10, 500, 120),   # 10 chunks per CV: 10 CVs need ~100, plus 20%
+    (30, 30, 10, 500, 12),   # one chunk per CV
+    (30, 0, 10, 500, 360),   # nothing distinct yet: assume every chunk was the same CV
+    (30, 3, 10, 50, 50),     # capped at max_k
+])
+def test_refetch_size(fetched, distinct, wanted, max_k, expected):
+    assert refetch_size(fetched, distinct, wanted, max_k) == expected
@@ -0,0 +1,108 @@
+# file: test_ingest_manifest.py
+import uuid
+
+from ingest_manifest import CHUNK_NAMESPACE, IngestManifest, chunk_id
+
+
+def ids(file_hash: str, n: int = 2) -> list:
+    return [chunk_id(file_hash, offset) for offset in range(0, 100 * n, 100)]
+
+
+def test_chunk_ids_are_deterministic_uuid5():
+    assert chunk_id("md5:abc", 0) == chunk_id("md5:abc", 0)
+    assert chunk_id("md5:abc", 0) != chunk_id("md5:abc", 100) != chunk_id("md5:abd", 100)
+    assert uuid.UUID(chunk_id("md5:abc", 0)) == uuid.uuid5(CHUNK_NAMESPACE, "md5:abc:0")
+
+
+def test_diff_unchanged_changed_removed(tmp_path):
+    manifest = IngestManifest(str(tmp_path / "manifest.json"))
+    manifest.record("a.pdf", "md5:a", ids("md5:a"))
+    manifest.record("b.pdf", "md5:b", ids("md5:b"))
+    manifest.record("c.pdf", "md5:c", ids("md5:c"))
+    changed, removed = manifest.diff({"a.pdf": "md5:a", "b.pdf": "md5:b2", "d.pdf": "md5:d"})
+    assert sorted(changed) == ["b.pdf", "d.pdf"]
+    assert removed == ["c.pdf"]
+    assert manifest.chunk_ids(changed + removed) == ids("md5:b") + ids("md5:c")
+
+
+def test_saved_manifest_round_trips(tmp_path):
+    path = str(tmp_path / "manifest.json")
+    manifest = IngestManifest(path)
+    manifest.record("a.pdf", "md5:a", ids("md5:a"), pages=2)
+    manifest.schedule_delete(["x"])
+    manifest.save()
+    again = IngestManifest(path)
+    assert again.entries == manifest.entries
+    assert again.pending_deletes == {"x"}
+    assert again.diff({"a.pdf": "md5:a"}) == ([], [])
+
+
+def test_identical_files_share_chunk_ids(tmp_path):
+    manifest = IngestManifest(str(tmp_path / "manifest.json"))
+    manifest.record("a.pdf", "md5:same", ids("md5:same"))
+    manifest.record("copy.pdf", "md5:same", ids("md5:same"))
+    manifest.schedule_delete(manifest.chunk_ids(["copy.pdf"]))
+    manifest.forget("copy.pdf")
+    # a.pdf still uses them
+    assert manifest.stale_ids() == []
+
+
+def _start_run(path: str, listing: dict):
+    """What ingest_cvs.py does before upserting anything."""
+    manifest = IngestManifest(path)
+    changed, removed = manifest.diff(listing)
+    manifest.schedule_delete(manifest.chunk_ids(changed + removed))
+    manifest.save()
+    return manifest, changed, removed
+
+
+def test_crash_before_recording_keeps_old_ids_pending(tmp_path):
+    path = str(tmp_path / "manifest.json")
+    manifest = IngestManifest(path)
+    manifest.record("a.pdf", "md5:a1", ids("md5:a1"))
+    manifest.save()
+
+    # Run 1 sees a new version of a.pdf and dies before a.pdf is recorded
+    _start_run(path, {"a.pdf": "md5:a2"})
+
+    # Run 2 resumes: a.pdf is still changed, its old chunks are still pending
+    manifest, changed, _ = _start_run(path, {"a.pdf": "md5:a2"})
+    assert changed == ["a.pdf"]
+    manifest.record("a.pdf", "md5:a2", ids("md5:a2"))
+    assert manifest.stale_ids() == sorted(ids("md5:a1"))
+    manifest.retain_deletes(manifest.chunk_ids(set(changed) - {"a.pdf"}))
+    manifest.save()
+    assert IngestManifest(path).pending_deletes == set()
+
+
+def test_crash_after_checkpoint_still_deletes_old_ids(tmp_path):
+    path = str(tmp_path / "manifest.json")
+    manifest = IngestManifest(path)
+    manifest.record("a.pdf", "md5:a1", ids("md5:a1"))
+    manifest.record("b.pdf", "md5:b", ids("md5:b"))
+    manifest.save()
+
+    # Run 1 re-ingests a.pdf and removes b.pdf, checkpoints a.pdf, then dies before deleting
+    manifest, _, _ = _start_run(path, {"a.pdf": "md5:a2"})
+    manifest.record("a.pdf", "md5:a2", ids("md5:a2"))
+    manifest.save()
+
+    # Run 2 has nothing new to ingest but still finds the orphaned chunks
+    manifest, changed, removed = _start_run(path, {"a.pdf": "md5:a2"})
+    assert (changed, removed) == ([], ["b.pdf"])
+    assert manifest.stale_ids() == sorted(ids("md5:a1"))
+    manifest.forget("b.pdf")
+    assert manifest.stale_ids() == sorted(ids("md5:a1") + ids("md5:b"))
+
+
+def test_failed_file_keeps_its_old_chunks_pending(tmp_path):
+    path = str(tmp_path / "manifest.json")
+    manifest = IngestManifest(path)
+    manifest.record("a.pdf", "md5:a1", ids("md5:a1"))
+    manifest.save()
+
+    manifest, changed, _ = _start_run(path, {"a.pdf": "md5:a2"})
+    # a.pdf failed: its old vectors stay live and are retried next run
+    assert manifest.stale_ids() == []
+    manifest.retain_deletes(manifest.chunk_ids(set(changed)))
+    assert manifest.pending_deletes == set(ids("md5:a1"))
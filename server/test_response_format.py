@@ -0,0 +1,79 @@
+# file: test_response_format.py
+import pytest
+
+from response_format import (ResultStore, SqliteResultStore, compact_card, decode_cursor, encode_cursor,
+                             merge_chunks, paginate)
+
+
+def cards(texts):
+    return [{"id": f"c{i}", "name": f"Candidate {i}", "text": text, "cvUrl": "", "role": "AI Candidate"}
+            for i, text in enumerate(texts)]
+
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor("abc123", 0)) == ("abc123", 0)
+    assert decode_cursor(encode_cursor("abc123", 40)) == ("abc123", 40)
+
+
+@pytest.mark.parametrize("cursor", ["", "abc", "abc.", ".10", "abc.-1", "abc.x1", "abc.1.5"])
+def test_bad_cursor_is_rejected(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+def test_pages_follow_their_cursors():
+    all_cards = cards(["a", "b", "c", "d", "e"])
+    seen, offset = [], 0
+    while True:
+        page = paginate(all_cards, False, offset, 2, "r1")
+        assert page["total"] == 5
+        seen.extend(card["id"] for card in page["content"])
+        if page["next_cursor"] is None:
+            break
+        result_id, offset = decode_cursor(page["next_cursor"])
+        assert result_id == "r1"
+    assert seen == [card["id"] for card in all_cards]
+    # Without a page size (or a stored result) everything comes at once
+    assert paginate(all_cards, False, 0, None, "r1")["next_cursor"] is None
+    assert paginate(all_cards, False, 0, 2, None)["next_cursor"] is None
+
+
+def test_compact_pages_send_each_snippet_once():
+    all_cards = cards(["same", "same", "other", "same", "third", "third"])
+    offset, cursor = 0, "start"
+    while cursor:
+        page = paginate(all_cards, True, offset, 4, "r1")
+        # Each page is self-contained: every index resolves within its own snippets, no repeats
+        assert len(page["snippets"]) == len(set(page["snippets"]))
+        for card, original in zip(page["content"], all_cards[offset:]):
+            assert "text" not in card
+            assert page["snippets"][card["snippet"]] == original["text"]
+        cursor = page["next_cursor"]
+        if cursor:
+            offset = decode_cursor(cursor)[1]
+    first = paginate(all_cards, True, 0, 4, "r1")
+    assert first["snippets"] == ["same", "other"]
+    assert paginate(all_cards, True, 4, 4, "r1")["snippets"] == ["third"]
+
+
+def test_compact_card_drops_constant_and_empty_fields():
+    assert compact_card(cards(["x"])[0]) == {"id": "c0", "name": "Candidate 0", "text": "x"}
+
+
+def test_merge_chunks_undoes_overlap():
+    text = "Jane Doe. Python developer with 7 years of experience."
+    chunks = [(20, text[20:]), (0, text[:30]), (10, text[10:35])]
+    assert merge_chunks(chunks) == text
+    # A gap (dropped whitespace) becomes a line break
+    assert merge_chunks([(0, "Skills"), (7, "Python")]) == "Skills\nPython"
+    assert merge_chunks([]) == ""
+
+
+@pytest.mark.parametrize("store", ["memory", "sqlite"])
+def test_result_store_round_trip(tmp_path, store):
+    results = ResultStore() if store == "memory" else SqliteResultStore(str(tmp_path / "results.sqlite"))
+    result_id = results.put(cards(["a"]), True)
+    assert results.get(result_id) == (cards(["a"]), True)
+    assert results.get("missing") is None
+    results.remember({"c0": "gs://cvs/a.pdf"})
+    assert results.source("c0") == "gs://cvs/a.pdf"
@@ -0,0 +1,87 @@
+# file: test_singleflight.py
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from singleflight import SingleFlight, messages_key, question_key
+
+
+def test_concurrent_identical_calls_share_one_upstream_call():
+    flights = SingleFlight("test")
+    calls = []
+
+    async def upstream():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "answer"
+
+    async def main():
+        same = await asyncio.gather(*(flights.do("q", upstream) for _ in range(5)))
+        other = await flights.do("other", upstream)
+        return same, other
+
+    same, other = asyncio.run(main())
+    assert same == ["answer"] * 5 and other == "answer"
+    assert len(calls) == 2
+    assert flights.stats()["leaders"] == 2 and flights.stats()["followers"] == 4
+    assert flights.stats()["in_flight"] == 0
+
+
+def test_calls_after_completion_run_again():
+    flights = SingleFlight("test")
+    calls = []
+
+    async def upstream():
+        calls.append(1)
+        return len(calls)
+
+    async def main():
+        return [await flights.do("q", upstream), await flights.do("q", upstream)]
+
+    assert asyncio.run(main()) == [1, 2]
+
+
+def test_cancelled_caller_does_not_cancel_the_shared_call():
+    flights = SingleFlight("test")
+    started = []
+
+    async def upstream():
+        started.append(1)
+        await asyncio.sleep(0.05)
+        return "answer"
+
+    async def main():
+        leader = asyncio.ensure_future(flights.do("q", upstream))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flights.do("q", upstream))
+        await asyncio.sleep(0.01)
+        leader.cancel()   # e.g. the leader's client disconnected
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(main()) == "answer"
+    assert len(started) == 1
+
+
+def test_followers_share_the_exception():
+    flights = SingleFlight("test")
+
+    async def upstream():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("quota exceeded")
+
+    async def main():
+        return await asyncio.gather(*(flights.do("q", upstream) for _ in range(3)), return_exceptions=True)
+
+    errors = asyncio.run(main())
+    assert all(isinstance(e, RuntimeError) for e in errors)
+    assert flights.stats()["in_flight"] == 0
+
+
+def test_keys():
+    assert question_key("  Python   DEVELOPERS\n") == question_key("python developers")
+    prompt = [SimpleNamespace(type="human", content="hi")]
+    assert messages_key(prompt) == messages_key(list(prompt))
+    assert messages_key(prompt) != messages_key([SimpleNamespace(type="ai", content="hi")])
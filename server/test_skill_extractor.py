@@ -0,0 +1,34 @@
+# file: test_skill_extractor.py
+import pytest
+
+from skill_extractor import SkillMatcher, extract_skills
+
+
+@pytest.mark.parametrize("text", [
+    "Willing to go the extra mile in R&D with Julia Roberts.",
+    "Express delivery of reports to the board.",
+    "Excel at communication with stakeholders.",
+    "Worked in Unity with the sales team.",
+])
+def test_everyday_words_are_not_skills(text):
+    assert extract_skills(text) == []
+
+
+def test_listed_aliases_still_match():
+    text = "Golang and R programming, Express.js APIs, Unity3D games, Microsoft Excel, Julia lang"
+    assert extract_skills(text) == ["Go", "R", "Express", "Unity", "Excel", "Julia"]
+
+
+def test_whole_words_and_longest_alias():
+    assert extract_skills("json parsing in node.js, c++ and c#") == ["Node", "C++", "C#"]
+
+
+def test_display_name_is_not_an_implicit_alias():
+    matcher = SkillMatcher({"Go": ["golang"]})
+    assert matcher.extract("go to market") == []
+    assert matcher.extract("golang services") == ["Go"]
+
+
+def test_filter_names_accept_display_names():
+    matcher = SkillMatcher({"Go": ["golang"], "Node": ["node.js"]})
+    assert [matcher.canonical(s) for s in ("go", "node.js", "Elm")] == ["Go", "Node", "Elm"]
@@ -0,0 +1,83 @@
+# file: test_upload_queue.py
+import asyncio
+import os
+
+import pytest
+
+from upload_queue import QueueFull, UploadQueue, multipart_boundary, receive_uploads
+
+BOUNDARY = b"----hirepal"
+
+
+def part(data: bytes, filename=None, name="files") -> bytes:
+    disposition = f'form-data; name="{name}"' + (f'; filename="{filename}"' if filename else "")
+    return (b"--" + BOUNDARY + b"\r\nContent-Disposition: " + disposition.encode()
+            + b"\r\nContent-Type: application/pdf\r\n\r\n" + data + b"\r\n")
+
+
+def body(*parts: bytes) -> bytes:
+    return b"".join(parts) + b"--" + BOUNDARY + b"--\r\n"
+
+
+def receive(data: bytes, tmp_path, piece: int = 1 << 16, max_bytes: int = 1 << 20, max_files: int = 10):
+    async def chunks():
+        for start in range(0, len(data), piece):
+            yield data[start:start + piece]
+    return asyncio.run(receive_uploads(chunks(), BOUNDARY, str(tmp_path), max_bytes, max_files))
+
+
+def test_boundary_from_content_type():
+    assert multipart_boundary('multipart/form-data; boundary="abc"') == b"abc"
+    assert multipart_boundary("multipart/form-data; charset=utf-8; boundary=x-1") == b"x-1"
+    assert multipart_boundary("application/json") is None
+    assert multipart_boundary("multipart/form-data") is None
+
+
+@pytest.mark.parametrize("piece", [1, 3, len(BOUNDARY) + 3, 1 << 16])
+def test_boundary_split_across_reads(tmp_path, piece):
+    # Content that looks like the start of a delimiter must stay in the file
+    pdf = b"%PDF-1.4\r\n--" + BOUNDARY[:-2] + b"\r\n" + bytes(range(256)) * 10
+    stored = receive(body(part(b"a note", name="note"), part(pdf, "cv.pdf")), tmp_path, piece)
+    assert [f["filename"] for f in stored] == ["cv.pdf"]
+    with open(stored[0]["path"], "rb") as f:
+        assert f.read() == pdf
+    assert os.path.basename(stored[0]["path"]) == stored[0]["content_hash"] + ".pdf"
+
+
+def test_per_file_size_limit_and_non_pdf(tmp_path):
+    stored = receive(body(part(b"%PDF" + b"x" * 200, "big.pdf"), part(b"hello", "cv.txt"),
+                          part(b"", "empty.pdf"), part(b"%PDF-ok", "ok.pdf")), tmp_path, max_bytes=100)
+    assert [f.get("error") for f in stored] == [
+        "File is larger than 100 bytes.", "Not a PDF file.", "Empty file.", None]
+    # Rejected files leave nothing behind
+    assert sorted(os.listdir(tmp_path)) == [stored[3]["content_hash"] + ".pdf"]
+
+
+def test_too_many_files(tmp_path):
+    stored = receive(body(*(part(b"%%PDF-%d" % i, f"{i}.pdf") for i in range(3))), tmp_path, max_files=2)
+    assert ["error" in f for f in stored] == [False, False, True]
+    assert stored[2]["error"] == "More than 2 files in one request."
+
+
+@pytest.mark.parametrize("data", [
+    part(b"%PDF-1.4", "cv.pdf"),                                   # no closing delimiter
+    b"--" + BOUNDARY + b"garbage\r\n\r\n%PDF--" + BOUNDARY + b"--",  # junk after a delimiter
+    b"--" + BOUNDARY + b"\r\n" + b"X-Header: y\r\n" * 2000,          # headers that never end
+])
+def test_malformed_body(tmp_path, data):
+    with pytest.raises(ValueError):
+        receive(data, tmp_path)
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".part")]
+
+
+def test_enqueue_is_bounded(tmp_path):
+    uploads = UploadQueue(str(tmp_path / "queue.sqlite"), max_pending=2)
+    uploads.enqueue("a.pdf", "/a", "a")
+    uploads.enqueue("b.pdf", "/b", "b")
+    with pytest.raises(QueueFull):
+        uploads.enqueue("c.pdf", "/c", "c")
+    assert uploads.pending() == 2
+    # Content that was already ingested is done at once and takes no room
+    uploads.finish(uploads.claim(1)[0]["id"], chunks=4)
+    uploads.enqueue("b.pdf", "/b", "b")
+    assert uploads.enqueue("a-again.pdf", "/a", "a")["state"] == "done"
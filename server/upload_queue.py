@@ -0,0 +1,498 @@
+# file: upload_queue.py
+"""
+CVs uploaded through POST /cvs: streamed to UPLOAD_DIR, queued in SQLite and ingested
+in the background by the same pipeline as ingest_cvs.py.
+
+The queue survives restarts (files claimed by a worker that died go back to "queued")
+and is bounded: once UPLOAD_MAX_PENDING files wait, uploads get a 429 before their body
+is read. The worker runs outside the API processes, one per machine: with
+"UPLOAD_WORKER": "process" serve.py starts it from its master process; by default
+("external") it is started separately, and "thread" runs it inside a single
+`uvicorn app:app` process (development only):
+
+    python upload_queue.py
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import signal
+import sqlite3
+import threading
+import time
+import uuid
+from multiprocessing import get_context
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from ingest_manifest import IngestManifest
+from ingest_pipeline import FileLock, index_writer_lock
+
+logger = logging.getLogger(__name__)
+
+STATES = ("queued", "processing", "done", "failed")
+MAX_ATTEMPTS = 3
+# A file still 'processing' after this long belongs to a worker that stopped
+STALE_SECONDS = 1800
+# Bytes buffered per file before they are written out
+_WRITE_SIZE = 1 << 20
+# Limit on one part's headers, so a malformed body can't grow the buffer without bound
+_MAX_HEADER_BYTES = 16 * 1024
+
+
+class QueueFull(Exception):
+    """The upload queue has no room; the client should retry later."""
+
+
+class UploadQueue:
+    """Persistent upload jobs, one row per file, shared by every process on the machine."""
+
+    def __init__(self, path: str = "uploads/queue.sqlite", max_pending: int = 5000):
+        self.path = path
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._pid = None
+        self._db()
+
+    @classmethod
+    def from_config(cls, config) -> "UploadQueue":
+        return cls(getattr(config, "UPLOAD_QUEUE_PATH", "uploads/queue.sqlite"),
+                   getattr(config, "UPLOAD_MAX_PENDING", 5000))
+
+    def _db(self) -> sqlite3.Connection:
+        # One connection per process (see SqliteSessionStore)
+        if self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS uploads ("
+                " id TEXT PRIMARY KEY, filename TEXT NOT NULL, path TEXT NOT NULL, content_hash TEXT NOT NULL,"
+                " state TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, chunks INTEGER, error TEXT,"
+                " created REAL NOT NULL, updated REAL NOT NULL)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS uploads_state ON uploads(state, created)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS uploads_hash ON uploads(content_hash, state)")
+            self._conn.commit()
+            self._pid = os.getpid()
+        return self._conn
+
+    def pending(self) -> int:
+        with self._lock:
+            return self._db().execute(
+                "SELECT COUNT(*) FROM uploads WHERE state IN ('queued', 'processing')").fetchone()[0]
+
+    def queued(self) -> bool:
+        """Whether any file waits to be claimed."""
+        with self._lock:
+            return self._db().execute("SELECT 1 FROM uploads WHERE state = 'queued' LIMIT 1").fetchone() is not None
+
+    def check_room(self, n: int = 1):
+        """Raise QueueFull unless `n` more files fit; a cheap early check before reading an upload."""
+        if self.pending() + n > self.max_pending:
+            raise QueueFull(f"{self.max_pending} uploads are already waiting.")
+
+    def enqueue(self, filename: str, path: str, content_hash: str) -> dict:
+        """
+        Queue a stored file; a file whose content was already ingested is done right away.
+        Raises QueueFull if UPLOAD_MAX_PENDING files already wait (checked in the same transaction).
+        """
+        now = time.time()
+        upload_id = uuid.uuid4().hex
+        with self._lock:
+            db = self._db()
+            db.execute("BEGIN IMMEDIATE")   # no other process can queue between the count and the insert
+            try:
+                done = db.execute("SELECT chunks FROM uploads WHERE content_hash = ? AND state = 'done' LIMIT 1",
+                                  (content_hash,)).fetchone()
+                state, chunks = ("done", done[0]) if done else ("queued", None)
+                if state == "queued" and db.execute(
+                        "SELECT COUNT(*) FROM uploads WHERE state IN ('queued', 'processing')"
+                ).fetchone()[0] >= self.max_pending:
+                    raise QueueFull(f"{self.max_pending} uploads are already waiting.")
+                db.execute("INSERT INTO uploads (id, filename, path, content_hash, state, chunks, created, updated)"
+                           " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                           (upload_id, filename, path, content_hash, state, chunks, now, now))
+                db.commit()
+            except BaseException:
+                db.rollback()
+                raise
+        return {"upload_id": upload_id, "filename": filename, "state": state}
+
+    def claim(self, limit: int) -> List[dict]:
+        """Mark up to `limit` of the oldest queued files as processing and return them."""
+        with self._lock:
+            db = self._db()
+            rows = db.execute("SELECT id, filename, path, content_hash FROM uploads WHERE state = 'queued'"
+                              " ORDER BY created LIMIT ?", (limit,)).fetchall()
+            db.executemany("UPDATE uploads SET state = 'processing', attempts = attempts + 1, updated = ?"
+                           " WHERE id = ? AND state = 'queued'", [(time.time(), r[0]) for r in rows])
+            db.commit()
+        return [dict(zip(("id", "filename", "path", "content_hash"), r)) for r in rows]
+
+    def finish(self, upload_id: str, chunks: int):
+        self._set(upload_id, "done", chunks=chunks, error=None)
+
+    def fail(self, upload_id: str, error: str):
+        """Retry later, or give up after MAX_ATTEMPTS."""
+        with self._lock:
+            db = self._db()
+            row = db.execute("SELECT attempts FROM uploads WHERE id = ?", (upload_id,)).fetchone()
+        state = "failed" if row is None or row[0] >= MAX_ATTEMPTS else "queued"
+        self._set(upload_id, state, error=error)
+
+    def _set(self, upload_id: str, state: str, **fields):
+        fields = dict(fields, state=state, updated=time.time())
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            db = self._db()
+            db.execute(f"UPDATE uploads SET {assignments} WHERE id = ?", (*fields.values(), upload_id))
+            db.commit()
+
+    def requeue_stale(self, older_than: float = STALE_SECONDS) -> int:
+        """Put files left 'processing' by a stopped worker back in the queue."""
+        with self._lock:
+            db = self._db()
+            cur = db.execute("UPDATE uploads SET state = 'queued' WHERE state = 'processing' AND updated < ?",
+                             (time.time() - older_than,))
+            db.commit()
+        return cur.rowcount
+
+    def status(self, upload_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._db().execute(
+                "SELECT id, filename, state, attempts, chunks, error, created, updated FROM uploads WHERE id = ?",
+                (upload_id,)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("upload_id", "filename", "state", "attempts", "chunks", "error", "created", "updated"), row))
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            counts = dict(self._db().execute("SELECT state, COUNT(*) FROM uploads GROUP BY state").fetchall())
+        return {state: counts.get(state, 0) for state in STATES}
+
+
+def multipart_boundary(content_type: str) -> Optional[bytes]:
+    """The boundary of a multipart/form-data Content-Type header, or None for any other type."""
+    kind, _, params = content_type.partition(";")
+    if kind.strip().lower() != "multipart/form-data":
+        return None
+    for param in params.split(";"):
+        name, _, value = param.strip().partition("=")
+        if name.lower() == "boundary" and value:
+            return value.strip('"').encode("latin-1")
+    return None
+
+
+def _part_filename(headers: bytes) -> Optional[str]:
+    # Content-Disposition: form-data; name="files"; filename="cv.pdf"
+    for line in headers.decode("utf-8", "replace").split("\r\n"):
+        name, _, value = line.partition(":")
+        if name.strip().lower() != "content-disposition":
+            continue
+        for param in value.split(";"):
+            key, _, val = param.strip().partition("=")
+            if key.lower() == "filename":
+                return os.path.basename(val.strip('"').replace("\\", "/")) or "upload.pdf"
+    return None
+
+
+class _StoredFile:
+    """One uploaded file on its way to `upload_dir/<sha256>.pdf`: checked and hashed as it arrives."""
+
+    def __init__(self, filename: str, upload_dir: str, max_bytes: int):
+        self.filename = filename
+        self.upload_dir = upload_dir
+        self.max_bytes = max_bytes
+        self.tmp = os.path.join(upload_dir, f".{uuid.uuid4().hex}.part")
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.head = b""
+        self.error = None
+        self._out = None
+
+    def check(self, data: bytes) -> bool:
+        """Account for the next piece of the file; False once the file is rejected."""
+        if self.error:
+            return False
+        if len(self.head) < 4:
+            self.head += data[:4 - len(self.head)]
+            if not b"%PDF".startswith(self.head):
+                self.error = "Not a PDF file."
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            self.error = f"File is larger than {self.max_bytes} bytes."
+        if self.error:
+            return False
+        self.digest.update(data)
+        return True
+
+    def write(self, data: bytes):
+        if self._out is None:
+            os.makedirs(self.upload_dir, exist_ok=True)
+            self._out = open(self.tmp, "wb")
+        self._out.write(data)
+
+    def close(self) -> dict:
+        """Move the finished file into place (same content, same file); a dict with path and hash, or error."""
+        if self._out is not None:
+            self._out.close()
+        if not self.error and self.head != b"%PDF":
+            self.error = "Empty file." if not self.size else "Not a PDF file."
+        if self.error:
+            self.discard()
+            return {"filename": self.filename, "error": self.error}
+        content_hash = self.digest.hexdigest()
+        path = os.path.join(self.upload_dir, f"{content_hash}.pdf")
+        os.replace(self.tmp, path)
+        return {"filename": self.filename, "path": path, "content_hash": content_hash}
+
+    def discard(self):
+        if self._out is not None and not self._out.closed:
+            self._out.close()
+        if os.path.exists(self.tmp):
+            os.remove(self.tmp)
+
+
+async def receive_uploads(chunks: AsyncIterator[bytes], boundary: bytes, upload_dir: str,
+                          max_bytes: int, max_files: int) -> List[dict]:
+    """
+    Stream a multipart/form-data body to disk without holding it in memory. Every file part
+    gives a dict with its path and sha256, or an error (not a PDF, too large, too many files);
+    other form fields are skipped. Raises ValueError for a malformed body.
+    """
+    loop = asyncio.get_running_loop()
+    delimiter = b"\r\n--" + boundary
+    keep = len(delimiter) - 1   # a delimiter may straddle two chunks
+    buf = b"\r\n"              # the first boundary has no preceding line break
+    state = "preamble"
+    results: List[dict] = []
+    current: Optional[_StoredFile] = None
+    pending = bytearray()
+
+    async def flush(sink: _StoredFile):
+        # File writes run off the event loop, a megabyte at a time
+        if pending and not sink.error:
+            await loop.run_in_executor(None, sink.write, bytes(pending))
+        pending.clear()
+
+    async def feed(data: bytes):
+        if current is not None and data and current.check(data):
+            pending.extend(data)
+            if len(pending) >= _WRITE_SIZE:
+                await flush(current)
+
+    try:
+        async for chunk in chunks:
+            buf += chunk
+            while True:
+                if state in ("preamble", "body"):
+                    at = buf.find(delimiter)
+                    if at < 0:
+                        if state == "body":
+                            await feed(buf[:max(0, len(buf) - keep)])
+                        buf = buf[max(0, len(buf) - keep):]
+                        break
+                    if state == "body":
+                        await feed(buf[:at])
+                        if current is not None:
+                            await flush(current)
+                            results.append(await loop.run_in_executor(None, current.close))
+                            current = None
+                    buf = buf[at + len(delimiter):]
+                    state = "boundary"
+                elif state == "boundary":
+                    if len(buf) < 2:
+                        break
+                    if buf.startswith(b"--"):
+                        state = "end"
+                        break
+                    end = buf.find(b"\r\n")
+                    if end < 0:
+                        if len(buf) > _MAX_HEADER_BYTES:
+                            raise ValueError("Malformed multipart body.")
+                        break
+                    if buf[:end].strip(b" \t"):
+                        raise ValueError("Malformed multipart body.")
+                    buf = buf[end + 2:]
+                    state = "headers"
+                elif state == "headers":
+                    end = buf.find(b"\r\n\r\n")
+                    if end < 0:
+                        if len(buf) > _MAX_HEADER_BYTES:
+                            raise ValueError("Multipart headers are too large.")
+                        break
+                    filename = _part_filename(buf[:end])
+                    buf = buf[end + 4:]
+                    state = "body"
+                    if filename is None:
+                        continue   # a plain form field: skip its value
+                    current = _StoredFile(filename, upload_dir, max_bytes)
+                    if len(results) >= max_files:
+                        current.error = f"More than {max_files} files in one request."
+                else:
+                    break
+            if state == "end":
+                break
+        if state != "end":
+            raise ValueError("Incomplete multipart body.")
+    except BaseException:
+        if current is not None:
+            current.discard()
+        raise
+    return results
+
+
+class UploadWorker:
+    """
+    Drains the upload queue through the ingestion pipeline. Each session takes the index
+    writer lock (shared with ingest_cvs.py), reopens the indexes so it builds on whatever
+    was published last, ingests batches of up to `batch_files` files (so chunks of many small
+    uploads share embedding calls and upserts) for at most `publish_seconds`, then publishes
+    the vector store, side indexes and manifest once. Files are marked done only after that.
+    Only one worker per machine runs: the others wait on a file lock next to the queue.
+    """
+
+    def __init__(self, config, uploads: UploadQueue, batch_files: int = 64, idle_wait: float = 2.0,
+                 publish_seconds: float = 60.0):
+        self.config = config
+        self.uploads = uploads
+        self.batch_files = batch_files
+        self.idle_wait = idle_wait
+        self.publish_seconds = publish_seconds
+        self._stop = threading.Event()
+        self._thread = None
+        self._embeddings = None
+
+    @classmethod
+    def from_config(cls, config, uploads: UploadQueue) -> "UploadWorker":
+        return cls(config, uploads, getattr(config, "UPLOAD_BATCH_FILES", 64),
+                   publish_seconds=getattr(config, "UPLOAD_PUBLISH_SECONDS", 60))
+
+    def _open_clients(self):
+        """Embeddings are kept; the indexes are opened fresh (under the writer lock) every session."""
+        from attribute_index import AttributeIndex
+        from bm25_index import BM25Index
+        from embedding_cache import EmbeddingCache
+        from vector_backends import create_embeddings, create_vector_backend
+        if self._embeddings is None:
+            self._embeddings = create_embeddings(self.config, EmbeddingCache.from_config(self.config))
+        return (self._embeddings,
+                create_vector_backend(self.config, embeddings=self._embeddings, writable=True),
+                BM25Index.from_config(self.config), AttributeIndex.from_config(self.config))
+
+    def process(self, jobs: List[dict], clients) -> Tuple[Dict[str, int], Dict[str, str]]:
+        """Ingest one batch of claimed uploads; returns ({id: chunks} ingested, {id: error} failed)."""
+        from ingest_pipeline import IngestItem, cv_pipeline
+        emb, vector_store, lexical, attributes = clients
+        done: Dict[str, int] = {}
+
+        def on_file_done(item, ids):
+            attributes.put({item.metadata["gcs_uri"]: {k: v for k, v in item.metadata.items()
+                                                       if k.startswith("cv_")}})
+            done[item.name] = len(ids)
+
+        def upsert(texts, vectors, metadatas, ids):
+            vector_store.add(texts, vectors, metadatas, ids)
+            lexical.add(ids, texts, metadatas)
+
+        def reader(path):
+            def fetch():
+                with open(path, "rb") as f:
+                    return f.read()
+            return fetch
+
+        items = [IngestItem(
+            name=job["id"],
+            content_hash=job["content_hash"],
+            fetch=reader(job["path"]),
+            metadata={"gcs_uri": f"upload://{job['content_hash']}", "filename": job["filename"],
+                      "content_hash": job["content_hash"]},
+        ) for job in jobs]
+        pipeline = cv_pipeline(
+            emb.embed_documents, upsert, on_file_done=on_file_done,
+            download_workers=2,
+            extract_workers=getattr(self.config, "UPLOAD_EXTRACT_WORKERS", 2),
+            batch_size=getattr(self.config, "INGEST_UPSERT_BATCH_SIZE", 256),
+            report_every=3600,
+            mp_context=get_context("spawn"),   # don't fork a threaded server process
+        )
+        error = "Could not read the PDF."
+        try:
+            pipeline.run(items)
+        except Exception as e:
+            error = str(e)
+            logger.exception("Upload batch failed")
+        failed = {job["id"]: error for job in jobs if job["id"] not in done}
+        return done, failed
+
+    def session(self) -> int:
+        """Ingest queued files under the writer lock and publish them once; returns how many were claimed."""
+        if not self.uploads.queued():
+            return 0
+        lock = index_writer_lock(self.config)
+        if not lock.acquire(stop=self._stop):
+            return 0
+        claimed: Dict[str, dict] = {}
+        done: Dict[str, int] = {}
+        try:
+            clients = self._open_clients()
+            deadline = time.monotonic() + self.publish_seconds
+            while not self._stop.is_set() and time.monotonic() < deadline:
+                jobs = self.uploads.claim(self.batch_files)
+                if not jobs:
+                    break
+                claimed.update((job["id"], job) for job in jobs)
+                ingested, failed = self.process(jobs, clients)
+                done.update(ingested)
+                for upload_id, error in failed.items():
+                    self.uploads.fail(upload_id, error)
+                    claimed.pop(upload_id)
+            if done:
+                # Readers pick the new files up on their next search; the manifest write
+                # bumps the retrieval cache generation
+                _, vector_store, lexical, attributes = clients
+                vector_store.save()
+                lexical.compile()
+                attributes.compile()
+                IngestManifest(getattr(self.config, "INGEST_MANIFEST_PATH", "ingest_manifest.json")).save()
+        except Exception as e:
+            logger.exception("Upload worker failed")
+            for upload_id in claimed:
+                self.uploads.fail(upload_id, f"Ingestion failed: {e}")
+            return len(claimed)
+        finally:
+            lock.release()
+        for upload_id, chunks in done.items():
+            self.uploads.finish(upload_id, chunks)
+        return len(claimed)
+
+    def run(self):
+        """Run sessions until stopped (waits `idle_wait` seconds when the queue is empty)."""
+        worker_lock = FileLock(f"{self.uploads.path}.worker.lock")
+        if not worker_lock.acquire(poll=self.idle_wait * 15, stop=self._stop):
+            return
+        try:
+            self.uploads.requeue_stale(older_than=0)   # we hold the lock, so nobody else is processing
+            while not self._stop.is_set():
+                if not self.session():
+                    self._stop.wait(self.idle_wait)
+        finally:
+            worker_lock.release()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name="upload-worker", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+
+if __name__ == "__main__":
+    from config_manager import ConfigManager
+    logging.basicConfig(level="INFO", format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    config = ConfigManager()
+    worker = UploadWorker.from_config(config, UploadQueue.from_config(config))
+    # serve.py stops its child worker with SIGTERM: finish and publish the current batch first
+    signal.signal(signal.SIGTERM, lambda *_: worker.stop())
+    worker.run()
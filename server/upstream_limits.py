@@ -0,0 +1,29 @@
+# file: upstream_limits.py
+import asyncio
+from typing import Dict
+
+
+class UpstreamLimits:
+    """
+    Named asyncio semaphores, one per upstream service (embedding, vector search, LLM).
+    Semaphores are created on first use so they bind to the running event loop.
+
+        async with limits("llm"):
+            resp = await llm.ainvoke(msgs)
+    """
+
+    def __init__(self, limits: Dict[str, int]):
+        self.limits = dict(limits)
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+
+    def __call__(self, name: str) -> asyncio.Semaphore:
+        sem = self._semaphores.get(name)
+        if sem is None:
+            sem = self._semaphores[name] = asyncio.Semaphore(self.limits[name])
+        return sem
+
+    def stats(self) -> Dict[str, dict]:
+        """Configured limit and free slots per upstream."""
+        return {name: {"limit": limit,
+                       "available": self._semaphores[name]._value if name in self._semaphores else limit}
+                for name, limit in self.limits.items()}
@@ -0,0 +1,205 @@
+# file: vector_backends.py
+import asyncio
+import os
+import threading
+import uuid
+from functools import partial
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from attribute_index import AttributeFilter, filter_results, vertex_filters
+
+# Existing Vertex AI Vector Search deployment (override in config.json)
+DEFAULT_INDEX_ID = "3037589987731177472"
+DEFAULT_ENDPOINT_ID = "7123093721570082816"
+DEFAULT_BUCKET = "cv-rag-west-4"
+LOCAL_EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+
+
+class VectorBackend:
+    """
+    Where chunk vectors live: add / delete / search, with chunk text and metadata.
+    IDs are the deterministic chunk IDs from ingest_manifest.chunk_id; search returns
+    LangChain (Document, score) pairs, best first, like a LangChain vector store. Scores are
+    similarities (higher is better) whichever backend is used.
+    """
+
+    def add(self, texts: Sequence[str], vectors: Sequence[Sequence[float]],
+            metadatas: Sequence[dict], ids: Sequence[str]):
+        raise NotImplementedError
+
+    def delete(self, ids: Sequence[str]):
+        raise NotImplementedError
+
+    def search(self, vector, k: int, flt: Optional[AttributeFilter] = None) -> List[Tuple[object, float]]:
+        raise NotImplementedError
+
+    async def asearch(self, vector, k: int, flt: Optional[AttributeFilter] = None) -> list:
+        return await asyncio.get_running_loop().run_in_executor(None, partial(self.search, vector, k, flt))
+
+    def save(self):
+        """Publish pending writes (a no-op for backends that write through)."""
+
+
+class VertexBackend(VectorBackend):
+    """Vertex AI Vector Search through LangChain's VectorSearchVectorStore."""
+
+    def __init__(self, store, attribute_index=None):
+        self.store = store
+        self.attribute_index = attribute_index  # picks the most selective skill restrict
+
+    def add(self, texts, vectors, metadatas, ids):
+        self.store.add_texts_with_embeddings(texts=texts, embeddings=vectors, metadatas=metadatas, ids=ids)
+
+    def delete(self, ids):
+        self.store.delete(ids=list(ids))
+
+    def search(self, vector, k, flt=None):
+        restricts = vertex_filters(flt, self.attribute_index) if flt else {}
+        return filter_results(self.store.similarity_search_by_vector_with_score(vector, k=k, **restricts), flt)
+
+    async def asearch(self, vector, k, flt=None):
+        if not hasattr(self.store, "asimilarity_search_by_vector_with_score"):
+            return await super().asearch(vector, k, flt)
+        restricts = vertex_filters(flt, self.attribute_index) if flt else {}
+        return filter_results(
+            await self.store.asimilarity_search_by_vector_with_score(vector, k=k, **restricts), flt)
+
+
+def faiss_id(chunk_id: str) -> int:
+    """Stable int64 FAISS ID for a chunk ID (the low 63 bits of its UUID)."""
+    return uuid.UUID(chunk_id).int & (2 ** 63 - 1)
+
+
+class FaissBackend(VectorBackend):
+    """
+    Local FAISS index plus SQLite sidecar (faiss_store.FaissStore, as in cv_search.py).
+    The ingest process opens it writable and publishes with `save()`; API workers open it
+    read-only and memory-mapped and pick up new versions on the next search.
+    Attribute filters are applied to the results, widening k until enough chunks pass.
+    Chunks arrive a batch at a time, so the writer only supports an exact flat index: IVF/PQ
+    would be trained on the first batch and never again, and HNSW can't delete.
+    """
+
+    def __init__(self, path: str = "chunk_index", index_type: str = "flat", writable: bool = False):
+        if writable and index_type != "flat":
+            raise ValueError(f"FAISS_INDEX_TYPE '{index_type}' can't be built incrementally; "
+                             f"the chunk index needs 'flat'")
+        self.path = path
+        self.index_type = index_type
+        self.writable = writable
+        self._store = None
+        self._lock = threading.Lock()
+
+    def _get_store(self):
+        from faiss_store import FaissStore
+        if self._store is None:
+            with self._lock:
+                if self._store is None and os.path.exists(f"{self.path}.faiss"):
+                    store = FaissStore.open(self.path, mmap=not self.writable, writable=self.writable)
+                    if self.writable and not store.is_flat:
+                        raise ValueError(f"{self.path}.faiss is not a flat index; delete it and re-ingest")
+                    self._store = store
+        elif not self.writable:
+            self._store.reload_if_changed()
+        return self._store
+
+    def add(self, texts, vectors, metadatas, ids):
+        from faiss_store import FaissStore
+        int_ids = [faiss_id(i) for i in ids]
+        records = [{"chunk_id": i, "text": t, "metadata": m} for i, t, m in zip(ids, texts, metadatas)]
+        vectors = np.asarray(vectors, dtype=np.float32)
+        store = self._get_store()
+        with self._lock:
+            if store is None:
+                self._store = FaissStore.build(self.path, vectors, records, ids=int_ids,
+                                               index_type=self.index_type)
+                return
+        # Upsert: drop the vectors already stored under these IDs first
+        existing = list(store.records(int_ids))
+        if existing:
+            store.remove(existing)
+        store.add(vectors, records, ids=int_ids)
+
+    def delete(self, ids):
+        store = self._get_store()
+        if store is not None:
+            store.remove([faiss_id(i) for i in ids])
+
+    def save(self):
+        if self._store is not None:
+            self._store.save()
+
+    def search(self, vector, k, flt=None):
+        from langchain_core.documents import Document
+        store = self._get_store()
+        if store is None or store.ntotal == 0:
+            return []
+        query = np.asarray(vector, dtype=np.float32)[None, :]
+        fetch = k if flt is None else k * 4
+        while True:
+            distances, indices = store.search(query, min(fetch, store.ntotal))
+            records = store.records(indices[0])
+            # Squared L2 distance -> cosine similarity for unit-length embeddings (text-embedding-005,
+            # all-MiniLM-L6-v2); higher is better, on the same scale as Vertex's dot-product scores
+            results = [(Document(page_content=records[i]["text"],
+                                 metadata=dict(records[i]["metadata"], chunk_id=records[i]["chunk_id"])),
+                        1.0 - float(d) / 2)
+                       for i, d in zip(indices[0].tolist(), distances[0].tolist()) if i in records]
+            results = filter_results(results, flt)
+            if len(results) >= k or fetch >= store.ntotal:
+                return results[:k]
+            fetch *= 4
+
+
+def create_vector_backend(config, embeddings=None, attribute_index=None, writable: bool = False) -> VectorBackend:
+    """Pick the backend from config.json ("VECTOR_BACKEND": "vertex" or "faiss")."""
+    backend = getattr(config, "VECTOR_BACKEND", "vertex")
+    if backend == "faiss":
+        return FaissBackend(getattr(config, "FAISS_INDEX_PATH", "chunk_index"),
+                            getattr(config, "FAISS_INDEX_TYPE", "flat"), writable=writable)
+    if backend == "vertex":
+        from google.cloud import aiplatform
+        from langchain_google_vertexai.vectorstores import VectorSearchVectorStore
+        aiplatform.init(project=config.PROJECT_ID, location=config.REGION)
+        store = VectorSearchVectorStore.from_components(
+            embedding=embeddings,
+            index_id=getattr(config, "VERTEX_INDEX_ID", DEFAULT_INDEX_ID),
+            endpoint_id=getattr(config, "VERTEX_ENDPOINT_ID", DEFAULT_ENDPOINT_ID),
+            gcs_bucket_name=getattr(config, "VERTEX_STAGING_BUCKET", DEFAULT_BUCKET),
+            project_id=config.PROJECT_ID,
+            region=config.REGION,
+        )
+        return VertexBackend(store, attribute_index)
+    raise ValueError(f"Unknown VECTOR_BACKEND '{backend}', expected 'vertex' or 'faiss'")
+
+
+def create_embeddings(config, cache=None):
+    """
+    Pick the embedding model from config.json ("EMBEDDING_BACKEND": "vertex" or "local"),
+    behind the embedding cache. Must match the model the index was built with.
+    """
+    from embedding_cache import CachedEmbeddings
+    backend = getattr(config, "EMBEDDING_BACKEND", "vertex")
+    if backend == "local":
+        from sentence_transformers import SentenceTransformer
+        model_name = getattr(config, "LOCAL_EMBEDDING_MODEL", LOCAL_EMBEDDING_MODEL)
+        model = SentenceTransformer(model_name)
+        return CachedEmbeddings(model, model_name=model_name,
+                                dimensions=model.get_sentence_embedding_dimension(), cache=cache)
+    if backend == "vertex":
+        from google.cloud import aiplatform
+        from langchain_google_vertexai import VertexAIEmbeddings
+        aiplatform.init(project=config.PROJECT_ID, location=config.REGION)
+        return CachedEmbeddings(
+            VertexAIEmbeddings(
+                model_name="text-embedding-005",  # or "gemini-embedding-001"
+                project=config.PROJECT_ID,
+                location=config.REGION,
+            ),
+            model_name="text-embedding-005",
+            dimensions=config.DIMENSIONS,
+            cache=cache,
+        )
+    raise ValueError(f"Unknown EMBEDDING_BACKEND '{backend}', expected 'vertex' or 'local'")